@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the QuickMin calculations, and comparison against a baseline.
+
+The molecules are generated once, with `generate`, and checked in to
+benchmarks/molecules so that every run times exactly the same structures. They
+range from methyl acetate, with 11 atoms, to a chain of 2000 alanines with 20007
+atoms. Each forcefield is timed setting up, calculating the energy and gradients,
+extracting the gradients and taking 20 steps of conjugate gradients, along with
+choosing the "best available" forcefield and the RMSDs that the step calculates::
+
+    python benchmarks/benchmark.py run -o results.json
+    python benchmarks/benchmark.py compare benchmarks/baseline.json results.json
+
+`memory` runs the whole QuickMin step on each molecule in a fresh process, and
+records the peak resident memory after each phase of the step, and the peak memory
+allocated by Python during each phase, traced in a second run with tracemalloc::
+
+    python benchmarks/benchmark.py memory -o memory.json
+    python benchmarks/benchmark.py compare benchmarks/memory-baseline.json memory.json
+
+`compare` lists the benchmarks that are worse than the baseline by more than the
+tolerance and exits with an error if there are any.
+
+OpenBabel sets up the forcefields with every pair of atoms, so the time and memory
+grow quadratically; 3000 atoms takes about 25 s and 2 GB. By default the forcefield
+benchmarks stop at 1500 atoms and the RMSDs at 6000, which `--max-atoms` overrides.
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from openbabel import openbabel
+
+import molsystem
+from quickmin_step import forcefield
+
+directory = Path(__file__).resolve().parent / "molecules"
+
+# The molecules as SMILES, which are built into 3-D structures
+molecules = {
+    "methyl-acetate": "CC(=O)OC",
+    "alanine-10": "N" + "C(C)C(=O)N" * 10 + "C",
+    "alanine-100": "N" + "C(C)C(=O)N" * 100 + "C",
+    "alanine-500": "N" + "C(C)C(=O)N" * 500 + "C",
+    "alanine-2000": "N" + "C(C)C(=O)N" * 2000 + "C",
+}
+
+forcefields = ("MMFF94", "MMFF94s", "GAFF", "UFF", "Ghemical")
+
+# The largest molecule, in atoms, for each benchmark by default
+limits = {
+    "setup": 1500,
+    "single-point energy": 1500,
+    "gradients": 1500,
+    "optimization": 1500,
+    "best available": 1500,
+    "RMSD": 6000,
+    "memory": 1500,
+}
+
+# Differences smaller than these are noise
+floors = {"s": 0.001, "MiB": 1.0}
+
+
+def generate():
+    """Build the molecules and write them to benchmarks/molecules."""
+    directory.mkdir(exist_ok=True)
+    for name, smiles in molecules.items():
+        obmol = forcefield.obmol_from_text(smiles, "smi")
+        obmol.AddHydrogens()
+        openbabel.OBBuilder().Build(obmol)
+        text = forcefield.obmol_to_text(obmol, "mol2")
+        path = directory / f"{name}.mol2.gz"
+        # No timestamp, so the file only changes if the structure does
+        path.write_bytes(gzip.compress(text.encode(), mtime=0))
+        print(f"{name:>16s}: {obmol.NumAtoms()} atoms")
+
+
+def read_molecule(name):
+    """The molecule from benchmarks/molecules."""
+    text = gzip.decompress((directory / f"{name}.mol2.gz").read_bytes()).decode()
+    return forcefield.obmol_from_text(text, "mol2")
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Discard the OpenBabel log, which goes straight to stderr."""
+    sys.stderr.flush()
+    saved = os.dup(2)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 2)
+    try:
+        yield
+    finally:
+        os.dup2(saved, 2)
+        os.close(saved)
+        os.close(devnull)
+
+
+def _invalidate(ff_names):
+    """Set up the forcefields for methane, so the next setup is not skipped.
+
+    OpenBabel keeps the setup of the last molecule, and quietly reuses it if asked
+    to set up the same molecule again.
+    """
+    methane = forcefield.obmol_from_text("C", "smi")
+    methane.AddHydrogens()
+    for ff_name in ff_names:
+        forcefield.setup_forcefield(methane, ff_name, log_level=0)
+
+
+def bench_setup(obmol, ff_name):
+    """Setting up the forcefield."""
+    _invalidate((ff_name,))
+    t0 = time.perf_counter()
+    forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+    return time.perf_counter() - t0
+
+
+def bench_single_point(obmol, ff_name):
+    """A single-point energy and gradients, as the step does, including setup."""
+    _invalidate((ff_name,))
+    t0 = time.perf_counter()
+    forcefield.calculate(obmol, ff_name, "single-point energy")
+    return time.perf_counter() - t0
+
+
+def bench_gradients(obmol, ff_name):
+    """Extracting the gradients after the energy."""
+    obFF, _ = forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+    obFF.Energy(True)
+    t0 = time.perf_counter()
+    forcefield.get_gradients(obFF, obmol)
+    return time.perf_counter() - t0
+
+
+def bench_optimization(obmol, ff_name):
+    """20 steps of conjugate gradients, excluding the setup."""
+    obFF, _ = forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+    obFF.SetCoordinates(obmol)
+    t0 = time.perf_counter()
+    obFF.ConjugateGradients(20)
+    return time.perf_counter() - t0
+
+
+def bench_best_available(obmol, ff_name=None):
+    """Choosing and setting up the best available forcefield."""
+    _invalidate(forcefield.best_available)
+    t0 = time.perf_counter()
+    forcefield.setup_forcefield(obmol, "best available", log_level=0)
+    return time.perf_counter() - t0
+
+
+def bench_rmsd(obmol, ff_name=None):
+    """The RMSDs with and without hydrogens that the step reports."""
+    rng = np.random.default_rng(7)
+    xyz = forcefield.get_coordinates(obmol)
+    displaced = openbabel.OBMol(obmol)
+    forcefield.set_coordinates(displaced, xyz + rng.normal(scale=0.05, size=xyz.shape))
+    t0 = time.perf_counter()
+    molsystem.RMSD(displaced, obmol, symmetry=True, align=True)
+    molsystem.RMSD(displaced, obmol, symmetry=True, include_h=True)
+    return time.perf_counter() - t0
+
+
+benchmarks = {
+    "setup": (bench_setup, True),
+    "single-point energy": (bench_single_point, True),
+    "gradients": (bench_gradients, True),
+    "optimization": (bench_optimization, True),
+    "best available": (bench_best_available, False),
+    "RMSD": (bench_rmsd, False),
+}
+
+
+def metadata():
+    """A description of the machine and software."""
+    return {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "openbabel": openbabel.OBReleaseVersion(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(
+    names=None,
+    repeats=5,
+    max_atoms=None,
+    selected=None,
+    ff_names=None,
+    max_time=5.0,
+):
+    """Run the benchmarks.
+
+    Parameters
+    ----------
+    names : [str] = None
+        The molecules, by default all.
+    repeats : int = 5
+        The number of times to run each benchmark.
+    max_atoms : int = None
+        The largest molecule for any benchmark, instead of the default limits.
+    selected : [str] = None
+        The benchmarks to run, by default all.
+    ff_names : [str] = None
+        The forcefields, by default all.
+    max_time : float = 5.0
+        Stop repeating a benchmark once it has taken this many seconds in total.
+
+    Returns
+    -------
+    dict
+        The "metadata" and the "results", keyed by benchmark/forcefield/molecule,
+        with the "min" and "median" time in seconds.
+    """
+    names = list(molecules) if names is None else names
+    selected = list(benchmarks) if selected is None else selected
+    ff_names = forcefields if ff_names is None else ff_names
+
+    results = {}
+    for name in names:
+        obmol = read_molecule(name)
+        n_atoms = obmol.NumAtoms()
+        for benchmark in selected:
+            function, per_forcefield = benchmarks[benchmark]
+            limit = limits[benchmark] if max_atoms is None else max_atoms
+            if n_atoms > limit:
+                continue
+            for ff_name in ff_names if per_forcefield else ("-",):
+                key = f"{benchmark}/{ff_name}/{name}"
+                times = []
+                try:
+                    with _quiet():
+                        while len(times) < repeats and sum(times) < max_time:
+                            times.append(function(obmol, ff_name))
+                except RuntimeError as e:
+                    print(f"{key:>50s}: skipped, {e}")
+                    continue
+                results[key] = {
+                    "atoms": n_atoms,
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "repeats": len(times),
+                }
+                print(f"{key:>50s}: {min(times):10.6f} s", flush=True)
+
+    return {"metadata": metadata(), "results": results}
+
+
+def run_step(name, output, trace=False, ff_name="best available", n_steps=20):
+    """Run the QuickMin step on a molecule, saving the memory used to a file.
+
+    This is run in a fresh process for each molecule, since the peak resident
+    memory of a process never goes down.
+
+    Parameters
+    ----------
+    name : str
+        The molecule.
+    output : str or pathlib.Path
+        The JSON file for the "memory" and "timings" from Results.json.
+    trace : bool = False
+        Whether to trace the memory allocated by Python with tracemalloc.
+    ff_name : str = "best available"
+        The forcefield.
+    n_steps : int = 20
+        The number of steps of minimization.
+    """
+    import seamm
+    import quickmin_step
+
+    if trace:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        flowchart = seamm.Flowchart(directory=tmp)
+        db = molsystem.SystemDB(filename="file:seamm_db?mode=memory&cache=shared")
+        seamm.flowchart_variables = seamm.Variables()
+        seamm.flowchart_variables.set_variable("_system_db", db)
+        configuration = db.create_system().create_configuration()
+        configuration.from_OBMol(read_molecule(name))
+
+        node = quickmin_step.QuickMin(flowchart=flowchart)
+        flowchart.add_node(node)
+        node._id = ("1",)
+        node.parameters["forcefield"].value = ff_name
+        node.parameters["n_steps"].value = n_steps
+        with _quiet():
+            node.run()
+        results = json.loads((Path(node.directory) / "Results.json").read_text())
+    Path(output).write_text(json.dumps(results))
+
+
+def memory(names=None, max_atoms=None, ff_name="best available", n_steps=20):
+    """Measure the memory used by the phases of the QuickMin step.
+
+    Parameters
+    ----------
+    names : [str] = None
+        The molecules, by default all.
+    max_atoms : int = None
+        The largest molecule, instead of the default limit.
+    ff_name : str = "best available"
+        The forcefield.
+    n_steps : int = 20
+        The number of steps of minimization.
+
+    Returns
+    -------
+    dict
+        The "metadata" and the "results", keyed by measure/phase/molecule, with the
+        "peak" memory in MiB.
+    """
+    names = list(molecules) if names is None else names
+    limit = limits["memory"] if max_atoms is None else max_atoms
+
+    results = {}
+    for name in names:
+        n_atoms = read_molecule(name).NumAtoms()
+        if n_atoms > limit:
+            continue
+        for trace in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                output = Path(tmp) / "memory.json"
+                command = [
+                    sys.executable,
+                    __file__,
+                    "step",
+                    name,
+                    str(output),
+                    "--forcefield",
+                    ff_name,
+                    "--steps",
+                    str(n_steps),
+                ]
+                if trace:
+                    command.append("--trace")
+                subprocess.run(command, check=True)
+                data = json.loads(output.read_text())["memory"]
+            if trace:
+                measure, peaks = "traced peak", data["traced peaks"]
+            else:
+                measure, peaks = "peak RSS", data["peak RSS"]
+            for phase, peak in peaks.items():
+                key = f"{measure}/{phase}/{name}"
+                results[key] = {"atoms": n_atoms, "peak": peak, "units": "MiB"}
+                print(f"{key:>50s}: {peak:10.1f} MiB", flush=True)
+
+    return {"metadata": metadata(), "results": results}
+
+
+def compare(baseline, current, tolerance=0.25):
+    """Compare the results with the baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        The baseline results, as from `run` or `memory`.
+    current : dict
+        The new results.
+    tolerance : float = 0.25
+        The fraction by which a benchmark may be worse before it is a regression.
+
+    Returns
+    -------
+    [str]
+        The benchmarks that regressed.
+    """
+    old = baseline["results"]
+    new = current["results"]
+
+    regressions = []
+    print(f"{'benchmark':>50s} {'baseline':>10s} {'current':>10s} {'ratio':>6s}")
+    for key in sorted(old.keys() & new.keys()):
+        # The time in seconds, or memory in MiB
+        field = "min" if "min" in old[key] else "peak"
+        floor = floors[old[key].get("units", "s")]
+        t0 = old[key][field]
+        t1 = new[key][field]
+        ratio = t1 / t0 if t0 > 0 else float("inf")
+        flag = ""
+        if t1 > (1 + tolerance) * t0 and t1 - t0 > floor:
+            flag = "  WORSE"
+            regressions.append(key)
+        elif t0 > (1 + tolerance) * t1 and t0 - t1 > floor:
+            flag = "  better"
+        print(f"{key:>50s} {t0:10.6g} {t1:10.6g} {ratio:6.2f}{flag}")
+
+    missing = old.keys() - new.keys()
+    if len(missing) > 0:
+        print(f"\n{len(missing)} benchmarks in the baseline were not run.")
+    for key in sorted(new.keys() - old.keys()):
+        print(f"{key:>50s}: not in the baseline")
+
+    if len(regressions) > 0:
+        print(f"\n{len(regressions)} benchmarks are more than {tolerance:.0%} worse.")
+    return regressions
+
+
+def main(argv=None):
+    """Generate the molecules, run the benchmarks, or compare results."""
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py", description="Benchmarks of QuickMin."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("generate", help="Build the benchmark molecules")
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("-o", "--output", help="The JSON file for the results")
+    run_parser.add_argument("-r", "--repeats", type=int, default=5)
+    run_parser.add_argument(
+        "--max-atoms", type=int, default=None, help="The largest molecule to use"
+    )
+    run_parser.add_argument(
+        "--molecule", action="append", choices=list(molecules), dest="names"
+    )
+    run_parser.add_argument(
+        "--benchmark", action="append", choices=list(benchmarks), dest="selected"
+    )
+    run_parser.add_argument(
+        "--forcefield", action="append", choices=forcefields, dest="ff_names"
+    )
+    run_parser.add_argument(
+        "--compare", metavar="BASELINE", help="Compare with this baseline"
+    )
+    run_parser.add_argument("--tolerance", type=float, default=0.25)
+
+    memory_parser = subparsers.add_parser(
+        "memory", help="Measure the memory used by the step"
+    )
+    memory_parser.add_argument("-o", "--output", help="The JSON file for the results")
+    memory_parser.add_argument(
+        "--max-atoms", type=int, default=None, help="The largest molecule to use"
+    )
+    memory_parser.add_argument(
+        "--molecule", action="append", choices=list(molecules), dest="names"
+    )
+    memory_parser.add_argument("--forcefield", default="best available")
+    memory_parser.add_argument("--steps", type=int, default=20)
+    memory_parser.add_argument(
+        "--compare", metavar="BASELINE", help="Compare with this baseline"
+    )
+    memory_parser.add_argument("--tolerance", type=float, default=0.25)
+
+    # Used by `memory` to run the step in a fresh process
+    step_parser = subparsers.add_parser("step")
+    step_parser.add_argument("name", choices=list(molecules))
+    step_parser.add_argument("output")
+    step_parser.add_argument("--forcefield", default="best available")
+    step_parser.add_argument("--steps", type=int, default=20)
+    step_parser.add_argument("--trace", action="store_true")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare results with a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="The fraction slower that is a regression (default: 0.25)",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generate()
+        return 0
+
+    if args.command == "step":
+        run_step(args.name, args.output, args.trace, args.forcefield, args.steps)
+        return 0
+
+    if args.command in ("run", "memory"):
+        if args.command == "run":
+            current = run(
+                args.names, args.repeats, args.max_atoms, args.selected, args.ff_names
+            )
+        else:
+            current = memory(args.names, args.max_atoms, args.forcefield, args.steps)
+        if args.output is not None:
+            Path(args.output).write_text(json.dumps(current, indent=4))
+        if args.compare is None:
+            return 0
+        baseline = json.loads(Path(args.compare).read_text())
+    else:
+        baseline = json.loads(Path(args.baseline).read_text())
+        current = json.loads(Path(args.current).read_text())
+
+    regressions = compare(baseline, current, args.tolerance)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
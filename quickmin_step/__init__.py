@@ -8,10 +8,13 @@ A SEAMM plug-in for simple, quick minimization
 # Bring up the classes so that they appear to be directly in
 # the quickmin_step package.
 
+from .asynchronous import AsyncMinimizer, minimize_async  # noqa: F401
 from .quickmin import QuickMin  # noqa: F401
 from .quickmin_parameters import QuickMinParameters  # noqa: F401
 from .quickmin_step import QuickMinStep  # noqa: F401
+from .results import load_results, read_results_lines  # noqa: F401
 from .tk_quickmin import TkQuickMin  # noqa: F401
+from .trajectory import Trajectory  # noqa: F401
 
 from .metadata import metadata  # noqa: F401
 
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""Running QuickMin calculations from asyncio without blocking the event loop.
+
+The calculations run in a pool of worker processes, since the OpenBabel forcefields
+are neither thread-safe nor release the GIL. Each one can report its progress and
+be cancelled, which stops the minimization in the worker at the end of the current
+chunk of steps::
+
+    async def main(configurations):
+        async with AsyncMinimizer(max_concurrent=8) as minimizer:
+            tasks = [minimizer.minimize(c, forcefield="GAFF") for c in configurations]
+            return await asyncio.gather(*tasks)
+
+For occasional use, `minimize_async` uses a shared minimizer with one process per
+core.
+"""
+
+import asyncio
+import concurrent.futures
+import inspect
+import math
+import multiprocessing
+import sys
+import time
+
+from seamm_util import Q_
+
+from .forcefield import (
+    best_available,
+    calculate,
+    get_coordinates,
+    obmol_from_text,
+    obmol_to_text,
+    set_coordinates,
+)
+from . import parallel
+
+# The progress, as pairs of steps and energy, and the stop flags for each slot,
+# shared with the worker processes
+_progress = None
+_stop = None
+
+# The minimizer used by `minimize_async`
+_default = None
+
+
+def _initialize_worker(progress, stop):
+    """Keep the shared arrays and load the forcefields in a worker process."""
+    global _progress, _stop
+
+    _progress = progress
+    _stop = stop
+    for ff_name in best_available:
+        try:
+            parallel.warm_up_worker(ff_name)
+        except Exception:
+            pass
+
+
+def _calculate(
+    slot, interval, text, coordinates, ff_name, calculation, n_steps, cutoff
+):
+    """Do one calculation in a worker, reporting progress through the slot.
+
+    OpenBabel does not report the energy as it minimizes, so the progress, with
+    the energy, is only updated every `interval` seconds, as often as it is read,
+    and not at all if the interval is None.
+    """
+    from .quickmin import OutputGrabber
+
+    factor = None
+    last = time.monotonic()
+
+    def callback(obFF, steps):
+        nonlocal factor, last
+        if interval is not None and time.monotonic() - last >= interval:
+            if factor is None:
+                factor = Q_(1.0, obFF.GetUnit()).m_as("kJ/mol")
+            _progress[2 * slot + 1] = factor * obFF.Energy(False)
+            # The steps last, so that the energy is never older than them
+            _progress[2 * slot] = steps
+            last = time.monotonic()
+        return _stop[slot] != 0
+
+    obmol = obmol_from_text(text, "mol2")
+    # The text only has 4 decimal places
+    set_coordinates(obmol, coordinates)
+    out = OutputGrabber(sys.stderr)
+    with out:
+        result = calculate(
+            obmol, ff_name, calculation, n_steps, cutoff, callback=callback
+        )
+    del result["setup"]
+    result["log"] = out.capturedtext
+    result["coordinates"] = get_coordinates(obmol)
+    return result
+
+
+class AsyncMinimizer(object):
+    """Minimizations from asyncio, run in a pool of processes.
+
+    Parameters
+    ----------
+    max_concurrent : int = None
+        The most calculations in progress at once, including those waiting for a
+        worker. Others wait their turn. By default the number of processes.
+    n_processes : int or str = None
+        The number of worker processes, by default all the cores.
+    poll_interval : float = 0.1
+        How often, in seconds, to check the progress of the calculations.
+    """
+
+    def __init__(self, max_concurrent=None, n_processes=None, poll_interval=0.1):
+        self.n_processes = parallel.n_workers(n_processes)
+        if max_concurrent is None:
+            max_concurrent = self.n_processes
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+
+        context = multiprocessing.get_context()
+        self._progress = context.RawArray("d", 2 * max_concurrent)
+        self._stop = context.RawArray("b", max_concurrent)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            self.n_processes,
+            initializer=_initialize_worker,
+            initargs=(self._progress, self._stop),
+        )
+        self._slots = None
+        self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes, stopping any calculations in progress."""
+        for slot in range(self.max_concurrent):
+            self._stop[slot] = 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _get_slot(self):
+        """Wait for a free slot, which bounds the number of calculations."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Queue()
+            for slot in range(self.max_concurrent):
+                self._slots.put_nowait(slot)
+        return await self._slots.get()
+
+    async def minimize(
+        self,
+        configuration,
+        forcefield="best available",
+        n_steps=1000,
+        calculation="optimization",
+        cutoff=6.0,
+        progress=None,
+    ):
+        """Minimize the structure, or calculate its energy, in a worker process.
+
+        The configuration is not changed. Cancelling the task stops the
+        calculation in the worker.
+
+        Parameters
+        ----------
+        configuration : molsystem._Configuration or openbabel.OBMol
+            The structure.
+        forcefield : str = "best available"
+            The forcefield as given in the parameters of the step.
+        n_steps : int = 1000
+            The maximum number of steps.
+        calculation : str = "optimization"
+            "optimization", "hydrogens only" or "single-point energy".
+        cutoff : float = 6.0
+            The nonbonded cutoff in Å, used when only minimizing the hydrogens.
+        progress : callable = None
+            Called as progress(steps, energy), with the energy in kJ/mol, as the
+            minimization progresses, at most once each poll interval. It may be a
+            coroutine function.
+
+        Returns
+        -------
+        dict
+            As from `forcefield.calculate`, plus the minimized "coordinates" and
+            the OpenBabel "log".
+        """
+        if hasattr(configuration, "to_OBMol"):
+            obmol = configuration.to_OBMol()
+        else:
+            obmol = configuration
+        args = (
+            obmol_to_text(obmol, "mol2"),
+            get_coordinates(obmol),
+            forcefield,
+            calculation,
+            n_steps,
+            cutoff,
+        )
+
+        slot = await self._get_slot()
+        job = None
+        try:
+            self._stop[slot] = 0
+            self._progress[2 * slot] = 0
+            self._progress[2 * slot + 1] = math.nan
+            interval = None if progress is None else self.poll_interval
+            job = self._executor.submit(_calculate, slot, interval, *args)
+            future = asyncio.wrap_future(job)
+            reported = 0
+            while True:
+                done, pending = await asyncio.wait({future}, timeout=self.poll_interval)
+                steps = int(self._progress[2 * slot])
+                if progress is not None and steps > reported:
+                    reported = steps
+                    value = progress(steps, self._progress[2 * slot + 1])
+                    if inspect.isawaitable(value):
+                        await value
+                if done:
+                    return future.result()
+        except asyncio.CancelledError:
+            # Stop the worker, or the job if it has not started, before freeing the
+            # slot
+            self._stop[slot] = 1
+            if job is not None and not job.cancel():
+                await asyncio.wait({future})
+            raise
+        finally:
+            self._slots.put_nowait(slot)
+
+
+async def minimize_async(
+    configuration, forcefield="best available", n_steps=1000, **kwargs
+):
+    """Minimize the structure in the shared pool of processes.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration or openbabel.OBMol
+        The structure.
+    forcefield : str = "best available"
+        The forcefield as given in the parameters of the step.
+    n_steps : int = 1000
+        The maximum number of steps.
+    kwargs : dict
+        Other arguments for `AsyncMinimizer.minimize`.
+
+    Returns
+    -------
+    dict
+        As from `AsyncMinimizer.minimize`.
+    """
+    global _default
+
+    if _default is None:
+        _default = AsyncMinimizer()
+    return await _default.minimize(
+        configuration, forcefield=forcefield, n_steps=n_steps, **kwargs
+    )
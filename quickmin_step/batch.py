@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+
+"""Minimizing large libraries of molecules from the command line.
+
+The molecules are read one at a time from any format that OpenBabel reads, such as
+SDF, MOL2 or SMILES, minimized on a pool of processes with the same forcefields as
+the QuickMin step, and written to an SDF file with the energy and convergence as
+tags. The output is in the same order as the input, and only a limited number of
+molecules are in memory at any time, so libraries of any size can be handled
+without a flowchart::
+
+    quickmin-batch library.smi minimized.sdf --forcefield MMFF94s -n 16
+
+Progress is recorded in a manifest next to the output, so a job that is stopped,
+for example by preemption on a cluster, continues where it left off when the same
+command is run again.
+"""
+
+import argparse
+import concurrent.futures
+import heapq
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+
+from openbabel import openbabel
+
+from . import cost
+from . import forcefield
+from . import parallel
+from . import supervisor
+
+logger = logging.getLogger(__name__)
+
+# The OpenBabel formats with one SMILES per line
+smiles_formats = ("smi", "smiles", "can", "ism")
+
+# The tags added to each molecule in the output
+tags = {
+    "energy": "QuickMin energy (kJ/mol)",
+    "converged": "QuickMin converged",
+    "n steps": "QuickMin steps",
+    "forcefield": "QuickMin forcefield",
+    "error": "QuickMin error",
+}
+
+
+def read_molecules(path, fmt=None, start=0):
+    """Read the molecules in a file one at a time.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file to read.
+    fmt : str = None
+        The OpenBabel format, defaulting to the extension of the file.
+    start : int = 0
+        The number of molecules to skip at the beginning of the file. They are
+        skipped without being parsed.
+
+    Yields
+    ------
+    openbabel.OBMol
+        Each molecule in turn. SMILES that cannot be parsed give an empty molecule,
+        so that the output stays in step with the input.
+    """
+    path = Path(path).expanduser()
+    if not path.exists():
+        raise FileNotFoundError(f"The file '{path}' does not exist.")
+    if fmt is None:
+        fmt = path.suffix[1:]
+
+    obConversion = openbabel.OBConversion()
+    if not obConversion.SetInFormat(fmt):
+        raise ValueError(f"OpenBabel cannot read files of type '{fmt}'.")
+
+    if fmt in smiles_formats:
+        # OpenBabel stops reading at a bad SMILES, so read the lines here.
+        with open(path) as fd:
+            for line in fd:
+                if line.strip() == "":
+                    continue
+                if start > 0:
+                    start -= 1
+                    continue
+                obmol = openbabel.OBMol()
+                if not obConversion.ReadString(obmol, line):
+                    obmol = openbabel.OBMol()
+                    fields = line.split(maxsplit=1)
+                    obmol.SetTitle(fields[-1].strip())
+                yield obmol
+        return
+
+    if start > 0:
+        obConversion.AddOption("f", openbabel.OBConversion.GENOPTIONS, str(start + 1))
+    obmol = openbabel.OBMol()
+    more = obConversion.ReadFile(obmol, str(path))
+    while more:
+        yield obmol
+        obmol = openbabel.OBMol()
+        more = obConversion.Read(obmol)
+
+
+def add_tags(obmol, values):
+    """Add the values as SDF tags to the molecule.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    values : dict
+        The values, with keys from `tags`.
+    """
+    for key, value in values.items():
+        if key not in tags:
+            continue
+        if isinstance(value, float):
+            value = f"{value:.4f}"
+        data = openbabel.OBPairData()
+        data.SetAttribute(tags[key])
+        data.SetValue(str(value))
+        obmol.CloneData(data)
+
+
+def _to_job(obmol):
+    """The molecule as text for a worker, as SMILES if it has no coordinates."""
+    fmt = "sdf" if obmol.GetDimension() > 0 else "smi"
+    return forcefield.obmol_to_text(obmol, fmt), fmt, cost.molecule_size(obmol)
+
+
+def minimize_record(text, ff_name="best available", n_steps=1000, fmt="sdf"):
+    """Minimize one molecule and return it as SDF with the results as tags.
+
+    Molecules without 3-D coordinates, for example from SMILES, are given
+    hydrogens and 3-D coordinates first. Any problem is reported in the
+    "QuickMin error" tag rather than raised.
+
+    Parameters
+    ----------
+    text : str
+        The molecule as text.
+    ff_name : str = "best available"
+        The forcefield, either "best available" or an OpenBabel name.
+    n_steps : int = 1000
+        The maximum number of steps.
+    fmt : str = "sdf"
+        The format of the text.
+
+    Returns
+    -------
+    (str, dict)
+        The molecule as SDF text with the tags, and the results.
+    """
+    t0 = time.perf_counter()
+    obmol = forcefield.obmol_from_text(text, fmt)
+    try:
+        if obmol.NumAtoms() == 0:
+            raise ValueError("The molecule could not be read.")
+        if not obmol.Has3D():
+            obmol.AddHydrogens()
+            builder = openbabel.OBBuilder()
+            if not builder.Build(obmol):
+                raise RuntimeError("Could not build 3-D coordinates.")
+        obFF, ff_name = forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+        energy, converged, steps = forcefield.minimize(obFF, obmol, n_steps=n_steps)
+        if not math.isfinite(energy):
+            raise RuntimeError(f"The energy with {ff_name} is not finite.")
+        result = {
+            "energy": energy,
+            "converged": converged,
+            "n steps": steps,
+            "forcefield": ff_name,
+            "time": time.perf_counter() - t0,
+        }
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+
+    add_tags(obmol, result)
+    return forcefield.obmol_to_text(obmol), result
+
+
+def _failed_record(text, fmt, message):
+    """The molecule as SDF with an error tag, and the result, for a failed job."""
+    obmol = forcefield.obmol_from_text(text, fmt)
+    result = {"error": message}
+    add_tags(obmol, result)
+    return forcefield.obmol_to_text(obmol), result
+
+
+class Manifest(object):
+    """An append-only record of how much of the output is complete.
+
+    The manifest is kept beside the output, as "<output>.manifest". The first line
+    is a JSON header describing the job. Each following line gives the number of
+    molecules written and the size of the output in bytes at that point. The output
+    is flushed to disk before a line is added, so the last complete line always
+    describes complete output, and anything beyond it is a partial write that can
+    be truncated.
+
+    Parameters
+    ----------
+    output_path : str or pathlib.Path
+        The output file.
+    header : dict
+        The description of the job, which must match to continue a previous run.
+    interval : int = 100
+        Record the progress after this many molecules ...
+    seconds : float = 60.0
+        ... or this many seconds, whichever comes first.
+    """
+
+    def __init__(self, output_path, header, interval=100, seconds=60.0):
+        self.path = Path(str(output_path) + ".manifest")
+        self.header = header
+        self.interval = interval
+        self.seconds = seconds
+        self.n = 0
+        self._fd = None
+        self._recorded = 0
+        self._time = time.monotonic()
+
+    def read(self):
+        """The progress recorded by a previous run of the same job.
+
+        Returns
+        -------
+        (int, int)
+            The number of molecules completed and the size of the output in bytes.
+        """
+        if not self.path.exists():
+            return 0, 0
+        with open(self.path) as fd:
+            # A last line without a newline was interrupted, so ignore it.
+            lines = fd.read().split("\n")[:-1]
+        if len(lines) == 0:
+            return 0, 0
+        if json.loads(lines[0]) != self.header:
+            raise RuntimeError(
+                f"The manifest '{self.path}' is for a different job. Remove it or "
+                "use --restart to start again."
+            )
+        n, offset = 0, 0
+        for line in lines[1:]:
+            n, offset = (int(value) for value in line.split())
+        return n, offset
+
+    def open(self, n=0):
+        """Open the manifest to record progress, starting afresh if `n` is 0."""
+        self.n = self._recorded = n
+        if n == 0:
+            self._fd = open(self.path, "w")
+            self._fd.write(json.dumps(self.header) + "\n")
+            self._fd.flush()
+        else:
+            self._fd = open(self.path, "a")
+        self._time = time.monotonic()
+
+    def record(self, output):
+        """Note that another molecule has been written, recording it when due."""
+        self.n += 1
+        if (
+            self.n - self._recorded >= self.interval
+            or time.monotonic() - self._time >= self.seconds
+        ):
+            self.flush(output)
+
+    def flush(self, output):
+        """Write the output to disk and then record the progress."""
+        if self._fd is None or self.n == self._recorded:
+            return
+        output.flush()
+        os.fsync(output.fileno())
+        self._fd.write(f"{self.n} {output.tell()}\n")
+        self._fd.flush()
+        os.fsync(self._fd.fileno())
+        self._recorded = self.n
+        self._time = time.monotonic()
+
+    def close(self):
+        """Close the manifest."""
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def remove(self):
+        """Remove the manifest, if it exists."""
+        self.path.unlink(missing_ok=True)
+
+
+def minimize_file(
+    input_path,
+    output_path,
+    ff_name="best available",
+    n_steps=1000,
+    n_processes=None,
+    input_format=None,
+    window=None,
+    restart=False,
+    checkpoint=100,
+    model=None,
+    timings=None,
+    timeout=None,
+    memory_limit=None,
+):
+    """Minimize all the molecules in a file, writing them in order to an SDF file.
+
+    The minimizations run in supervised worker processes, so a molecule that
+    crashes its worker, or exceeds the time or memory limit, is written with an
+    error tag and the worker replaced. Only with a single process and no limits
+    are the molecules minimized in this process.
+
+    Parameters
+    ----------
+    input_path : str or pathlib.Path
+        The file of molecules.
+    output_path : str or pathlib.Path
+        The SDF file to write.
+    ff_name : str = "best available"
+        The forcefield, either "best available" or an OpenBabel name.
+    n_steps : int = 1000
+        The maximum number of steps for each molecule.
+    n_processes : int = None
+        The number of processes, defaulting to all the cores.
+    input_format : str = None
+        The OpenBabel format of the input, defaulting to the extension of the file.
+    window : int = None
+        The largest number of molecules read but not yet written, which bounds
+        the memory used. Defaults to 8 per process.
+    restart : bool = False
+        Start from the beginning, rather than continuing a previous run of the job.
+    checkpoint : int = 100
+        Record the progress in the manifest after this many molecules.
+    model : cost.CostModel = None
+        The model for the cost of each molecule, by default `CostModel.default()`.
+    timings : str or pathlib.Path = None
+        A JSON Lines file to append the predicted and actual times to.
+    timeout : float = None
+        The time limit in seconds for each molecule.
+    memory_limit : int = None
+        The limit in bytes on the memory of each worker process.
+
+    Returns
+    -------
+    dict
+        Counts of the molecules that "converged", did "not converge" and "failed"
+        in this run, and those "previously done".
+    """
+    n_processes = parallel.n_workers(n_processes)
+    if window is None:
+        window = 8 * n_processes
+    input_path = Path(input_path).expanduser()
+    output_path = Path(output_path).expanduser()
+    stat = input_path.stat()
+    header = {
+        "input": str(input_path.resolve()),
+        "size": stat.st_size,
+        "modified": stat.st_mtime_ns,
+        "forcefield": ff_name,
+        "n steps": n_steps,
+    }
+    manifest = Manifest(output_path, header, interval=checkpoint)
+    if restart:
+        manifest.remove()
+    n_done, offset = manifest.read()
+    if n_done > 0:
+        if not output_path.exists() or output_path.stat().st_size < offset:
+            raise RuntimeError(
+                f"The output '{output_path}' is shorter than recorded in the "
+                "manifest. Use --restart to start again."
+            )
+        logger.info(f"Continuing after the {n_done} molecules already done.")
+
+    counts = {"converged": 0, "not converged": 0, "failed": 0}
+    jobs = (
+        _to_job(obmol)
+        for obmol in read_molecules(input_path, input_format, start=n_done)
+    )
+    if model is None:
+        model = cost.CostModel.default()
+    log = None if timings is None else cost.TimingLog(timings)
+
+    def predict(size):
+        return model.predict(*size, ff_name, n_steps)
+
+    with open(output_path, "r+b" if n_done > 0 else "wb") as fd:
+        # Remove anything written after the last recorded point
+        fd.truncate(offset)
+        fd.seek(offset)
+        manifest.open(n_done)
+
+        def write(size, predicted, text, result):
+            fd.write(text.encode())
+            manifest.record(fd)
+            if "time" in result:
+                logger.debug(
+                    f"{size[0]} atoms, {size[1]} rotors: predicted {predicted:.3f} s, "
+                    f"took {result['time']:.3f} s"
+                )
+                if log is not None:
+                    log.log(
+                        *size,
+                        ff_name,
+                        n_steps,
+                        predicted,
+                        result["time"],
+                        result["forcefield"],
+                    )
+            if "error" in result:
+                counts["failed"] += 1
+            elif result["converged"]:
+                counts["converged"] += 1
+            else:
+                counts["not converged"] += 1
+            n = sum(counts.values())
+            if n % 1000 == 0:
+                logger.info(f"Minimized {n} molecules")
+
+        try:
+            if n_processes == 1 and timeout is None and memory_limit is None:
+                for text, fmt, size in jobs:
+                    write(
+                        size,
+                        predict(size),
+                        *minimize_record(text, ff_name, n_steps, fmt),
+                    )
+            else:
+                pool = supervisor.SupervisedExecutor(
+                    n_processes,
+                    timeout=timeout,
+                    memory_limit=memory_limit,
+                    initializer=minimize_record,
+                    initargs=("C", ff_name, 1, "smi"),
+                )
+                with pool:
+                    _minimize_in_pool(
+                        jobs, write, predict, ff_name, n_steps, pool, window
+                    )
+        finally:
+            manifest.flush(fd)
+            manifest.close()
+            if log is not None:
+                log.close()
+
+    counts["previously done"] = n_done
+    return counts
+
+
+def _minimize_in_pool(jobs, write, predict, ff_name, n_steps, pool, window):
+    """Minimize the molecules on a pool of processes, writing them in order.
+
+    Up to `window` molecules are read ahead, and the most expensive of those are
+    started first. Only two molecules per process are queued at a time, so each
+    worker takes the next most expensive one as soon as it is free.
+    """
+    # Molecules waiting to start, as a heap ordered by decreasing cost
+    waiting = []
+    pending = {}
+    # finished ones are held until all the ones before them have been written.
+    finished = {}
+    n_read = 0
+    n_written = 0
+    exhausted = False
+    while True:
+        while not exhausted and n_read - n_written < window:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                break
+            heapq.heappush(waiting, (-predict(job[2]), n_read, job))
+            n_read += 1
+        while len(waiting) > 0 and len(pending) < 2 * pool.max_workers:
+            predicted, index, job = heapq.heappop(waiting)
+            text, fmt, size = job
+            future = pool.submit(minimize_record, text, ff_name, n_steps, fmt)
+            pending[future] = (index, job, -predicted)
+        if len(pending) == 0:
+            break
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            index, (text, fmt, size), predicted = pending.pop(future)
+            try:
+                record = future.result()
+            except supervisor.WorkerFailed as e:
+                record = _failed_record(text, fmt, f"WorkerFailed: {e}")
+            finished[index] = (size, predicted, *record)
+        while n_written in finished:
+            write(*finished.pop(n_written))
+            n_written += 1
+
+
+def create_parser():
+    """The command-line parser for quickmin-batch."""
+    parser = argparse.ArgumentParser(
+        prog="quickmin-batch",
+        description=(
+            "Minimize a library of molecules with the OpenBabel forcefields, writing "
+            "an SDF file with the energies and convergence as tags."
+        ),
+    )
+    parser.add_argument("input", help="The molecules, e.g. .sdf, .mol2 or .smi")
+    parser.add_argument("output", help="The SDF file for the minimized molecules")
+    parser.add_argument(
+        "-f",
+        "--forcefield",
+        default="best available",
+        choices=("best available", *forcefield.best_available, "MMFF94"),
+        help="The forcefield (default: best available)",
+    )
+    parser.add_argument(
+        "-s",
+        "--n-steps",
+        type=int,
+        default=1000,
+        help="The maximum number of steps for each molecule (default: 1000)",
+    )
+    parser.add_argument(
+        "-n",
+        "--processes",
+        type=int,
+        default=0,
+        help="The number of processes (default: all the cores)",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-format",
+        default=None,
+        help="The OpenBabel format of the input, if not given by the extension",
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=None,
+        help="The time limit in seconds for each molecule (default: none)",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-limit",
+        type=float,
+        default=None,
+        help="The limit on the memory of each process in GB (default: none)",
+    )
+    parser.add_argument(
+        "--cost-model",
+        default=None,
+        help=(
+            "A JSON file with the model of the time for each molecule, used to start "
+            "the most expensive first"
+        ),
+    )
+    parser.add_argument(
+        "--timings",
+        default=None,
+        help="A JSON Lines file to append the predicted and actual times to",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Start from the beginning rather than continuing a previous run",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        help="The level of logging to stderr",
+    )
+    return parser
+
+
+def main(argv=None):
+    """The command-line interface for minimizing libraries of molecules."""
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format="%(levelname)s: %(message)s")
+
+    # Exit cleanly when terminated, so that the progress is recorded.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    t0 = time.perf_counter()
+    try:
+        model = (
+            None if args.cost_model is None else cost.CostModel.load(args.cost_model)
+        )
+        counts = minimize_file(
+            args.input,
+            args.output,
+            ff_name=args.forcefield,
+            n_steps=args.n_steps,
+            n_processes=args.processes,
+            input_format=args.input_format,
+            restart=args.restart,
+            model=model,
+            timings=args.timings,
+            timeout=args.timeout,
+            memory_limit=(
+                None if args.memory_limit is None else int(args.memory_limit * 1e9)
+            ),
+        )
+    except (FileNotFoundError, RuntimeError, ValueError) as e:
+        print(f"quickmin-batch: error: {e}", file=sys.stderr)
+        return 2
+    t = time.perf_counter() - t0
+    previously = counts.pop("previously done")
+    n = sum(counts.values())
+
+    if previously > 0:
+        print(f"Skipped {previously} molecules done previously.", file=sys.stderr)
+    print(
+        f"Minimized {n} molecules in {t:.1f} s: {counts['converged']} converged, "
+        f"{counts['not converged']} did not converge, and {counts['failed']} failed.",
+        file=sys.stderr,
+    )
+    return 0 if counts["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
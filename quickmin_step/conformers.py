@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""Generating rotamers and finding the unique conformers after minimization."""
+
+import itertools
+import logging
+import math
+
+import numpy as np
+from openbabel import openbabel
+
+from . import forcefield
+
+logger = logging.getLogger(__name__)
+
+# The angles, in degrees, tried for each rotatable bond.
+rotamer_angles = (60.0, 180.0, 300.0)
+
+
+def rotatable_torsions(obmol):
+    """The torsions, as 1-based atom indices, that define the rotatable bonds.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    [(int, int, int, int)]
+        The four atoms of a torsion around each rotatable bond.
+    """
+    result = []
+    for bond in openbabel.OBMolBondIter(obmol):
+        if not bond.IsRotor():
+            continue
+        b = bond.GetBeginAtom()
+        c = bond.GetEndAtom()
+        a = _heaviest_neighbor(b, c)
+        d = _heaviest_neighbor(c, b)
+        if a is None or d is None:
+            continue
+        result.append((a.GetIdx(), b.GetIdx(), c.GetIdx(), d.GetIdx()))
+    return result
+
+
+def _heaviest_neighbor(atom, exclude):
+    """The neighbor of an atom with the highest atomic number, ignoring one atom."""
+    result = None
+    for neighbor in openbabel.OBAtomAtomIter(atom):
+        if neighbor.GetIdx() == exclude.GetIdx():
+            continue
+        if result is None or neighbor.GetAtomicNum() > result.GetAtomicNum():
+            result = neighbor
+    return result
+
+
+def generate_rotamers(obmol, n_rotamers=1000, angles=rotamer_angles, seed=None):
+    """Generate starting structures by rotating about the rotatable bonds.
+
+    If there are few enough combinations of angles they are all generated,
+    otherwise they are sampled randomly. The first structure is always the input
+    structure.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule, which is left with its original coordinates.
+    n_rotamers : int = 1000
+        The maximum number of structures.
+    angles : (float) = (60.0, 180.0, 300.0)
+        The torsion angles, in degrees, for each rotatable bond.
+    seed : int = None
+        The seed for the random number generator, for reproducible sampling.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n_structures, n_atoms, 3) coordinates in Å.
+    """
+    initial = forcefield.get_coordinates(obmol)
+    torsions = rotatable_torsions(obmol)
+    if len(torsions) == 0 or n_rotamers <= 1:
+        return initial[np.newaxis]
+
+    n_angles = len(angles)
+    n_combinations = n_angles ** len(torsions)
+    if n_combinations <= n_rotamers - 1:
+        choices = np.array(
+            list(itertools.product(range(n_angles), repeat=len(torsions)))
+        )
+    else:
+        rng = np.random.default_rng(seed)
+        choices = rng.integers(0, n_angles, size=(n_rotamers - 1, len(torsions)))
+
+    forcefield.ensure_coordinate_array(obmol)
+    obatoms = [[obmol.GetAtom(i) for i in torsion] for torsion in torsions]
+    radians = [math.radians(angle) for angle in angles]
+    result = [initial]
+    for choice in choices.tolist():
+        forcefield.set_coordinates(obmol, initial)
+        for atoms, i in zip(obatoms, choice):
+            obmol.SetTorsion(*atoms, radians[i])
+        result.append(forcefield.get_coordinates(obmol))
+    forcefield.set_coordinates(obmol, initial)
+
+    return np.array(result)
+
+
+def rmsd_to_many(xyz, others):
+    """The RMSD of a structure to many others, after optimal superposition.
+
+    The superposition uses the Kabsch algorithm, with the SVDs for all the other
+    structures done at once.
+
+    Parameters
+    ----------
+    xyz : numpy.ndarray
+        The (n_atoms, 3) coordinates of the structure.
+    others : numpy.ndarray
+        The (n_others, n_atoms, 3) coordinates of the other structures.
+
+    Returns
+    -------
+    numpy.ndarray
+        The n_others RMSDs.
+    """
+    n_atoms = xyz.shape[0]
+    xyz = xyz - xyz.mean(axis=0)
+    others = others - others.mean(axis=1, keepdims=True)
+
+    H = np.einsum("kni,nj->kij", others, xyz)
+    U, S, Vt = np.linalg.svd(H)
+    # Avoid reflections
+    d = np.sign(np.linalg.det(U @ Vt))
+    S[:, -1] *= d
+    squared = (others**2).sum(axis=(1, 2)) + (xyz**2).sum() - 2 * S.sum(axis=1)
+
+    return np.sqrt(np.maximum(squared, 0.0) / n_atoms)
+
+
+def superposition_rotation(xyz, reference):
+    """The rotation that best superimposes a structure on a reference.
+
+    Parameters
+    ----------
+    xyz : numpy.ndarray
+        The (n_atoms, 3) coordinates of the structure.
+    reference : numpy.ndarray
+        The (n_atoms, 3) coordinates of the reference.
+
+    Returns
+    -------
+    numpy.ndarray
+        The 3x3 rotation matrix R, such that the centered structure times R is
+        closest to the centered reference. Vectors on the atoms, such as gradients,
+        are rotated the same way.
+    """
+    xyz = xyz - xyz.mean(axis=0)
+    reference = reference - reference.mean(axis=0)
+
+    U, S, Vt = np.linalg.svd(xyz.T @ reference)
+    # Avoid reflections
+    if np.linalg.det(U @ Vt) < 0:
+        U[:, -1] *= -1
+    return U @ Vt
+
+
+def unique_conformers(
+    energies,
+    coordinates,
+    mask=None,
+    threshold=0.5,
+    window=None,
+    max_conformers=None,
+    converged=None,
+):
+    """Select the unique low-energy conformers.
+
+    The conformers are considered in order of increasing energy, and one is kept if
+    its RMSD to all those already kept is larger than the threshold. Conformers
+    whose minimization did not converge are not considered at all, since a partly
+    minimized structure is not a conformer, and could hide the converged one that
+    it resembles.
+
+    Parameters
+    ----------
+    energies : numpy.ndarray
+        The energies of the conformers.
+    coordinates : numpy.ndarray
+        The (n_conformers, n_atoms, 3) coordinates.
+    mask : numpy.ndarray = None
+        A boolean mask of the atoms to use for the RMSD, typically the heavy atoms.
+    threshold : float = 0.5
+        The RMSD below which two conformers are considered the same.
+    window : float = None
+        Only keep conformers within this energy of the lowest one.
+    max_conformers : int = None
+        The maximum number of conformers to keep.
+    converged : numpy.ndarray = None
+        Whether the minimization of each conformer converged. If not given, all are
+        taken to have converged.
+
+    Returns
+    -------
+    [int]
+        The indices of the unique conformers, in order of increasing energy.
+    """
+    energies = np.asarray(energies)
+    if mask is not None:
+        coordinates = coordinates[:, mask, :]
+
+    order = np.argsort(energies, kind="stable")
+    if converged is not None:
+        order = order[np.asarray(converged, dtype=bool)[order]]
+    if len(order) == 0:
+        return []
+    lowest = energies[order[0]]
+
+    kept = []
+    for i in order.tolist():
+        if window is not None and energies[i] - lowest > window:
+            break
+        if max_conformers is not None and len(kept) >= max_conformers:
+            break
+        if len(kept) > 0:
+            rmsds = rmsd_to_many(coordinates[i], coordinates[kept])
+            if rmsds.min() < threshold:
+                continue
+        kept.append(i)
+
+    return kept
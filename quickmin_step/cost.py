@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""Estimating the time to minimize a molecule, to balance the work on a pool.
+
+The model is log-linear in the number of atoms, the number of rotatable bonds and
+the maximum number of steps, with a factor for each forcefield:
+
+    log(t) = c0 + c1 log(n_atoms) + c2 log(1 + n_rotors) + c3 log(n_steps) + c_ff
+
+The forcefield is the one requested, since which forcefield "best available"
+gives for a molecule is only known once the forcefield is set up. So "best
+available" has a factor of its own, learned from the runs that requested it.
+
+The default coefficients are rough, but since the pool only needs to start the
+expensive molecules first, the ordering matters more than the absolute times. The
+predicted and actual times can be logged as JSON Lines and the model refit from
+them::
+
+    quickmin-cost-model timings.jsonl ~/.seamm.d/quickmin/cost_model.json
+
+A model in that location is used by default.
+"""
+
+import argparse
+import json
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The coefficients of the default model, for times in seconds
+default_coefficients = {
+    "intercept": -13.9,
+    "log n atoms": 1.2,
+    "log n rotors": 0.1,
+    "log n steps": 1.0,
+    "UFF": 0.5,
+}
+
+terms = ("intercept", "log n atoms", "log n rotors", "log n steps")
+
+# Where a fitted model is used by default
+default_path = Path("~/.seamm.d/quickmin/cost_model.json")
+
+
+def forcefield_key(ff_name):
+    """The forcefield as named in the model.
+
+    Parameters
+    ----------
+    ff_name : str
+        The forcefield as requested, e.g. "best available", "MMFF94" or
+        "MMFF94 -- MMFF94 force field".
+
+    Returns
+    -------
+    str
+        "best available", or the OpenBabel name of the forcefield.
+    """
+    if ff_name == "best available":
+        return ff_name
+    return ff_name.split()[0]
+
+
+def molecule_size(obmol):
+    """The number of atoms, including implicit hydrogens, and of rotatable bonds.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    (int, int)
+        The number of atoms and of rotatable bonds.
+    """
+    n_atoms = obmol.NumAtoms()
+    for i in range(1, n_atoms + 1):
+        n_atoms += obmol.GetAtom(i).GetImplicitHCount()
+    return n_atoms, obmol.NumRotors()
+
+
+class CostModel(object):
+    """A model of the time to minimize a molecule.
+
+    Parameters
+    ----------
+    coefficients : dict = None
+        The coefficients of the terms, plus any forcefield factors. Defaults to
+        `default_coefficients`.
+    """
+
+    def __init__(self, coefficients=None):
+        if coefficients is None:
+            coefficients = default_coefficients
+        self.coefficients = dict(coefficients)
+
+    def predict(self, n_atoms, n_rotors, ff_name, n_steps=1000):
+        """The predicted time in seconds.
+
+        Parameters
+        ----------
+        n_atoms : int
+            The number of atoms, including hydrogens.
+        n_rotors : int
+            The number of rotatable bonds.
+        ff_name : str
+            The forcefield requested, which may be "best available". Forcefields
+            not in the model have no factor.
+        n_steps : int = 1000
+            The maximum number of steps.
+
+        Returns
+        -------
+        float
+            The time in seconds.
+        """
+        c = self.coefficients
+        log_t = (
+            c["intercept"]
+            + c["log n atoms"] * math.log(max(n_atoms, 1))
+            + c["log n rotors"] * math.log(1 + n_rotors)
+            + c["log n steps"] * math.log(max(n_steps, 1))
+            + c.get(forcefield_key(ff_name), 0.0)
+        )
+        return math.exp(log_t)
+
+    @classmethod
+    def default(cls):
+        """The fitted model in `default_path` if there is one, otherwise the default.
+
+        Returns
+        -------
+        CostModel
+            The model.
+        """
+        path = default_path.expanduser()
+        if path.exists():
+            try:
+                return cls.load(path)
+            except Exception as e:
+                logger.warning(f"Could not read the cost model '{path}': {e}")
+        return cls()
+
+    @classmethod
+    def fit(cls, timings):
+        """Fit the model to recorded timings by least squares in log(t).
+
+        Terms that do not vary in the timings, typically the number of steps, cannot
+        be fit, so keep their default coefficients.
+
+        Parameters
+        ----------
+        timings : [dict]
+            The records written by `TimingLog`.
+
+        Returns
+        -------
+        CostModel
+            The fitted model.
+        """
+        timings = [t for t in timings if t.get("time", 0) > 0]
+        forcefields = sorted({t["forcefield"] for t in timings})
+        # The first forcefield is the reference, so has no factor
+        columns = [*terms, *forcefields[1:]]
+        if len(timings) < len(columns):
+            raise ValueError(
+                f"At least {len(columns)} timings are needed to fit the cost model, "
+                f"but there are only {len(timings)}."
+            )
+
+        A = np.zeros((len(timings), len(columns)))
+        A[:, 0] = 1.0
+        for row, t in zip(A, timings):
+            row[1] = math.log(max(t["n atoms"], 1))
+            row[2] = math.log(1 + t["n rotors"])
+            row[3] = math.log(max(t["n steps"], 1))
+            if t["forcefield"] in columns:
+                row[columns.index(t["forcefield"])] = 1.0
+        y = np.log([t["time"] for t in timings])
+
+        coefficients = {}
+        fit = [0]
+        for i, name in enumerate(columns[1:], start=1):
+            if np.ptp(A[:, i]) > 0:
+                fit.append(i)
+            elif name in terms:
+                coefficients[name] = default_coefficients[name]
+                y -= coefficients[name] * A[:, i]
+        x, residuals, rank, sv = np.linalg.lstsq(A[:, fit], y, rcond=None)
+        for i, value in zip(fit, x):
+            coefficients[columns[i]] = float(value)
+
+        return cls(coefficients)
+
+    @classmethod
+    def load(cls, path):
+        """Read the model from a JSON file."""
+        with open(Path(path).expanduser()) as fd:
+            return cls(json.load(fd))
+
+    def save(self, path):
+        """Write the model to a JSON file."""
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as fd:
+            json.dump(self.coefficients, fd, indent=4)
+
+
+class TimingLog(object):
+    """An append-only JSON Lines log of predicted and actual times.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The log file, which is appended to.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._fd = open(self.path, "a")
+
+    def log(
+        self, n_atoms, n_rotors, ff_name, n_steps, predicted, actual, resolved=None
+    ):
+        """Add the timing of one minimization.
+
+        The forcefield is recorded as requested, as it was for the prediction, and
+        for "best available" the forcefield actually used as the "resolved
+        forcefield".
+        """
+        record = {
+            "n atoms": n_atoms,
+            "n rotors": n_rotors,
+            "forcefield": forcefield_key(ff_name),
+            "n steps": n_steps,
+            "predicted": round(predicted, 6),
+            "time": round(actual, 6),
+        }
+        if resolved is not None and resolved != record["forcefield"]:
+            record["resolved forcefield"] = resolved
+        self._fd.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """Close the log."""
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+def read_timings(path):
+    """Read the records from a timing log.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The log file.
+
+    Returns
+    -------
+    [dict]
+        The records.
+    """
+    with open(path) as fd:
+        return [json.loads(line) for line in fd if line.strip() != ""]
+
+
+def main(argv=None):
+    """Refit the cost model from a timing log."""
+    parser = argparse.ArgumentParser(
+        prog="quickmin-cost-model",
+        description="Fit the model of minimization times to recorded timings.",
+    )
+    parser.add_argument("timings", help="The JSON Lines log of timings")
+    parser.add_argument("model", help="The JSON file for the fitted model")
+    args = parser.parse_args(argv)
+
+    timings = [t for t in read_timings(args.timings) if t.get("time", 0) > 0]
+    model = CostModel.fit(timings)
+    model.save(args.model)
+
+    predicted = np.log(
+        [
+            model.predict(t["n atoms"], t["n rotors"], t["forcefield"], t["n steps"])
+            for t in timings
+        ]
+    )
+    actual = np.log([t["time"] for t in timings])
+    rms = np.sqrt(np.mean((predicted - actual) ** 2))
+    print(f"Fit {len(timings)} timings with an RMS error of {rms:.2f} in log(t).")
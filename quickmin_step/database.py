@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Writing the results for many configurations to the database at once.
+
+Setting the coordinates of a configuration through molsystem looks up the rows of
+each coordinate column, then updates and commits each column in turn, which is
+slow when storing hundreds of minimized structures. `WriteBack` collects the
+coordinates and properties of many configurations and writes them in one
+transaction, updating the coordinates of all the configurations with a single
+statement. `set_atom_data` similarly stores the per-atom results of a calculation
+on the atoms of a configuration.
+"""
+
+import contextlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def transaction(system_db):
+    """Commit everything written to the database inside the block at once.
+
+    Nothing is committed if there is an error. Inside another such block, or with
+    a version of molsystem that cannot defer commits, this does nothing.
+
+    Parameters
+    ----------
+    system_db : molsystem.SystemDB
+        The database.
+    """
+    if getattr(system_db, "deferred_commit", True):
+        yield
+        return
+
+    system_db.deferred_commit = True
+    try:
+        yield
+    except BaseException:
+        # Stop deferring first, or a new transaction is left open
+        system_db.deferred_commit = False
+        system_db.rollback_transaction()
+        raise
+    system_db.deferred_commit = False
+    system_db.commit_transaction()
+
+
+def set_coordinates(configurations, coordinates):
+    """Set the Cartesian coordinates of many configurations with one statement.
+
+    Periodic configurations and those with symmetry are set through molsystem, one
+    at a time, since their coordinates need converting.
+
+    Parameters
+    ----------
+    configurations : [molsystem._Configuration]
+        The configurations, all in the same database.
+    coordinates : [numpy.ndarray or [[float]]]
+        The (n_atoms, 3) coordinates in Å for each configuration.
+    """
+    parameters = []
+    for configuration, xyz in zip(configurations, coordinates):
+        if configuration.periodicity != 0 or configuration.n_symops > 1:
+            configuration.atoms.set_coordinates(xyz, fractionals=False)
+            continue
+        rowids = [
+            row[0]
+            for row in configuration.db.execute(
+                "SELECT co.rowid FROM coordinates AS co, atomset_atom AS aa"
+                " WHERE aa.atomset = ? AND co.atom = aa.atom"
+                "   AND co.configuration = ?"
+                " ORDER BY co.atom",
+                (configuration.atomset, configuration.id),
+            )
+        ]
+        if len(rowids) != len(xyz):
+            raise ValueError(
+                f"Configuration {configuration.id} has {len(rowids)} atoms, but "
+                f"there are {len(xyz)} coordinates."
+            )
+        parameters.extend(
+            (x, y, z, rowid)
+            for (x, y, z), rowid in zip(np.asarray(xyz).tolist(), rowids)
+        )
+    if len(parameters) > 0:
+        db = configurations[0].db
+        db.executemany(
+            "UPDATE coordinates SET x = ?, y = ?, z = ? WHERE rowid = ?", parameters
+        )
+        db.commit()
+
+
+def put_property(configuration, generic, value, model):
+    """Store a property for a configuration, creating the property if needed.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration.
+    generic : str
+        The generic property name, e.g. "total energy#QuickMin#{model}"
+    value : int, float or str
+        The value.
+    model : str
+        The model for the property.
+    """
+    _property = generic.format(model=model)
+    properties = configuration.properties
+    if not properties.exists(_property):
+        _type, units, description = properties.metadata(generic)
+        properties.add(
+            _property,
+            _type=_type,
+            units=units,
+            description=description.format(model=model),
+        )
+    properties.put(_property, value)
+
+
+def set_atom_data(
+    configuration, ff_name, gradients=None, charges=None, atom_types=None
+):
+    """Store per-atom results of a forcefield on the atoms, in one transaction.
+
+    The gradients go in the gradients of the configuration, and the charges and
+    atom types in the columns "charges_<ff_name>" and "atom_types_<ff_name>",
+    which are added if needed.
+
+    Parameters
+    ----------
+    configuration : molsystem._Configuration
+        The configuration, with the atoms in the same order as the values.
+    ff_name : str
+        The name of the forcefield.
+    gradients : numpy.ndarray = None
+        The (n_atoms, 3) Cartesian gradients in kJ/mol/Å.
+    charges : numpy.ndarray = None
+        The partial charges in e.
+    atom_types : [str] = None
+        The atom types.
+    """
+    atoms = configuration.atoms
+    columns = {}
+    if charges is not None:
+        columns[f"charges_{ff_name}"] = ("float", np.asarray(charges).tolist())
+    if atom_types is not None:
+        columns[f"atom_types_{ff_name}"] = ("str", list(atom_types))
+
+    with transaction(configuration.system_db):
+        if gradients is not None:
+            atoms.set_gradients(gradients, fractionals=False)
+        for key, (coltype, values) in columns.items():
+            if key not in atoms:
+                atoms.add_attribute(key, coltype=coltype, configuration_dependent=True)
+            atoms[key] = values
+
+
+class WriteBack(object):
+    """The coordinates and properties of many configurations, to write at once.
+
+    Parameters
+    ----------
+    system_db : molsystem.SystemDB
+        The database holding the configurations.
+    """
+
+    def __init__(self, system_db):
+        self.system_db = system_db
+        self._coordinates = []
+        self._properties = []
+
+    def __len__(self):
+        return len(self._coordinates) + len(self._properties)
+
+    def add(self, configuration, coordinates=None, properties=None, model=None):
+        """Add the results for a configuration.
+
+        Parameters
+        ----------
+        configuration : molsystem._Configuration
+            The configuration.
+        coordinates : numpy.ndarray = None
+            The new (n_atoms, 3) Cartesian coordinates in Å, if any.
+        properties : dict = None
+            The values of properties, keyed by generic name, e.g.
+            "total energy#QuickMin#{model}".
+        model : str = None
+            The model for the properties.
+        """
+        if coordinates is not None:
+            self._coordinates.append((configuration, coordinates))
+        for generic, value in (properties or {}).items():
+            self._properties.append((configuration, generic, value, model))
+
+    def write(self):
+        """Write everything added, in one transaction."""
+        with transaction(self.system_db):
+            if len(self._coordinates) > 0:
+                set_coordinates(*zip(*self._coordinates))
+            for configuration, generic, value, model in self._properties:
+                put_property(configuration, generic, value, model)
+        logger.debug(
+            f"Wrote {len(self._coordinates)} sets of coordinates and "
+            f"{len(self._properties)} properties."
+        )
+        self._coordinates = []
+        self._properties = []
@@ -0,0 +1,990 @@
+# -*- coding: utf-8 -*-
+
+"""Functions for using the OpenBabel forcefields directly with OBMol objects.
+
+These are independent of the flowchart so that they can be used both by the QuickMin
+step and by scripts or other tools that need energies and gradients for many
+structures.
+"""
+
+import concurrent.futures
+import ctypes
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import threading
+import time
+
+import numpy as np
+from openbabel import openbabel
+
+from seamm_util import Q_
+
+logger = logging.getLogger(__name__)
+
+# The forcefields tried, in order, for the "best available" forcefield.
+best_available = ("GAFF", "MMFF94s", "Ghemical", "UFF")
+
+# Where the atom types and charges are cached between runs
+typing_cache_directory = Path("~/.seamm.d/quickmin/typing")
+
+
+def forcefield_names(forcefield):
+    """The names of the OpenBabel forcefields to try, in order.
+
+    Parameters
+    ----------
+    forcefield : str
+        The forcefield as given in the parameters, e.g. "best available" or
+        "MMFF94 -- MMFF94 force field".
+
+    Returns
+    -------
+    (str)
+        The OpenBabel names of the forcefields.
+    """
+    if forcefield == "best available":
+        return best_available
+    return (forcefield.split()[0],)
+
+
+def setup_forcefield(obmol, forcefield="best available", constraints=None, log_level=1):
+    """Find the forcefield and set it up for the molecule.
+
+    The OpenBabel log goes to stderr, so the caller may want to capture it.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    forcefield : str = "best available"
+        The forcefield as given in the parameters.
+    constraints : openbabel.OBFFConstraints = None
+        Any constraints, such as fixed atoms.
+    log_level : int = 1
+        The OpenBabel log level.
+
+    Returns
+    -------
+    (openbabel.OBForceField, str)
+        The forcefield, setup for the molecule, and its name.
+    """
+    if constraints is None:
+        constraints = openbabel.OBFFConstraints()
+
+    names = forcefield_names(forcefield)
+    for ff_name in names:
+        obFF = openbabel.OBForceField.FindForceField(ff_name)
+
+        if obFF is None:
+            if len(names) == 1:
+                raise RuntimeError(f"Couldn't find forcefield '{ff_name}'")
+            logger.warning(f"Couldn't find forcefield '{ff_name}'")
+            continue
+
+        obFF.SetLogToStdErr()
+        obFF.SetLogLevel(log_level)
+        if obFF.Setup(obmol, constraints):
+            return obFF, ff_name
+
+    if len(names) == 1:
+        raise RuntimeError(f"Could not assign forcefield {ff_name} to the molecule")
+    raise RuntimeError("Could not find a forcefield for the molecule")
+
+
+def set_cutoff(obFF, cutoff):
+    """Use a cutoff for the nonbonded interactions, updating the pair list
+    only occasionally.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, which must already be setup.
+    cutoff : float
+        The cutoff for the van der Waals interactions, in Å. The cutoff for the
+        electrostatics is 1.5 times larger.
+    """
+    obFF.EnableCutOff(True)
+    obFF.SetVDWCutOff(cutoff)
+    obFF.SetElectrostaticCutOff(1.5 * cutoff)
+    obFF.SetUpdateFrequency(10)
+    obFF.UpdatePairsSimple()
+
+
+def ensure_coordinate_array(obmol):
+    """Make sure that the molecule has its array of coordinates.
+
+    Molecules built atom by atom, as by molsystem, keep the coordinates in the atoms
+    until the array is created, and e.g. OBMol.SetTorsion crashes without it.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    """
+    if obmol.GetCoordinates() is None:
+        obmol.BeginModify()
+        obmol.EndModify()
+
+
+def get_coordinates(obmol):
+    """The coordinates of the molecule as an (n_atoms, 3) array, in Å.
+
+    If the molecule has its array of coordinates, it is copied in one go rather
+    than atom by atom, which is much faster.
+    """
+    n_atoms = obmol.NumAtoms()
+    pointer = obmol.GetCoordinates()
+    if pointer is not None and n_atoms > 0:
+        array = (ctypes.c_double * (3 * n_atoms)).from_address(int(pointer))
+        return np.array(array).reshape(n_atoms, 3)
+    return np.array(
+        [
+            [atom.GetX(), atom.GetY(), atom.GetZ()]
+            for atom in openbabel.OBMolAtomIter(obmol)
+        ]
+    )
+
+
+def set_coordinates(obmol, xyz):
+    """Set the coordinates of the molecule from an (n_atoms, 3) array, in Å."""
+    for atom, (x, y, z) in zip(
+        openbabel.OBMolAtomIter(obmol), np.asarray(xyz).tolist()
+    ):
+        atom.SetVector(x, y, z)
+
+
+def get_gradients(obFF, obmol):
+    """The gradients from the last energy evaluation.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, after calling Energy(True).
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n_atoms, 3) gradients in kJ/mol/Å.
+    """
+    # These appear to be forces, so negate
+    factor = -Q_(1.0, obFF.GetUnit()).m_as("kJ/mol")
+    gradients = []
+    for atom in openbabel.OBMolAtomIter(obmol):
+        # vector objects have to be de-referenced individually (sigh)
+        grad = obFF.GetGradient(atom)
+        gradients.append([grad.GetX(), grad.GetY(), grad.GetZ()])
+    return factor * np.array(gradients)
+
+
+def get_atom_types(obFF, obmol):
+    """The atom types assigned by the forcefield.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, set up for the molecule.
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    [str]
+        The atom type of each atom.
+    """
+    obFF.GetAtomTypes(obmol)
+    return [
+        atom.GetData("FFAtomType").GetValue() if atom.HasData("FFAtomType") else ""
+        for atom in openbabel.OBMolAtomIter(obmol)
+    ]
+
+
+def get_partial_charges(obFF, obmol):
+    """The partial charges used by the forcefield.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, set up for the molecule.
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    numpy.ndarray
+        The partial charge of each atom, in e.
+    """
+    obFF.GetPartialCharges(obmol)
+    charges = []
+    for atom in openbabel.OBMolAtomIter(obmol):
+        if atom.HasData("FFPartialCharge"):
+            charges.append(float(atom.GetData("FFPartialCharge").GetValue()))
+        else:
+            charges.append(atom.GetPartialCharge())
+    return np.array(charges)
+
+
+def get_typing(obmol, ff_name, obFF=None, cache=None):
+    """The atom types and partial charges from the forcefield, cached if possible.
+
+    OpenBabel always types the molecule when setting up the forcefield, ignoring
+    any types already on the atoms, so with the forcefield already set up they are
+    simply read from it and the cache is not used. Otherwise they are taken from
+    the cache, and only if they are not there is the forcefield set up, which can
+    take a while for large molecules, and the results cached.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    ff_name : str
+        The OpenBabel name of the forcefield.
+    obFF : openbabel.OBForceField = None
+        The forcefield, if already set up for the molecule.
+    cache : TypingCache = None
+        The cache of atom types and charges to use, if any.
+
+    Returns
+    -------
+    ([str], numpy.ndarray)
+        The atom type and partial charge of each atom.
+    """
+    if obFF is not None:
+        return get_atom_types(obFF, obmol), get_partial_charges(obFF, obmol)
+
+    if cache is not None:
+        typing = cache.get(obmol, ff_name)
+        if typing is not None:
+            return typing
+    obFF, ff_name = setup_forcefield(obmol, ff_name, log_level=0)
+    atom_types = get_atom_types(obFF, obmol)
+    charges = get_partial_charges(obFF, obmol)
+    if cache is not None:
+        cache.put(obmol, ff_name, atom_types, charges)
+    return atom_types, charges
+
+
+def calculate(
+    obmol,
+    forcefield="best available",
+    calculation="optimization",
+    n_steps=1000,
+    cutoff=6.0,
+    setup=None,
+    callback=None,
+):
+    """Minimize the molecule or calculate its energy, as the QuickMin step does.
+
+    The OpenBabel log goes to stderr, so the caller may want to capture it.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule, which is updated with the minimized coordinates.
+    forcefield : str = "best available"
+        The forcefield as given in the parameters.
+    calculation : str = "optimization"
+        "optimization", "hydrogens only" or "single-point energy".
+    n_steps : int = 1000
+        The maximum number of steps.
+    cutoff : float = 6.0
+        The nonbonded cutoff in Å, used when only minimizing the hydrogens.
+    setup : (openbabel.OBForceField, str) = None
+        A forcefield and its name already setup for this molecule and calculation,
+        which is reused rather than setting up a new one. OpenBabel has only one
+        instance of each forcefield, so this must be the last setup done with it.
+    callback : callable = None
+        If given, the minimization is done in chunks with `minimize`, calling
+        callback(obFF, steps) after each chunk, and can be stopped by it.
+
+    Returns
+    -------
+    dict
+        The "energy" in the "units" of the forcefield, the "gradients" in kJ/mol/Å,
+        the "forcefield", the number of "n mobile atoms", the "setup" for reuse,
+        and the "timings" in seconds of the "setup", "minimization" and
+        "gradients". With a callback, whether the minimization "converged" and the
+        "n steps" too.
+    """
+    minimizing = calculation in ("optimization", "hydrogens only")
+    timings = {}
+    t0 = time.perf_counter()
+
+    # Fix all the heavy atoms if only minimizing the hydrogens
+    constraints = openbabel.OBFFConstraints()
+    n_mobile = 0
+    for atom in openbabel.OBMolAtomIter(obmol):
+        if calculation != "hydrogens only" or atom.GetAtomicNum() == 1:
+            n_mobile += 1
+        else:
+            constraints.AddAtomConstraint(atom.GetIdx())
+
+    if setup is None:
+        obFF, ff_name = setup_forcefield(obmol, forcefield, constraints=constraints)
+        if calculation == "hydrogens only":
+            set_cutoff(obFF, cutoff)
+        else:
+            # The cutoff stays on from any earlier calculation
+            obFF.EnableCutOff(False)
+    else:
+        obFF, ff_name = setup
+        obFF.SetConstraints(constraints)
+        obFF.SetCoordinates(obmol)
+    t1 = time.perf_counter()
+    timings["setup"] = t1 - t0
+
+    result = {}
+    if minimizing and callback is not None:
+        energy, result["converged"], result["n steps"] = minimize(
+            obFF, obmol, n_steps=n_steps, callback=callback
+        )
+    elif minimizing:
+        obFF.ConjugateGradients(n_steps)
+        obFF.GetCoordinates(obmol)
+    t2 = time.perf_counter()
+    if minimizing:
+        timings["minimization"] = t2 - t1
+
+    result.update(
+        {
+            "energy": obFF.Energy(True),
+            "units": obFF.GetUnit(),
+            "gradients": get_gradients(obFF, obmol),
+            "forcefield": ff_name,
+            "n mobile atoms": n_mobile,
+            "setup": (obFF, ff_name),
+        }
+    )
+    timings["gradients"] = time.perf_counter() - t2
+    result["timings"] = timings
+    return result
+
+
+class CancellationToken(object):
+    """A callback for `minimize` that stops it on request or when out of time.
+
+    `cancel` may be called from another thread, e.g. by a job manager, and the
+    minimization stops at the end of the current chunk of steps. The conjugate
+    gradients only take steps that lower the energy, so the coordinates then are
+    the best so far.
+
+    Parameters
+    ----------
+    time_budget : float = None
+        The wall-clock time in seconds from the creation of the token after which
+        to stop, or None for no limit.
+    """
+
+    def __init__(self, time_budget=None):
+        self.time_budget = time_budget
+        if time_budget is None:
+            self.deadline = None
+        else:
+            self.deadline = time.monotonic() + time_budget
+        # Why the minimization was stopped, if it was
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def __call__(self, obFF, steps):
+        if self._cancelled.is_set():
+            self.reason = "it was cancelled"
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = f"the time budget of {self.time_budget} s ran out"
+        return self.reason is not None
+
+    @property
+    def cancelled(self):
+        """Whether `cancel` has been called."""
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Ask for the minimization to stop."""
+        self._cancelled.set()
+
+
+class Checkpoint(object):
+    """A callback for `minimize` that saves the coordinates every so often.
+
+    The checkpoint is a small NumPy .npz file with the coordinates, the number of
+    steps taken and a key identifying the input. It is written to a temporary file
+    that then replaces the old checkpoint, so there is always a complete checkpoint
+    even if the job is killed while writing. OpenBabel does not expose the state of
+    the conjugate gradients, so a restart begins with a steepest descent step, as
+    the conjugate gradients do anyway whenever they reset.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The checkpoint file.
+    obmol : openbabel.OBMol
+        The molecule being minimized.
+    key : str
+        Identifies the input, from `Checkpoint.make_key`.
+    interval : int = 100
+        The number of steps between checkpoints.
+    steps_done : int = 0
+        The number of steps already taken, when restarting.
+    """
+
+    def __init__(self, path, obmol, key, interval=100, steps_done=0):
+        self.path = Path(path)
+        self.obmol = obmol
+        self.key = key
+        self.interval = interval
+        self.steps_done = steps_done
+        self._last = 0
+
+    def __call__(self, obFF, steps):
+        if steps - self._last >= self.interval:
+            self._last = steps
+            obFF.GetCoordinates(self.obmol)
+            self.save(get_coordinates(self.obmol), self.steps_done + steps)
+        return False
+
+    @staticmethod
+    def make_key(obmol, *settings):
+        """A key for the molecule, its coordinates and the settings.
+
+        Parameters
+        ----------
+        obmol : openbabel.OBMol
+            The molecule, with its starting coordinates.
+        settings : str
+            Anything else that must match to restart, such as the forcefield.
+
+        Returns
+        -------
+        str
+            The key.
+        """
+        sha = hashlib.sha256(topology_hash(obmol).encode())
+        sha.update(get_coordinates(obmol).tobytes())
+        for setting in settings:
+            sha.update(str(setting).encode())
+        return sha.hexdigest()
+
+    @staticmethod
+    def load(path, key):
+        """Read the checkpoint, if there is one for this input.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The checkpoint file.
+        key : str
+            The key of the input, from `Checkpoint.make_key`.
+
+        Returns
+        -------
+        (int, numpy.ndarray) or None
+            The number of steps taken and the coordinates, or None if there is no
+            checkpoint for this input.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) != key:
+                    return None
+                return int(data["steps"]), data["coordinates"]
+        except Exception as e:
+            logger.warning(f"Ignoring the unreadable checkpoint {path}: {e}")
+            return None
+
+    def save(self, coordinates, steps):
+        """Write the checkpoint atomically."""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as fd:
+            np.savez(fd, key=self.key, steps=steps, coordinates=coordinates)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        """Remove the checkpoint, once the minimization is finished."""
+        self.path.unlink(missing_ok=True)
+
+
+class TypingCache(object):
+    """Atom types and partial charges kept on disk, for reuse by later runs.
+
+    Each entry is a small JSON file named by a hash of the topology of the
+    molecule, the forcefield and the version of OpenBabel, so a new version of
+    OpenBabel, which might type differently, or another forcefield does not find
+    the old entries. The files are written atomically, so several jobs can share
+    the cache.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path = typing_cache_directory
+        The directory for the cache.
+    version : str = None
+        The version of OpenBabel, by default that running.
+    """
+
+    def __init__(self, directory=typing_cache_directory, version=None):
+        self.directory = Path(directory).expanduser()
+        self.version = openbabel.OBReleaseVersion() if version is None else version
+
+    def key(self, obmol, ff_name):
+        """The key for the molecule and forcefield."""
+        sha = hashlib.sha256(topology_hash(obmol).encode())
+        sha.update(f"{ff_name} {self.version}".encode())
+        return sha.hexdigest()
+
+    def get(self, obmol, ff_name):
+        """The cached atom types and charges, or None if not cached.
+
+        Parameters
+        ----------
+        obmol : openbabel.OBMol
+            The molecule.
+        ff_name : str
+            The OpenBabel name of the forcefield.
+
+        Returns
+        -------
+        ([str], numpy.ndarray) or None
+            The atom type and partial charge of each atom.
+        """
+        path = self.directory / f"{self.key(obmol, ff_name)}.json"
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text())
+        except Exception as e:
+            logger.warning(f"Ignoring the unreadable cached typing {path}: {e}")
+            return None
+        if (
+            data.get("forcefield") != ff_name
+            or data.get("version") != self.version
+            or len(data.get("atom types", [])) != obmol.NumAtoms()
+        ):
+            return None
+        return data["atom types"], np.array(data["charges"])
+
+    def put(self, obmol, ff_name, atom_types, charges):
+        """Add the atom types and charges for a molecule to the cache.
+
+        Parameters
+        ----------
+        obmol : openbabel.OBMol
+            The molecule.
+        ff_name : str
+            The OpenBabel name of the forcefield.
+        atom_types : [str]
+            The atom type of each atom.
+        charges : numpy.ndarray
+            The partial charge of each atom.
+        """
+        data = {
+            "forcefield": ff_name,
+            "version": self.version,
+            "atom types": list(atom_types),
+            "charges": np.asarray(charges).tolist(),
+        }
+        path = self.directory / f"{self.key(obmol, ff_name)}.json"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not cache the typing in {path}: {e}")
+
+
+def minimize(obFF, obmol, n_steps=1000, chunk=10, callback=None):
+    """Minimize with conjugate gradients, checking for convergence as it goes.
+
+    Rather than running all the steps in one call to OpenBabel, the steps are taken
+    in chunks so that the minimization can be monitored, and stopped early.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, already setup for the molecule.
+    obmol : openbabel.OBMol
+        The molecule, which is updated with the minimized coordinates.
+    n_steps : int = 1000
+        The maximum number of steps.
+    chunk : int = 10
+        The number of steps to take between checks.
+    callback : callable = None
+        Called as callback(obFF, steps) after each chunk of steps that does not
+        converge. If it returns True the minimization stops, unconverged.
+
+    Returns
+    -------
+    (float, bool, int)
+        The energy in kJ/mol, whether the minimization converged, and the number of
+        steps, which is accurate to within the chunk size.
+    """
+    obFF.SetCoordinates(obmol)
+    # Ask for one more step than will be taken, so that OpenBabel stopping
+    # early always means that it converged.
+    obFF.ConjugateGradientsInitialize(n_steps + 1)
+    steps = 0
+    converged = False
+    while steps < n_steps:
+        n = min(chunk, n_steps - steps)
+        steps += n
+        if not obFF.ConjugateGradientsTakeNSteps(n):
+            converged = True
+            break
+        if callback is not None and callback(obFF, steps):
+            break
+    obFF.GetCoordinates(obmol)
+    energy = Q_(obFF.Energy(False), obFF.GetUnit()).m_as("kJ/mol")
+
+    return energy, converged, steps
+
+
+def minimize_many(obFF, obmol, coordinates, n_steps=1000, out=None, gradients=None):
+    """Minimize a series of structures of the same molecule with one setup.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, already setup for the molecule.
+    obmol : openbabel.OBMol
+        The molecule, which must have the same atoms as the structures.
+    coordinates : iterable of (n_atoms, 3) arrays
+        The starting coordinates of the structures, in Å.
+    n_steps : int = 1000
+        The maximum number of steps for each structure.
+    out : numpy.ndarray = None
+        An (n_structures, n_atoms, 3) array for the minimized coordinates, which
+        may be `coordinates` itself. By default a new array is returned.
+    gradients : numpy.ndarray = None
+        An (n_structures, n_atoms, 3) array to fill with the gradients in kJ/mol/Å
+        at the minimized coordinates.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The energies in kJ/mol, whether each converged, and the (n_structures,
+        n_atoms, 3) minimized coordinates in Å.
+    """
+    energies = []
+    converged = []
+    minimized = []
+    for i, xyz in enumerate(coordinates):
+        set_coordinates(obmol, xyz)
+        energy, done, steps = minimize(obFF, obmol, n_steps=n_steps)
+        energies.append(energy)
+        converged.append(done)
+        if out is None:
+            minimized.append(get_coordinates(obmol))
+        else:
+            out[i] = get_coordinates(obmol)
+        if gradients is not None:
+            obFF.Energy(True)
+            gradients[i] = get_gradients(obFF, obmol)
+    if out is None:
+        out = np.array(minimized).reshape(-1, obmol.NumAtoms(), 3)
+    return np.array(energies), np.array(converged, dtype=bool), out
+
+
+def energy_scan(obFF, obmol, coordinates, gradients=False, writer=None):
+    """Evaluate the energy of a series of structures with one forcefield setup.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, already setup for the molecule.
+    obmol : openbabel.OBMol
+        The molecule, which must have the same atoms as the structures.
+    coordinates : iterable of (n_atoms, 3) arrays
+        The coordinates of the structures, in Å. This may be a generator, a list,
+        or a 3-D NumPy array.
+    gradients : bool = False
+        Whether to also return the gradients.
+    writer : results.ResultsWriter = None
+        If given, the "point", "energy" and any "gradients" of each structure are
+        written to it as they are calculated, and the gradients are not kept.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray or None)
+        The energies in kJ/mol, and the (n_points, n_atoms, 3) gradients in
+        kJ/mol/Å if requested and not written.
+    """
+    n_atoms = obmol.NumAtoms()
+    factor = Q_(1.0, obFF.GetUnit()).m_as("kJ/mol")
+
+    energies = []
+    all_gradients = []
+    for point, xyz in enumerate(coordinates):
+        xyz = np.asarray(xyz, dtype=float)
+        if xyz.shape != (n_atoms, 3):
+            raise ValueError(
+                f"Structure {point + 1} has shape {xyz.shape}, but {n_atoms} atoms "
+                "were expected."
+            )
+        set_coordinates(obmol, xyz)
+        obFF.SetCoordinates(obmol)
+        energies.append(factor * obFF.Energy(gradients))
+        if writer is not None:
+            record = {"point": point + 1, "energy": energies[-1]}
+            if gradients:
+                record["gradients"] = get_gradients(obFF, obmol)
+            writer.write(record)
+        elif gradients:
+            all_gradients.append(get_gradients(obFF, obmol))
+
+    if gradients and writer is None:
+        return np.array(energies), np.array(all_gradients).reshape(-1, n_atoms, 3)
+    return np.array(energies), None
+
+
+def read_trajectory(path):
+    """Read the coordinates of the structures in a file, one at a time.
+
+    The file may be any multi-structure format that OpenBabel understands, such as
+    .xyz, .sdf or .pdb, or a NumPy .npy file containing an (n_points, n_atoms, 3)
+    array, which is memory-mapped rather than read in.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The path to the file.
+
+    Yields
+    ------
+    numpy.ndarray
+        The (n_atoms, 3) coordinates of each structure in Å.
+    """
+    path = Path(path).expanduser()
+    if not path.exists():
+        raise FileNotFoundError(f"The trajectory file '{path}' does not exist.")
+
+    if path.suffix == ".npy":
+        data = np.load(path, mmap_mode="r")
+        if data.ndim != 3 or data.shape[2] != 3:
+            raise ValueError(
+                f"The array in '{path}' has shape {data.shape}, not "
+                "(n_points, n_atoms, 3)."
+            )
+        yield from data
+        return
+
+    obConversion = openbabel.OBConversion()
+    if not obConversion.SetInFormat(path.suffix[1:]):
+        raise ValueError(f"OpenBabel cannot read files of type '{path.suffix}'.")
+    obmol = openbabel.OBMol()
+    more = obConversion.ReadFile(obmol, str(path))
+    while more:
+        yield get_coordinates(obmol)
+        obmol = openbabel.OBMol()
+        more = obConversion.Read(obmol)
+
+
+def topology_hash(obmol):
+    """A hash of the atoms, charges and bonds of the molecule, but not coordinates.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+
+    Returns
+    -------
+    str
+        The hash, as hexadecimal.
+    """
+    items = [
+        f"{atom.GetAtomicNum()},{atom.GetFormalCharge()}"
+        for atom in openbabel.OBMolAtomIter(obmol)
+    ]
+    items.append(";")
+    items.extend(
+        f"{bond.GetBeginAtomIdx()}-{bond.GetEndAtomIdx()},{bond.GetBondOrder()}"
+        for bond in openbabel.OBMolBondIter(obmol)
+    )
+    return hashlib.sha256(" ".join(items).encode()).hexdigest()
+
+
+def obmol_to_text(obmol, fmt="sdf"):
+    """Write the molecule as text, e.g. to pass it to another process.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    fmt : str = "sdf"
+        The OpenBabel format.
+
+    Returns
+    -------
+    str
+        The molecule as text.
+    """
+    obConversion = openbabel.OBConversion()
+    obConversion.SetOutFormat(fmt)
+    return obConversion.WriteString(obmol)
+
+
+def obmol_from_text(text, fmt="sdf"):
+    """Create a molecule from text written by `obmol_to_text`.
+
+    Parameters
+    ----------
+    text : str
+        The molecule as text.
+    fmt : str = "sdf"
+        The OpenBabel format.
+
+    Returns
+    -------
+    openbabel.OBMol
+        The molecule.
+    """
+    obConversion = openbabel.OBConversion()
+    obConversion.SetInFormat(fmt)
+    obmol = openbabel.OBMol()
+    if not obConversion.ReadString(obmol, text):
+        raise ValueError(f"Could not read the molecule from the {fmt} text.")
+    return obmol
+
+
+def torsion_drive(
+    obFF, obmol, atoms, angles, n_steps=1000, tolerance=0.5, max_rounds=3
+):
+    """Minimize with the torsion restrained to each angle in turn.
+
+    Each point starts from the minimized structure of the previous one, with the
+    torsion rotated to the new angle, and the forcefield is only setup once.
+
+    OpenBabel's torsion constraint only acts through the gradient, and does not hold
+    the torsion at all firmly, so after each minimization the torsion is rotated
+    back to the angle and the structure minimized again, up to `max_rounds` times.
+    If it still drifts further than the tolerance, the structure, by then close to
+    relaxed, is finished by minimizing with the four torsion atoms fixed.
+
+    Parameters
+    ----------
+    obFF : openbabel.OBForceField
+        The forcefield, already setup for the molecule.
+    obmol : openbabel.OBMol
+        The molecule, which is updated to the structure at the last point.
+    atoms : [int]
+        The 1-based indices of the four atoms defining the torsion.
+    angles : [float]
+        The torsion angles, in degrees.
+    n_steps : int = 1000
+        The maximum number of minimization steps for each point.
+    tolerance : float = 0.5
+        How far in degrees the torsion may end from the angle.
+    max_rounds : int = 3
+        The number of times to minimize with the torsion constraint before fixing
+        the torsion atoms.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The energies in kJ/mol, the actual torsion angles in degrees, and the
+        (n_points, n_atoms, 3) coordinates in Å.
+    """
+    factor = Q_(1.0, obFF.GetUnit()).m_as("kJ/mol")
+    ensure_coordinate_array(obmol)
+    obatoms = [obmol.GetAtom(i) for i in atoms]
+    if any(atom is None for atom in obatoms):
+        raise ValueError(f"The torsion atoms {atoms} are not all in the molecule.")
+
+    energies = []
+    torsions = []
+    coordinates = []
+    fixed = openbabel.OBFFConstraints()
+    for atom in atoms:
+        fixed.AddAtomConstraint(atom)
+    for angle in angles:
+        constraints = openbabel.OBFFConstraints()
+        constraints.AddTorsionConstraint(*atoms, float(angle))
+        for _ in range(max_rounds):
+            obmol.SetTorsion(*obatoms, math.radians(angle))
+            obFF.SetConstraints(constraints)
+            obFF.SetCoordinates(obmol)
+            obFF.ConjugateGradients(n_steps)
+            obFF.GetCoordinates(obmol)
+            if abs(angle_difference(obmol.GetTorsion(*obatoms), angle)) <= tolerance:
+                break
+        else:
+            obmol.SetTorsion(*obatoms, math.radians(angle))
+            obFF.SetConstraints(fixed)
+            obFF.SetCoordinates(obmol)
+            obFF.ConjugateGradients(n_steps)
+            obFF.GetCoordinates(obmol)
+
+        torsion = obmol.GetTorsion(*obatoms)
+        if abs(angle_difference(torsion, angle)) > tolerance:
+            logger.warning(
+                f"The torsion ended at {torsion:.1f}° rather than {angle:.1f}°"
+            )
+        energies.append(factor * obFF.Energy(False))
+        torsions.append(torsion)
+        coordinates.append(get_coordinates(obmol))
+
+    obFF.SetConstraints(openbabel.OBFFConstraints())
+
+    return np.array(energies), np.array(torsions), np.array(coordinates)
+
+
+def angle_difference(a, b):
+    """The difference a - b between two angles in degrees, in [-180, 180)."""
+    return (a - b + 180.0) % 360.0 - 180.0
+
+
+def _torsion_drive_worker(text, ff_name, atoms, angles, n_steps):
+    """Run `torsion_drive` in another process, starting from the molecule as text."""
+    obmol = obmol_from_text(text)
+    obFF, ff_name = setup_forcefield(obmol, ff_name, log_level=0)
+    return torsion_drive(obFF, obmol, atoms, angles, n_steps=n_steps)
+
+
+def torsion_drive_from_both_ends(obmol, ff_name, atoms, angles, n_steps=1000):
+    """Run the torsion drive as two halves in parallel, each from one end of the grid.
+
+    Both halves start from the structure in `obmol` and are warm-started from
+    point to point towards the middle of the grid.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    ff_name : str
+        The OpenBabel name of the forcefield.
+    atoms : [int]
+        The 1-based indices of the four atoms defining the torsion.
+    angles : [float]
+        The torsion angles, in degrees.
+    n_steps : int = 1000
+        The maximum number of minimization steps for each point.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The energies in kJ/mol, the actual torsion angles in degrees, and the
+        (n_points, n_atoms, 3) coordinates in Å, in the order of `angles`.
+    """
+    angles = list(angles)
+    middle = (len(angles) + 1) // 2
+    text = obmol_to_text(obmol)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        forward = executor.submit(
+            _torsion_drive_worker, text, ff_name, atoms, angles[:middle], n_steps
+        )
+        backward = executor.submit(
+            _torsion_drive_worker, text, ff_name, atoms, angles[middle:][::-1], n_steps
+        )
+        first = forward.result()
+        second = backward.result()
+
+    return tuple(
+        np.concatenate((a, b[::-1])) if len(b) > 0 else a for a, b in zip(first, second)
+    )
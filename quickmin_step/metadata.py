@@ -98,44 +98,178 @@ metadata["results"] = {
         "dimensionality": "scalar",
         "type": "boolean",
     },
+    "n mobile atoms": {
+        "calculation": ["optimization", "hydrogens only"],
+        "description": "The number of atoms free to move",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "n points": {
+        "calculation": ["energy scan", "torsion scan"],
+        "description": "The number of structures in the scan",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "energies": {
+        "calculation": ["energy scan"],
+        "description": "The energies of the structures in the scan",
+        "dimensionality": "[n_points]",
+        "type": "float",
+        "units": "kJ/mol",
+    },
+    "scan gradients": {
+        "calculation": ["energy scan"],
+        "description": "The gradients of the structures in the scan",
+        "dimensionality": "[n_points, n_atoms, 3]",
+        "type": "float",
+        "units": "kJ/mol/Å",
+    },
+    "torsion angles": {
+        "calculation": ["torsion scan"],
+        "description": "The torsion angles of the minimized structures",
+        "dimensionality": "[n_points]",
+        "type": "float",
+        "units": "degree",
+    },
+    "torsion energies": {
+        "calculation": ["torsion scan"],
+        "description": "The energy profile of the torsion scan",
+        "dimensionality": "[n_points]",
+        "type": "float",
+        "units": "kJ/mol",
+    },
+    "n rotamers": {
+        "calculation": ["conformer search"],
+        "description": "The number of rotamers minimized",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "n pruned": {
+        "calculation": ["conformer search"],
+        "description": "The number of rotamers dropped for being high in energy",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "n conformers": {
+        "calculation": ["conformer search"],
+        "description": "The number of unique conformers kept",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "conformer energies": {
+        "calculation": ["conformer search"],
+        "description": "The energies of the unique conformers",
+        "dimensionality": "[n_conformers]",
+        "type": "float",
+        "units": "kJ/mol",
+    },
+    "n structures": {
+        "calculation": ["funnel screening"],
+        "description": "The number of structures screened",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "n tight": {
+        "calculation": ["funnel screening"],
+        "description": "The number of structures fully minimized",
+        "dimensionality": "scalar",
+        "type": "integer",
+    },
+    "screening energies": {
+        "calculation": ["funnel screening"],
+        "description": "The energies of the screened structures",
+        "dimensionality": "[n_structures]",
+        "type": "float",
+        "units": "kJ/mol",
+    },
+    "screening tiers": {
+        "calculation": ["funnel screening"],
+        "description": "Whether each energy is 'loose', 'tight' or 'failed'",
+        "dimensionality": "[n_structures]",
+        "type": "string",
+    },
+    "screening converged": {
+        "calculation": ["funnel screening"],
+        "description": "Whether the minimization of each structure converged",
+        "dimensionality": "[n_structures]",
+        "type": "boolean",
+    },
     "RMSD": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "RMSD with H removed",
         "dimensionality": "scalar",
         "type": "float",
         "units": "Å",
     },
     "displaced atom": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "Atom index with largest displacement",
         "dimensionality": "scalar",
         "type": "int",
     },
     "maximum displacement": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "Maximum displacement of an atom",
         "dimensionality": "scalar",
         "type": "float",
         "units": "Å",
     },
     "RMSD with H": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "RMSD including H atoms",
         "dimensionality": "scalar",
         "type": "float",
         "units": "Å",
     },
     "displaced atom with H": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "Atom index with largest displacement, including H",
         "dimensionality": "scalar",
         "type": "int",
     },
     "maximum displacement with H": {
-        "calculation": ["optimization"],
+        "calculation": ["optimization", "hydrogens only"],
         "description": "Maximum displacement of an atom, including H",
         "dimensionality": "scalar",
         "type": "float",
         "units": "Å",
     },
+    "conversion time": {
+        "description": "Time to convert the structure for OpenBabel",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "setup time": {
+        "description": "Time to set up the forcefield",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "minimization time": {
+        "calculation": ["optimization", "hydrogens only"],
+        "description": "Time for the minimization",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "gradients time": {
+        "description": "Time to calculate the final energy and gradients",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "RMSD time": {
+        "calculation": ["optimization", "hydrogens only"],
+        "description": "Time to calculate the RMSDs",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "s",
+    },
+    "peak RSS": {
+        "description": "The peak resident memory of the process",
+        "dimensionality": "scalar",
+        "type": "float",
+        "units": "MiB",
+    },
 }
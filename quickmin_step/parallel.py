@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+
+"""Running many minimizations in a pool of processes.
+
+The OpenBabel forcefields are not thread-safe, so the work is spread over processes.
+For many structures of the same molecule, each worker process reads the molecule and
+sets up the forcefield once, when it starts. The coordinates and gradients are
+passed through blocks of shared memory rather than being pickled, so the tasks
+carry only which structures to minimize. Different molecules are passed to the
+workers as SDF text.
+"""
+
+import concurrent.futures
+import logging
+import math
+from multiprocessing import shared_memory
+import os
+import time
+
+import numpy as np
+
+from . import cost
+from . import forcefield
+from . import supervisor
+
+logger = logging.getLogger(__name__)
+
+# The molecule and forcefield in each worker process
+_obmol = None
+_obFF = None
+
+# The blocks of shared memory attached to in each worker process, by name
+_shared = {}
+
+
+def n_workers(n_processes=None):
+    """The number of worker processes to use.
+
+    Parameters
+    ----------
+    n_processes : int or str = None
+        The number requested. None, "all" or a number less than 1 means all the
+        available cores.
+
+    Returns
+    -------
+    int
+        The number of processes.
+    """
+    if n_processes is None or n_processes == "all":
+        n_processes = 0
+    n_processes = int(n_processes)
+    if n_processes < 1:
+        try:
+            n_processes = len(os.sched_getaffinity(0))
+        except AttributeError:
+            n_processes = os.cpu_count() or 1
+    return n_processes
+
+
+def _initialize_worker(text, ff_name):
+    """Read the molecule and setup the forcefield in a worker process."""
+    global _obmol, _obFF
+
+    _obmol = forcefield.obmol_from_text(text)
+    _obFF, ff_name = forcefield.setup_forcefield(_obmol, ff_name, log_level=0)
+
+
+class SharedArray(object):
+    """A NumPy array in a block of shared memory, which workers can attach to.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array.
+    dtype : numpy.dtype = float
+        The type of the elements.
+    """
+
+    def __init__(self, shape, dtype=float):
+        dtype = np.dtype(dtype)
+        size = max(1, math.prod(shape) * dtype.itemsize)
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self._memory.buf)
+        # The name, shape and type, for attaching to the array in another process
+        self.descriptor = (self._memory.name, tuple(shape), dtype.str)
+
+    def close(self):
+        """Free the shared memory. Any views of the array must be released first."""
+        if self._memory is not None:
+            self.array = None
+            self._memory.unlink()
+            self._memory.close()
+            self._memory = None
+
+
+def _attach(descriptor):
+    """The array in shared memory described by the descriptor, in a worker."""
+    name, shape, dtype = descriptor
+    if name not in _shared:
+        _shared[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_shared[name].buf)
+
+
+def _minimize_block(coordinates, gradients, start, stop, n_steps):
+    """Minimize a block of structures in shared memory in a worker process."""
+    # Let go of any blocks from earlier calls, which the pool may have freed
+    for name in [*_shared]:
+        if name not in (coordinates[0], gradients and gradients[0]):
+            _shared.pop(name).close()
+
+    xyz = _attach(coordinates)[start:stop]
+    grad = None if gradients is None else _attach(gradients)[start:stop]
+    energies, converged, xyz = forcefield.minimize_many(
+        _obFF, _obmol, xyz, n_steps=n_steps, out=xyz, gradients=grad
+    )
+    return energies, converged
+
+
+class MinimizerPool(object):
+    """A pool of processes for minimizing many structures of one molecule.
+
+    Use it as a context manager, so that the processes are shut down afterwards::
+
+        with MinimizerPool(obmol, "MMFF94s") as pool:
+            energies, converged, xyz = pool.minimize(coordinates, n_steps=100)
+
+    With one process the minimizations are done in this process, with no pool.
+    Otherwise the coordinates and gradients are exchanged with the workers through
+    shared memory owned by the pool, and the arrays returned are views of it, which
+    are only valid until the next minimization or until the pool is closed.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    ff_name : str
+        The OpenBabel name of the forcefield.
+    n_processes : int or str = None
+        The number of processes, defaulting to all the cores.
+    block_size : int = None
+        The number of structures in each task. By default there are about four tasks
+        per process, to balance the load, but no more than 100 structures in a task.
+    """
+
+    def __init__(self, obmol, ff_name, n_processes=None, block_size=None):
+        self.obmol = obmol
+        self.ff_name = ff_name
+        self.n_processes = n_workers(n_processes)
+        self.block_size = block_size
+        self._executor = None
+        self._obFF = None
+        self._buffers = {}
+
+    def __enter__(self):
+        if self.n_processes > 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.n_processes,
+                initializer=_initialize_worker,
+                initargs=(forcefield.obmol_to_text(self.obmol), self.ff_name),
+            )
+        else:
+            self._obFF, self.ff_name = forcefield.setup_forcefield(
+                self.obmol, self.ff_name, log_level=0
+            )
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        for buffer in self._buffers.values():
+            buffer.close()
+        self._buffers = {}
+
+    def _buffer(self, name, shape):
+        """A view of a shared array big enough for the shape, reusing one if possible.
+
+        The arrays are not shrunk, so that minimizing fewer structures, as when
+        pruning, does not need new shared memory.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.array.shape[0] < shape[0]:
+            if buffer is not None:
+                buffer.close()
+            buffer = self._buffers[name] = SharedArray(shape)
+        return buffer, buffer.array[: shape[0]]
+
+    def minimize(self, coordinates, n_steps=1000, gradients=False):
+        """Minimize the structures.
+
+        Parameters
+        ----------
+        coordinates : numpy.ndarray
+            The (n_structures, n_atoms, 3) starting coordinates in Å.
+        n_steps : int = 1000
+            The maximum number of steps for each structure.
+        gradients : bool = False
+            Whether to also return the gradients at the minimized coordinates.
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray[, numpy.ndarray])
+            The energies in kJ/mol, whether each converged, the minimized
+            coordinates in Å, and if requested the gradients in kJ/mol/Å, in the
+            same order as the input.
+        """
+        coordinates = np.asarray(coordinates, dtype=float)
+        n_structures = coordinates.shape[0]
+
+        if self._executor is None:
+            grad = np.zeros_like(coordinates) if gradients else None
+            result = forcefield.minimize_many(
+                self._obFF, self.obmol, coordinates, n_steps=n_steps, gradients=grad
+            )
+            return result if grad is None else (*result, grad)
+
+        xyz_buffer, xyz = self._buffer("coordinates", coordinates.shape)
+        xyz[...] = coordinates
+        grad_descriptor = None
+        if gradients:
+            grad_buffer, grad = self._buffer("gradients", coordinates.shape)
+            grad_descriptor = grad_buffer.descriptor
+
+        block_size = self.block_size
+        if block_size is None:
+            block_size = min(
+                100, max(1, math.ceil(n_structures / (4 * self.n_processes)))
+            )
+
+        futures = [
+            self._executor.submit(
+                _minimize_block,
+                xyz_buffer.descriptor,
+                grad_descriptor,
+                start,
+                min(start + block_size, n_structures),
+                n_steps,
+            )
+            for start in range(0, n_structures, block_size)
+        ]
+        results = [future.result() for future in futures]
+        energies, converged = (np.concatenate(arrays) for arrays in zip(*results))
+
+        if gradients:
+            return energies, converged, xyz, grad
+        return energies, converged, xyz
+
+
+def minimize_with_pruning(
+    obmol,
+    ff_name,
+    coordinates,
+    n_steps=1000,
+    window=50.0,
+    interval=50,
+    n_processes=None,
+    block_size=None,
+):
+    """Minimize an ensemble in rounds, dropping structures high in energy.
+
+    After each round of `interval` steps, any structure that has not converged and
+    whose energy is more than `window` above the lowest energy so far is dropped.
+    Only the remaining structures continue, up to `n_steps` in total. The conjugate
+    gradients restart at the beginning of each round.
+
+    Parameters
+    ----------
+    obmol : openbabel.OBMol
+        The molecule.
+    ff_name : str
+        The OpenBabel name of the forcefield.
+    coordinates : numpy.ndarray
+        The (n_structures, n_atoms, 3) starting coordinates in Å.
+    n_steps : int = 1000
+        The maximum number of steps for each structure.
+    window : float = 50.0
+        The energy window in kJ/mol. None turns off the pruning.
+    interval : int = 50
+        The number of steps in each round.
+    n_processes : int or str = None
+        The number of processes, defaulting to all the cores.
+    block_size : int = None
+        The number of structures in each task.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The energies in kJ/mol, whether each converged, the coordinates in Å, and
+        whether each was pruned, in the same order as the input. The energies and
+        coordinates of pruned structures are those when they were dropped.
+    """
+    coordinates = np.array(coordinates, dtype=float)
+    n_structures = coordinates.shape[0]
+    energies = np.full(n_structures, np.inf)
+    converged = np.zeros(n_structures, dtype=bool)
+    pruned = np.zeros(n_structures, dtype=bool)
+
+    if window is None:
+        interval = n_steps
+
+    n_processes = min(n_workers(n_processes), max(n_structures, 1))
+    active = np.arange(n_structures)
+    taken = 0
+    with MinimizerPool(obmol, ff_name, n_processes, block_size) as pool:
+        while active.size > 0 and taken < n_steps:
+            n = min(interval, n_steps - taken)
+            # Copy the results straight out of the pool's shared memory
+            energies[active], converged[active], coordinates[active] = pool.minimize(
+                coordinates[active], n_steps=n
+            )
+            taken += n
+            E = energies[active]
+            done = converged[active]
+
+            remaining = ~done
+            if window is not None:
+                high = E - energies.min() > window
+                pruned[active[high & remaining]] = True
+                remaining &= ~high
+            active = active[remaining]
+
+            logger.debug(
+                f"After {taken} steps {active.size} of {n_structures} structures "
+                f"are still being minimized, {pruned.sum()} have been pruned."
+            )
+
+    return energies, converged, coordinates, pruned
+
+
+def warm_up_worker(ff_name):
+    """Load the forcefield parameters in a new worker, before any job is timed.
+
+    OpenBabel reads the parameters of a forcefield the first time it is set up, so
+    this is a suitable initializer for pools of worker processes.
+
+    Parameters
+    ----------
+    ff_name : str
+        The forcefield, either "best available" or an OpenBabel name.
+    """
+    obmol = forcefield.obmol_from_text("C", "smi")
+    obmol.AddHydrogens()
+    forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+
+
+def _minimize_molecule(text, ff_name, n_steps, coordinates=None):
+    """Minimize one molecule, given as text, in a worker process.
+
+    Problems with the molecule are returned as an error rather than raised, so that
+    one bad structure does not stop a batch. The time taken is returned too, for
+    refining the cost model.
+    """
+    t0 = time.perf_counter()
+    try:
+        obmol = forcefield.obmol_from_text(text)
+        if coordinates is not None:
+            forcefield.set_coordinates(obmol, coordinates)
+        obFF, ff_name = forcefield.setup_forcefield(obmol, ff_name, log_level=0)
+        energy, converged, steps = forcefield.minimize(obFF, obmol, n_steps=n_steps)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    if not math.isfinite(energy):
+        return {"error": f"The energy with {ff_name} is not finite."}
+    return {
+        "energy": energy,
+        "converged": converged,
+        "n steps": steps,
+        "forcefield": ff_name,
+        "coordinates": forcefield.get_coordinates(obmol),
+        "time": time.perf_counter() - t0,
+    }
+
+
+def minimize_molecules(
+    texts,
+    ff_name="best available",
+    n_steps=1000,
+    coordinates=None,
+    n_processes=None,
+    model=None,
+    timings=None,
+    timeout=None,
+    memory_limit=None,
+    callback=None,
+):
+    """Minimize a series of different molecules using a pool of processes.
+
+    The molecules are submitted one at a time, the most expensive first according
+    to the cost model, so that idle workers pick up the next molecule and a large
+    molecule does not start last and keep the others waiting.
+
+    With a time or memory limit the molecules are minimized in supervised worker
+    processes, even with only one process. A molecule that crashes its worker or
+    exceeds a limit gives an error, and the worker is replaced.
+
+    Parameters
+    ----------
+    texts : [str]
+        The molecules as SDF text, from `forcefield.obmol_to_text`.
+    ff_name : str = "best available"
+        The forcefield, either "best available" or an OpenBabel name.
+    n_steps : int = 1000
+        The maximum number of steps for each molecule.
+    coordinates : [numpy.ndarray] = None
+        Optional starting coordinates for each molecule, replacing those in the text.
+    n_processes : int or str = None
+        The number of processes, defaulting to all the cores.
+    model : cost.CostModel = None
+        The model for the cost of each molecule, by default `CostModel.default()`.
+    timings : str or pathlib.Path = None
+        A JSON Lines file to append the predicted and actual times to.
+    timeout : float = None
+        The time limit in seconds for each molecule.
+    memory_limit : int = None
+        The limit in bytes on the memory of each worker process.
+    callback : callable = None
+        Called as callback(i, result) as the result for each molecule arrives,
+        which is not in order when using several processes.
+
+    Returns
+    -------
+    [dict]
+        For each molecule, in order, the "energy" in kJ/mol, whether it "converged",
+        the "n steps", the "forcefield", the "coordinates" and the "time", or an
+        "error".
+    """
+    if coordinates is None:
+        coordinates = [None] * len(texts)
+    if model is None:
+        model = cost.CostModel.default()
+
+    # Molecules that cannot even be read are reported, and not scheduled
+    results = [None] * len(texts)
+    sizes = [None] * len(texts)
+    predicted = [None] * len(texts)
+    for i, text in enumerate(texts):
+        try:
+            sizes[i] = cost.molecule_size(forcefield.obmol_from_text(text))
+        except Exception as e:
+            results[i] = {"error": f"{type(e).__name__}: {e}"}
+            if callback is not None:
+                callback(i, results[i])
+            continue
+        predicted[i] = model.predict(*sizes[i], ff_name, n_steps)
+    order = sorted(
+        [i for i, result in enumerate(results) if result is None],
+        key=lambda i: predicted[i],
+        reverse=True,
+    )
+    n_processes = min(n_workers(n_processes), max(len(order), 1))
+
+    supervised = timeout is not None or memory_limit is not None
+    if n_processes == 1 and not supervised:
+        for i in sorted(order):
+            results[i] = _minimize_molecule(texts[i], ff_name, n_steps, coordinates[i])
+            if callback is not None:
+                callback(i, results[i])
+    else:
+        if supervised:
+            executor = supervisor.SupervisedExecutor(
+                n_processes,
+                timeout=timeout,
+                memory_limit=memory_limit,
+                initializer=warm_up_worker,
+                initargs=(ff_name,),
+            )
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(n_processes)
+        with executor:
+            futures = {
+                executor.submit(
+                    _minimize_molecule, texts[i], ff_name, n_steps, coordinates[i]
+                ): i
+                for i in order
+            }
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except supervisor.WorkerFailed as e:
+                    results[i] = {"error": f"WorkerFailed: {e}"}
+                if callback is not None:
+                    callback(i, results[i])
+
+    log = None if timings is None else cost.TimingLog(timings)
+    for size, t, result in zip(sizes, predicted, results):
+        if "time" not in result:
+            continue
+        logger.debug(
+            f"{size[0]} atoms, {size[1]} rotors: predicted {t:.3f} s, "
+            f"took {result['time']:.3f} s"
+        )
+        if log is not None:
+            log.log(*size, ff_name, n_steps, t, result["time"], result["forcefield"])
+    if log is not None:
+        log.close()
+
+    return results
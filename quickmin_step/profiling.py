@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Profiling QuickMin steps without changing the code.
+
+The step is profiled if its "profile" parameter is set, or if the environment
+variable QUICKMIN_PROFILE is set, to "yes" for the time in each function or to
+"memory" to also trace the memory allocated. The profile is written to
+profile.pstats in the step's directory, which can be examined with e.g. snakeviz,
+and the top functions are summarized in profile.txt. QUICKMIN_PROFILE_TOP sets the
+number of entries in the summary, by default 30.
+
+When not profiling, the only cost is checking the parameter and the environment.
+
+`Phases` times the phases of a step and follows the peak memory as they go.
+"""
+
+import cProfile
+import functools
+import io
+import logging
+import os
+from pathlib import Path
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import seamm
+
+logger = logging.getLogger(__name__)
+
+environment_variable = "QUICKMIN_PROFILE"
+top_variable = "QUICKMIN_PROFILE_TOP"
+
+
+def profile_mode(node):
+    """How to profile the step, if at all.
+
+    Parameters
+    ----------
+    node : seamm.Node
+        The step, with a "profile" parameter.
+
+    Returns
+    -------
+    str or None
+        "time", "memory", or None to not profile.
+    """
+    value = os.environ.get(environment_variable, "").strip().lower()
+    if value in ("", "0", "no", "false", "off"):
+        if "profile" not in node.parameters:
+            return None
+        value = node.parameters["profile"].get(context=seamm.flowchart_variables._data)
+        value = str(value).lower()
+        if value == "no":
+            return None
+    return "memory" if "memory" in value else "time"
+
+
+def profiled(run):
+    """Decorate the run method of a step to profile it when asked to."""
+
+    @functools.wraps(run)
+    def wrapper(self, *args, **kwargs):
+        mode = profile_mode(self)
+        if mode is None:
+            return run(self, *args, **kwargs)
+
+        profiler = cProfile.Profile()
+        snapshot = None
+        peak = None
+        tracing = mode == "memory" and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(25)
+        try:
+            return profiler.runcall(run, self, *args, **kwargs)
+        finally:
+            if mode == "memory":
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                # The phases of the step reset the peak as they go
+                phases = getattr(self, "phases", None)
+                if phases is not None and phases.traced_peak is not None:
+                    peak = max(peak, phases.traced_peak)
+                if tracing:
+                    tracemalloc.stop()
+            try:
+                write_profile(self.directory, profiler, snapshot, peak)
+            except Exception as e:
+                logger.warning(f"Could not write the profile: {e}")
+
+    return wrapper
+
+
+def write_profile(directory, profiler, snapshot=None, peak=None):
+    """Write the profile and a summary of the top entries.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The directory for profile.pstats and profile.txt.
+    profiler : cProfile.Profile
+        The finished profile.
+    snapshot : tracemalloc.Snapshot = None
+        The memory allocated, if traced.
+    peak : int = None
+        The peak memory traced, in bytes.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    n = int(os.environ.get(top_variable, 30))
+
+    profiler.dump_stats(directory / "profile.pstats")
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out).strip_dirs()
+    out.write(f"The top {n} functions by cumulative time\n")
+    stats.sort_stats("cumulative").print_stats(n)
+    out.write(f"\nThe top {n} functions by internal time\n")
+    stats.sort_stats("tottime").print_stats(n)
+
+    if snapshot is not None:
+        out.write(f"\nThe peak memory traced was {peak / 2**20:.1f} MiB\n")
+        out.write(f"\nThe top {n} lines by memory still allocated at the end\n\n")
+        for statistic in snapshot.statistics("lineno")[:n]:
+            out.write(f"{statistic}\n")
+
+    (directory / "profile.txt").write_text(out.getvalue())
+
+
+def peak_rss():
+    """The peak resident memory of the process so far, in MiB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, but KiB elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+class Phases(object):
+    """The time and memory used by each phase of a calculation.
+
+    A phase runs from calling `start` until the next phase starts, or `stop` is
+    called. Each one records its time, and the peak resident memory of the process
+    at its end, which only grows, so the phase that raises it is the one using
+    the memory. If tracemalloc is tracing, the peak memory allocated by Python
+    during each phase, above that at its start, is recorded too.
+
+    Attributes
+    ----------
+    timings : dict
+        The time in seconds of each phase.
+    peak_rss : dict
+        The peak resident memory in MiB after each phase.
+    traced_peaks : dict
+        The peak memory in MiB traced by tracemalloc during each phase, above that
+        at its start.
+    traced_peak : float
+        The largest traced peak, in bytes, or None if not tracing.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.peak_rss = {}
+        self.traced_peaks = {}
+        self.traced_peak = None
+        self._phase = None
+        self._t0 = None
+        self._traced = 0
+
+    def start(self, name):
+        """Start a phase, ending the current one."""
+        self.stop()
+        self._phase = name
+        if tracemalloc.is_tracing():
+            self._record_traced_peak()
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+        self._t0 = time.perf_counter()
+
+    def stop(self):
+        """End the current phase, if any."""
+        if self._phase is None:
+            return
+        name = self._phase
+        self._phase = None
+        # A phase may run more than once, e.g. printing
+        self.timings[name] = self.timings.get(name, 0.0) + (
+            time.perf_counter() - self._t0
+        )
+        rss = peak_rss()
+        if rss is not None:
+            self.peak_rss[name] = rss
+        if tracemalloc.is_tracing():
+            peak = (self._record_traced_peak() - self._traced) / 2**20
+            self.traced_peaks[name] = max(self.traced_peaks.get(name, 0.0), peak)
+
+    def total(self):
+        """The time in seconds since starting."""
+        return time.perf_counter() - self.started
+
+    def _record_traced_peak(self):
+        """Keep the largest traced peak, returning the current one in bytes."""
+        peak = tracemalloc.get_traced_memory()[1]
+        if self.traced_peak is None or peak > self.traced_peak:
+            self.traced_peak = peak
+        return peak
@@ -3,6 +3,8 @@
 """Non-graphical part of the QuickMin step in a SEAMM flowchart"""
 
 import importlib
+import json
+import math
 import os
 import sys
 import textwrap
@@ -22,6 +24,14 @@ from openbabel import openbabel
 
 import molsystem
 import quickmin_step
+from . import conformers
+from . import database
+from . import forcefield
+from . import parallel
+from .profiling import Phases, peak_rss, profiled
+from .results import ResultsWriter, save_array
+from . import server
+from .trajectory import TrajectoryWriter
 import seamm
 from seamm_util import ureg, Q_  # noqa: F401
 import seamm_util.printing as printing
@@ -185,6 +195,9 @@ class QuickMin(seamm.Node):
 
         self._metadata = quickmin_step.metadata
         self.parameters = quickmin_step.QuickMinParameters()
+        self._cancellation = None
+        # The time and memory used by the phases of the last run
+        self.phases = None
 
     @property
     def version(self):
@@ -196,6 +209,16 @@ class QuickMin(seamm.Node):
         """The git version of this module."""
         return quickmin_step.__git_revision__
 
+    def cancel(self):
+        """Stop a minimization in progress, keeping the structure so far.
+
+        This may be called from another thread. The minimization stops at the end
+        of the current chunk of steps and the step finishes normally, reporting
+        that the minimization did not converge.
+        """
+        if self._cancellation is not None:
+            self._cancellation.cancel()
+
     def description_text(self, P=None):
         """Create the text description of what this step will do.
         The dictionary of control values is passed in as P so that
@@ -213,6 +236,15 @@ class QuickMin(seamm.Node):
         """
         if P is None:
             P = self.parameters.values_to_dict()
+            # Booleans come back as "yes" or "no", and values like "none" with units
+            for key, value in P.items():
+                definition = self.parameters.parameters.get(key, {})
+                if definition.get("kind") == "boolean" and value in ("yes", "no"):
+                    P[key] = value == "yes"
+                elif isinstance(value, str) and value.split(" ")[0] in definition.get(
+                    "enumeration", ()
+                ):
+                    P[key] = value.split(" ")[0]
 
         calculation = P["calculation"]
         n_steps = P["n_steps"]
@@ -222,9 +254,46 @@ class QuickMin(seamm.Node):
         else:
             ff_name = forcefield.split()[0]
 
+        if P["time budget"] == "none":
+            budget = ""
+        else:
+            budget = (
+                f"The minimization will stop after {P['time budget']}, even if it "
+                "has not converged. "
+            )
+        if P["trajectory interval"] != "none":
+            budget += (
+                "A frame of the trajectory will be saved every "
+                f"{P['trajectory interval']} steps"
+            )
+            if P["trajectory energies"]:
+                budget += ", with its energy. "
+            else:
+                budget += ". "
+        if P["checkpoint interval"] != "none":
+            budget += (
+                f"The coordinates will be saved every {P['checkpoint interval']} "
+                "steps, and the minimization restarted from them if interrupted. "
+            )
+
         if calculation == "optimization":
             text = f"Minimizing the structure with {ff_name}, with a maximum of "
-            text += f"{n_steps} steps. "
+            text += f"{n_steps} steps. " + budget
+
+            if P["forcefield"] == "best available":
+                kwargs = {}
+            else:
+                kwargs = {"forcefield": ff_name}
+            text += seamm.standard_parameters.structure_handling_description(
+                P, **kwargs
+            )
+        elif calculation == "hydrogens only":
+            text = (
+                f"Minimizing the positions of the hydrogen atoms with {ff_name}, "
+                f"keeping all other atoms fixed, with a maximum of {n_steps} steps "
+                f"and a nonbond cutoff of {P['cutoff']}. "
+            )
+            text += budget
 
             if P["forcefield"] == "best available":
                 kwargs = {}
@@ -233,11 +302,67 @@ class QuickMin(seamm.Node):
             text += seamm.standard_parameters.structure_handling_description(
                 P, **kwargs
             )
+        elif calculation == "energy scan":
+            text = f"Calculating the energy of a series of structures with {ff_name}"
+            if P["scan gradients"]:
+                text += ", including the gradients,"
+            if P["scan source"] == "trajectory file":
+                text += f" using the structures in '{P['trajectory file']}'."
+            elif P["configurations"] == "all":
+                text += " using all the configurations of the current system."
+            else:
+                text += (
+                    f" using configurations {P['configurations']} of the current "
+                    "system."
+                )
+        elif calculation == "torsion scan":
+            text = (
+                f"Scanning the torsion {P['torsion']} from {P['first angle']} to "
+                f"{P['last angle']} in steps of {P['angle step']} with {ff_name}, "
+                f"minimizing each point for up to {n_steps} steps"
+            )
+            if P["scan from both ends"]:
+                text += ", starting from both ends of the scan in parallel."
+            else:
+                text += "."
+        elif calculation == "conformer search":
+            text = (
+                f"Searching for conformers with {ff_name} by minimizing up to "
+                f"{P['number of rotamers']} rotamers for at most {n_steps} steps "
+                "each"
+            )
+            if P["prune"]:
+                text += (
+                    f", dropping any more than {P['pruning window']} above the "
+                    f"lowest after every {P['pruning interval']} steps"
+                )
+            text += (
+                f". Up to {P['max conformers']} unique conformers within "
+                f"{P['energy window']} of the lowest will be added as new "
+                "configurations."
+            )
+        elif calculation == "funnel screening":
+            if P["structures"] == "all systems":
+                structures = "the current configuration of every system"
+            else:
+                structures = "all the configurations of the current system"
+            text = (
+                f"Screening {structures} with {ff_name}. Each structure will be "
+                f"minimized for up to {P['loose steps']} steps, and then the lowest "
+                f"{P['tight selection']} fully minimized for up to {n_steps} steps. "
+                "The minimized coordinates replace those of each configuration."
+            )
+            if P["time limit"] != "none" or P["memory limit"] != "none":
+                text += (
+                    " Each structure will be minimized in a supervised process, and "
+                    "any that crash or exceed the limits reported as failed."
+                )
         else:
             text = f"Performing a quick energy calculation with {ff_name}."
 
         return self.header + "\n" + __(text, indent=4 * " ").__str__()
 
+    @profiled
     def run(self):
         """Run a QuickMin step.
 
@@ -252,6 +377,8 @@ class QuickMin(seamm.Node):
         """
         global OpenBabel_version
 
+        # The time and memory used by each phase of the calculation
+        phases = self.phases = Phases()
         next_node = super().run(printer)
         # Get the values of the parameters, dereferencing any variables
         P = self.parameters.current_values_to_dict(
@@ -330,127 +457,176 @@ class QuickMin(seamm.Node):
         directory = Path(self.directory)
         directory.mkdir(parents=True, exist_ok=True)
 
+        if calculation == "energy scan":
+            self.energy_scan(P)
+            return next_node
+        elif calculation == "torsion scan":
+            self.torsion_scan(P)
+            return next_node
+        elif calculation == "conformer search":
+            self.conformer_search(P)
+            return next_node
+        elif calculation == "funnel screening":
+            self.funnel_screening(P)
+            return next_node
+
         # Get the current system and configuration (ignoring the system...)
         system, configuration = self.get_system_configuration(None)
 
+        phases.start("conversion")
         obmol = configuration.to_OBMol()
+        phases.start("copy")
         initial_OBMol = configuration.to_OBMol()
+        phases.start("calculation")
 
-        gradients = []
-        if P["forcefield"] == "best available":
-            for ff_name in ("GAFF", "MMFF94s", "Ghemical", "UFF"):
-                obFF = openbabel.OBForceField.FindForceField(ff_name)
-
-                if obFF is None:
-                    self.logger.warning(f"Couldn't find forcefield '{ff_name}'")
-                    continue
-
-                obFF.SetLogToStdErr()
-                obFF.SetLogLevel(1)
-                # see https://stackoverflow.com/questions/50978464/redirect-logs-to-file-in-pybel  # noqa: E501
-                out = OutputGrabber(sys.stderr)
-                with out:
-                    if not obFF.Setup(obmol):
-                        if ff_name == "UFF":
-                            raise RuntimeError(
-                                "Could not find a forcefield for the molecule"
-                            )
-                        continue
-                    if calculation == "optimization":
-                        obFF.ConjugateGradients(P["n_steps"])
-                        obFF.GetCoordinates(obmol)
-
-                    energy = obFF.Energy(True)
-                    units = obFF.GetUnit()
-
-                    # Capture the gradients. These appear to be forces, so negate
-                    factor = -Q_(1.0, units).m_as("kJ/mol")
-                    for atom in openbabel.OBMolAtomIter(obmol):
-                        # vector objects have to be de-referenced individually (sigh)
-                        grad = obFF.GetGradient(atom)
-                        gradients.append(
-                            [
-                                factor * grad.GetX(),
-                                factor * grad.GetY(),
-                                factor * grad.GetZ(),
-                            ]
-                        )
-
-                if calculation == "optimization":
-                    path = Path(self.directory) / "min.out"
-                else:
-                    path = Path(self.directory) / "energy.out"
-                path.write_text(out.capturedtext)
-                break
+        minimize = calculation in ("optimization", "hydrogens only")
+        cutoff = P["cutoff"].m_as("Å")
+        if P["time budget"] == "none":
+            time_budget = None
         else:
-            ff_name = P["forcefield"].split()[0]
-            obFF = openbabel.OBForceField.FindForceField(ff_name)
+            time_budget = P["time budget"].m_as("s")
+
+        # Restart from a checkpoint of an earlier, interrupted run on this input
+        checkpoint = None
+        steps_done = 0
+        if minimize and P["checkpoint interval"] != "none":
+            path = directory / "checkpoint.npz"
+            key = forcefield.Checkpoint.make_key(
+                obmol, P["forcefield"], calculation, P["n_steps"], cutoff
+            )
+            restart = forcefield.Checkpoint.load(path, key)
+            if restart is not None:
+                steps_done, xyz = restart
+                forcefield.set_coordinates(obmol, xyz)
+                printer.normal(
+                    __(
+                        "Restarting the minimization from the checkpoint after "
+                        f"{steps_done} steps.",
+                        indent=4 * " ",
+                    )
+                )
+                printer.normal("")
+            checkpoint = forcefield.Checkpoint(
+                path, obmol, key, P["checkpoint interval"], steps_done
+            )
+        n_steps = max(0, P["n_steps"] - steps_done)
+
+        trajectory = None
+        if minimize and P["trajectory interval"] != "none":
+            trajectory = TrajectoryWriter(
+                directory / "trajectory.bin",
+                obmol,
+                P["trajectory interval"],
+                n_steps,
+                steps_done,
+                energies=P["trajectory energies"],
+            )
 
-            if obFF is None:
-                raise RuntimeError(f"Couldn't find forcefield '{ff_name}'")
+        result = None
+        if P["use server"] and checkpoint is None and trajectory is None:
+            result = self._calculate_on_server(
+                obmol, P["forcefield"], calculation, n_steps, cutoff, time_budget
+            )
+        if result is None:
+            token = self._cancellation = forcefield.CancellationToken(time_budget)
+
+            def callback(obFF, steps):
+                if checkpoint is not None:
+                    checkpoint(obFF, steps)
+                if trajectory is not None:
+                    trajectory(obFF, steps)
+                return token(obFF, steps)
 
-            obFF.SetLogToStdErr()
-            obFF.SetLogLevel(1)
             # see https://stackoverflow.com/questions/50978464/redirect-logs-to-file-in-pybel  # noqa: E501
             out = OutputGrabber(sys.stderr)
-            with out:
-                if not obFF.Setup(obmol):
-                    raise RuntimeError(
-                        f"Could not assign forcefield {ff_name} to the molecule"
+            try:
+                with out:
+                    result = forcefield.calculate(
+                        obmol,
+                        P["forcefield"],
+                        calculation,
+                        n_steps,
+                        cutoff,
+                        callback=callback if minimize else None,
                     )
-                if calculation == "optimization":
-                    obFF.ConjugateGradients(P["n_steps"])
-                    obFF.GetCoordinates(obmol)
-
-                energy = obFF.Energy(True)
-                units = obFF.GetUnit()
-
-                # Capture the gradients. These appear to be forces, so negate
-                factor = -Q_(1.0, units).m_as("kJ/mol")
-                for atom in openbabel.OBMolAtomIter(obmol):
-                    # vector objects have to be de-referenced individually (sigh)
-                    grad = obFF.GetGradient(atom)
-                    gradients.append(
-                        [
-                            factor * grad.GetX(),
-                            factor * grad.GetY(),
-                            factor * grad.GetZ(),
-                        ]
+            finally:
+                self._cancellation = None
+                if trajectory is not None:
+                    if result is None:
+                        trajectory.close()
+                    else:
+                        trajectory.close(
+                            result["n steps"],
+                            Q_(result["energy"], result["units"]).m_as("kJ/mol"),
+                        )
+            result["log"] = out.capturedtext
+            result["stopped"] = token.reason
+            if checkpoint is not None:
+                if token.reason is None:
+                    checkpoint.remove()
+                else:
+                    # Keep the work so far, so that a rerun carries on from here
+                    checkpoint.save(
+                        forcefield.get_coordinates(obmol),
+                        steps_done + result["n steps"],
                     )
-
-            if calculation == "optimization":
-                path = Path(self.directory) / "min.out"
-            else:
-                path = Path(self.directory) / "energy.out"
-            path.write_text(out.capturedtext)
+        energy = result["energy"]
+        units = result["units"]
+        gradients = result["gradients"]
+        ff_name = result["forcefield"]
+        n_mobile = result["n mobile atoms"]
+        # The setup, minimization and gradients, timed within the calculation
+        timings = result.get("timings", {})
+        # Not returned by the server
+        setup = result.get("setup")
+
+        phases.start("log")
+        if minimize:
+            path = Path(self.directory) / "min.out"
+        else:
+            path = Path(self.directory) / "energy.out"
+        path.write_text(result["log"])
 
         # Set the model chemistry to the forcefield name.
         self._model = ff_name
 
-        # Check for convergence
-        lines = out.capturedtext.splitlines()
-        tmp = lines[-2].split()
-        if len(tmp) == 3:
-            n_iterations = tmp[0]
+        # The steps taken and convergence, as counted by the minimization. The server
+        # also passes a callback, so returns them too. Only a single-point energy, or
+        # an older server, lacks them, in which case fall back to the log, which
+        # OpenBabel only writes every 10 steps.
+        if "n steps" in result:
+            n_iterations = steps_done + result["n steps"]
+            converged = result["converged"]
         else:
-            n_iterations = "unknown"
-        converged = "HAS CONVERGED" in lines[-1]
+            lines = ["", ""] + result["log"].splitlines()
+            tmp = lines[-2].split()
+            if len(tmp) == 3:
+                n_iterations = int(tmp[0]) + steps_done
+            else:
+                n_iterations = "unknown"
+            converged = "HAS CONVERGED" in lines[-1]
 
         # Set up the results data
+        phases.start("results")
         data = {}
         data["converged"] = converged
         data["n steps"] = n_iterations
-        if units == "kJ/mol":
-            data["energy"] = energy
-            data["gradients"] = gradients
-        else:
-            data["energy"] = Q_(energy, units).m_as("kJ/mol")
-            tmp = np.array(gradients) * Q_(1.0, units).m_as("kJ/mol")
-            data["gradients"] = tmp.tolist()
+        data["energy"] = Q_(energy, units).m_as("kJ/mol")
+        # The arrays are saved to .npy files, and only kept inline if small
+        arrays = {
+            "gradients": save_array(directory, "gradients", gradients, "kJ/mol/Å")
+        }
+        if P["save coordinates"]:
+            arrays["coordinates"] = save_array(
+                directory, "coordinates", forcefield.get_coordinates(obmol), "Å"
+            )
+        if obmol.NumAtoms() <= P["inline array limit"]:
+            data["gradients"] = gradients.tolist()
         data["forcefield"] = ff_name
         data["model"] = self.model
+        data["n mobile atoms"] = n_mobile
 
-        if calculation == "optimization":
+        if minimize:
             table = {
                 "Property": [],
                 "Value": [],
@@ -461,7 +637,7 @@ class QuickMin(seamm.Node):
             table["Units"].append(units)
 
             table["Property"].append("Steps")
-            table["Value"].append(n_iterations)
+            table["Value"].append(str(n_iterations))
             table["Units"].append("")
 
             table["Property"].append("Converged")
@@ -472,31 +648,53 @@ class QuickMin(seamm.Node):
             table["Value"].append(data["forcefield"])
             table["Units"].append("")
 
+            if calculation == "hydrogens only":
+                table["Property"].append("Mobile Atoms")
+                table["Value"].append(f"{n_mobile} of {obmol.NumAtoms()}")
+                table["Units"].append("")
+
             if converged:
                 text = (
                     f"The minimization using {ff_name} converged in {n_iterations} "
                     f"steps to {energy:.3f} {units}. "
                 )
+            elif result.get("stopped") is not None:
+                text = (
+                    f"The minimization with {ff_name} was stopped after "
+                    f"{n_iterations} steps because {result['stopped']}, so did not "
+                    f"converge. The energy then was {energy:.3f} {units}. "
+                )
             else:
                 text = (
                     f"The minimization with {ff_name} did not converge in "
                     f"{n_iterations} steps! The final energy was {energy:.3f} {units}. "
                 )
+            if calculation == "hydrogens only":
+                text += (
+                    f"Only the {n_mobile} hydrogen atoms were free to move; the "
+                    f"other {obmol.NumAtoms() - n_mobile} atoms were fixed. "
+                )
 
+            phases.start("RMSD")
+            # Aligning with the initial structure rotates the minimized one
+            minimized = forcefield.get_coordinates(obmol)
             result = molsystem.RMSD(obmol, initial_OBMol, symmetry=True, align=True)
             data["RMSD"] = result["RMSD"]
             data["displaced atom"] = result["displaced atom"]
             data["maximum displacement"] = result["maximum displacement"]
 
             # Save the structure
+            phases.start("structure")
             if P["structure handling"] != "Discard the structure":
                 system, configuration = self.get_system_configuration(P)
                 configuration.coordinates_from_OBMol(obmol)
 
+            phases.start("RMSD")
             result = molsystem.RMSD(obmol, initial_OBMol, symmetry=True, include_h=True)
             data["RMSD with H"] = result["RMSD"]
             data["displaced atom with H"] = result["displaced atom"]
             data["maximum displacement with H"] = result["maximum displacement"]
+            phases.start("results")
 
             if "RMSD" in data:
                 tmp = data["RMSD"]
@@ -516,6 +714,7 @@ class QuickMin(seamm.Node):
                 table["Value"].append(f"{tmp + 1}")
                 table["Units"].append("")
 
+            phases.start("printing")
             text_lines = []
             text_lines.append("                     Results")
             text_lines.append(
@@ -533,6 +732,7 @@ class QuickMin(seamm.Node):
             text = "\n\n"
             text += textwrap.indent("\n".join(text_lines), 12 * " ")
             printer.normal(text)
+            phases.stop()
 
             text = seamm.standard_parameters.set_names(
                 system, configuration, P, _first=True, forcefield=ff_name
@@ -541,16 +741,153 @@ class QuickMin(seamm.Node):
             text = f"Calculated the energy and gradients using {ff_name}. The energy "
             text += f"was {energy:.3f} {units}."
 
+        # Store the per-atom results on the atoms, for other steps to use
+        if P["save atom data"]:
+            phases.start("atom data")
+            # Without a local setup, e.g. on the server, use any cached typing
+            if setup is None:
+                atom_types, charges = forcefield.get_typing(
+                    obmol, ff_name, cache=forcefield.TypingCache()
+                )
+            else:
+                atom_types, charges = forcefield.get_typing(
+                    obmol, ff_name, obFF=setup[0]
+                )
+            discarded = minimize and P["structure handling"] == "Discard the structure"
+            if minimize and not discarded:
+                # Rotate the gradients like the structure saved
+                gradients = gradients @ conformers.superposition_rotation(
+                    minimized, forcefield.get_coordinates(obmol)
+                )
+            database.set_atom_data(
+                configuration,
+                ff_name,
+                # The gradients are for the discarded structure
+                gradients=None if discarded else gradients,
+                charges=charges,
+                atom_types=atom_types,
+            )
+
         # Put any requested results into variables or tables
+        phases.stop()
+        for phase, t in {**phases.timings, **timings}.items():
+            if f"{phase} time" in self.metadata["results"]:
+                data[f"{phase} time"] = t
+        data["peak RSS"] = peak_rss()
+        phases.start("store results")
         self.store_results(
             configuration=configuration,
             data=data,
         )
 
+        phases.start("printing")
         printer.normal(__(text, indent=4 * " "))
         printer.normal("")
+        phases.stop()
+        self._update_results_json(phases, timings, arrays)
 
         # Add the citation(s) for the forcefield
+        self._cite_forcefield(ff_name)
+
+        # Add other citations here or in the appropriate place in the code.
+        # Add the bibtex to data/references.bib, and add a self.reference.cite
+        # similar to the above to actually add the citation to the references.
+
+        return next_node
+
+    def _update_results_json(self, phases, timings, arrays):
+        """Add the arrays, and the time and memory of the phases, to Results.json.
+
+        Parameters
+        ----------
+        phases : Phases
+            The time and memory used by each phase.
+        timings : dict
+            The time in seconds of the parts of the calculation.
+        arrays : dict
+            The references to the arrays saved in .npy files.
+        """
+        path = Path(self.directory) / "Results.json"
+        data = {}
+        if path.exists():
+            try:
+                data = json.loads(path.read_text())
+            except ValueError:
+                logger.warning(f"Could not read {path}, so overwriting it.")
+        timings = {**phases.timings, **timings, "total": phases.total()}
+        data["timings"] = {phase: round(t, 6) for phase, t in timings.items()}
+        data["memory"] = {
+            "peak RSS": {
+                phase: round(rss, 3) for phase, rss in phases.peak_rss.items()
+            },
+        }
+        if len(phases.traced_peaks) > 0:
+            data["memory"]["traced peaks"] = {
+                phase: round(peak, 3) for phase, peak in phases.traced_peaks.items()
+            }
+        data["arrays"] = arrays
+        with path.open("w") as fd:
+            json.dump(data, fd, indent=4, sort_keys=True)
+
+    def _calculate_on_server(
+        self, obmol, ff, calculation, n_steps, cutoff, time_budget=None
+    ):
+        """Do the calculation on the QuickMin server, if it is running.
+
+        Parameters
+        ----------
+        obmol : openbabel.OBMol
+            The molecule, which is updated with the minimized coordinates.
+        ff : str
+            The forcefield as given in the parameters.
+        calculation : str
+            "optimization", "hydrogens only" or "single-point energy".
+        n_steps : int
+            The maximum number of steps.
+        cutoff : float
+            The nonbonded cutoff in Å, used when only minimizing the hydrogens.
+        time_budget : float = None
+            The longest time in seconds to spend minimizing.
+
+        Returns
+        -------
+        dict or None
+            The results, as from `forcefield.calculate`, or None if the server is
+            not running or failed.
+        """
+        try:
+            with server.Client() as client:
+                result = client.calculate(
+                    obmol, ff, calculation, n_steps, cutoff, time_budget
+                )
+        except (ConnectionError, EOFError, OSError) as e:
+            printer.normal(
+                __(f"{e} Running the calculation here.", indent=4 * " ").__str__()
+            )
+            printer.normal("")
+            return None
+        if "error" in result:
+            printer.normal(
+                __(
+                    f"The QuickMin server failed: {result['error']} Running the "
+                    "calculation here.",
+                    indent=4 * " ",
+                ).__str__()
+            )
+            printer.normal("")
+            return None
+
+        forcefield.set_coordinates(obmol, result["coordinates"])
+        return result
+
+    def _cite_forcefield(self, ff_name):
+        """Add the citation(s) for the forcefield.
+
+        Parameters
+        ----------
+        ff_name : str
+            The OpenBabel name of the forcefield, e.g. "MMFF94s".
+        """
         if "MMFF94" in ff_name:
             self.references.cite(
                 raw=self._bibliography["MMFF94-1"],
@@ -586,8 +923,491 @@ class QuickMin(seamm.Node):
                 note=f"The main {ff_name} citation.",
             )
 
-        # Add other citations here or in the appropriate place in the code.
-        # Add the bibtex to data/references.bib, and add a self.reference.cite
-        # similar to the above to actually add the citation to the references.
+    def energy_scan(self, P):
+        """Calculate the energy of a series of structures with one forcefield setup.
 
-        return next_node
+        Parameters
+        ----------
+        P : dict
+            The current values of the control parameters.
+        """
+        system, configuration = self.get_system_configuration(None)
+        obmol = configuration.to_OBMol()
+
+        if P["scan source"] == "trajectory file":
+            coordinates = forcefield.read_trajectory(P["trajectory file"])
+        else:
+            cids = system.configuration_ids
+            if P["configurations"] != "all":
+                cids = [cids[i] for i in _parse_indices(P["configurations"], len(cids))]
+            coordinates = (
+                system.get_configuration(cid).atoms.get_coordinates(
+                    fractionals=False, as_array=True
+                )
+                for cid in cids
+            )
+
+        out = OutputGrabber(sys.stderr)
+        with out:
+            obFF, ff_name = forcefield.setup_forcefield(obmol, P["forcefield"])
+        path = Path(self.directory) / "energy.out"
+        path.write_text(out.capturedtext)
+
+        # Nothing more to log, and the output could be large
+        obFF.SetLogLevel(0)
+        # Stream each point to scan.jsonl, keeping the gradients in memory only
+        # for small systems
+        with ResultsWriter(Path(self.directory) / "scan.jsonl") as writer:
+            energies, gradients = forcefield.energy_scan(
+                obFF,
+                obmol,
+                coordinates,
+                gradients=P["scan gradients"],
+                writer=(writer if obmol.NumAtoms() > P["inline array limit"] else None),
+            )
+            if writer.n == 0:
+                for i, E in enumerate(energies):
+                    record = {"point": i + 1, "energy": E}
+                    if gradients is not None:
+                        record["gradients"] = gradients[i]
+                    writer.write(record)
+        n_points = energies.shape[0]
+        if n_points == 0:
+            raise RuntimeError("There were no structures for the energy scan.")
+
+        self._model = ff_name
+
+        # Write the energies out as a simple table
+        lowest = int(np.argmin(energies))
+        relative = energies - energies[lowest]
+        lines = ["Point,Energy (kJ/mol),Relative Energy (kJ/mol)"]
+        for i, (E, dE) in enumerate(zip(energies, relative), start=1):
+            lines.append(f"{i},{E:.4f},{dE:.4f}")
+        path = Path(self.directory) / "scan.csv"
+        path.write_text("\n".join(lines) + "\n")
+
+        data = {}
+        data["n points"] = n_points
+        data["energies"] = energies.tolist()
+        if gradients is not None:
+            data["scan gradients"] = gradients.tolist()
+        data["forcefield"] = ff_name
+        data["model"] = self.model
+
+        self.store_results(configuration=configuration, data=data)
+
+        text = (
+            f"Calculated the energy of {n_points} structures using {ff_name}. The "
+            f"lowest energy was {energies[lowest]:.3f} kJ/mol for structure "
+            f"{lowest + 1}, and the highest was {relative.max():.3f} kJ/mol above "
+            "it. The energies are in 'scan.csv', and with any gradients in "
+            "'scan.jsonl'."
+        )
+        printer.normal(__(text, indent=4 * " "))
+        printer.normal("")
+
+        self._cite_forcefield(ff_name)
+
+    def torsion_scan(self, P):
+        """Minimize with a torsion restrained to each angle of a grid in turn.
+
+        Parameters
+        ----------
+        P : dict
+            The current values of the control parameters.
+        """
+        system, configuration = self.get_system_configuration(None)
+        obmol = configuration.to_OBMol()
+
+        atoms = [int(i) for i in P["torsion"].replace(",", " ").split()]
+        if len(atoms) != 4:
+            raise ValueError(f"A torsion needs four atoms, not '{P['torsion']}'")
+        first = P["first angle"].m_as("degree")
+        last = P["last angle"].m_as("degree")
+        step = P["angle step"].m_as("degree")
+        if step == 0:
+            raise ValueError("The step in the torsion angle cannot be zero.")
+        step = abs(step) if last >= first else -abs(step)
+        angles = np.arange(first, last + step / 2, step)
+
+        out = OutputGrabber(sys.stderr)
+        with out:
+            obFF, ff_name = forcefield.setup_forcefield(obmol, P["forcefield"])
+        path = Path(self.directory) / "min.out"
+        path.write_text(out.capturedtext)
+        obFF.SetLogLevel(0)
+
+        if P["scan from both ends"] and len(angles) > 1:
+            energies, torsions, coordinates = forcefield.torsion_drive_from_both_ends(
+                obmol, ff_name, atoms, angles, n_steps=P["n_steps"]
+            )
+        else:
+            energies, torsions, coordinates = forcefield.torsion_drive(
+                obFF, obmol, atoms, angles, n_steps=P["n_steps"]
+            )
+
+        self._model = ff_name
+
+        # Write out the profile and the structures
+        lowest = int(np.argmin(energies))
+        relative = energies - energies[lowest]
+        lines = ["Angle (degree),Torsion (degree),Energy (kJ/mol),Relative (kJ/mol)"]
+        for angle, torsion, E, dE in zip(angles, torsions, energies, relative):
+            lines.append(f"{angle:.2f},{torsion:.2f},{E:.4f},{dE:.4f}")
+        path = Path(self.directory) / "torsion_scan.csv"
+        path.write_text("\n".join(lines) + "\n")
+
+        sdf = []
+        for angle, xyz in zip(angles, coordinates):
+            forcefield.set_coordinates(obmol, xyz)
+            obmol.SetTitle(f"torsion {angle:.1f}")
+            sdf.append(forcefield.obmol_to_text(obmol))
+        path = Path(self.directory) / "torsion_scan.sdf"
+        path.write_text("".join(sdf))
+
+        if P["save structures"]:
+            write_back = database.WriteBack(configuration.system_db)
+            with database.transaction(configuration.system_db):
+                for angle, xyz in zip(angles, coordinates):
+                    new = system.copy_configuration(
+                        configuration, name=f"torsion {angle:.1f} with {ff_name}"
+                    )
+                    write_back.add(new, xyz)
+                write_back.write()
+
+        data = {}
+        data["n points"] = len(angles)
+        data["torsion angles"] = torsions.tolist()
+        data["torsion energies"] = energies.tolist()
+        data["forcefield"] = ff_name
+        data["model"] = self.model
+
+        self.store_results(configuration=configuration, data=data)
+
+        text = (
+            f"Scanned the torsion through {len(angles)} angles using {ff_name}. The "
+            f"lowest energy, {energies[lowest]:.3f} kJ/mol, was at "
+            f"{torsions[lowest]:.1f}°, and the barrier was {relative.max():.3f} "
+            "kJ/mol. The profile is in 'torsion_scan.csv' and the structures in "
+            "'torsion_scan.sdf'."
+        )
+        missed = [
+            f"{angle:.1f}° ({torsion:.1f}°)"
+            for angle, torsion in zip(angles, torsions)
+            if abs(forcefield.angle_difference(torsion, angle)) > 0.5
+        ]
+        if len(missed) > 0:
+            text += (
+                " Warning: the torsion could not be held at "
+                + ", ".join(missed)
+                + ", with the angle reached in parentheses."
+            )
+        printer.normal(__(text, indent=4 * " "))
+        printer.normal("")
+
+        self._cite_forcefield(ff_name)
+
+    def conformer_search(self, P):
+        """Minimize rotamers in parallel and keep the unique low-energy conformers.
+
+        Parameters
+        ----------
+        P : dict
+            The current values of the control parameters.
+        """
+        system, configuration = self.get_system_configuration(None)
+        obmol = configuration.to_OBMol()
+
+        # Find the forcefield here, both to capture the log and to resolve
+        # "best available" once for all the workers.
+        out = OutputGrabber(sys.stderr)
+        with out:
+            obFF, ff_name = forcefield.setup_forcefield(obmol, P["forcefield"])
+        path = Path(self.directory) / "min.out"
+        path.write_text(out.capturedtext)
+
+        rotamers = conformers.generate_rotamers(
+            obmol, n_rotamers=P["number of rotamers"]
+        )
+        n_rotamers = rotamers.shape[0]
+
+        if P["prune"]:
+            window = P["pruning window"].m_as("kJ/mol")
+        else:
+            window = None
+        energies, converged, coordinates, pruned = parallel.minimize_with_pruning(
+            obmol,
+            ff_name,
+            rotamers,
+            n_steps=P["n_steps"],
+            window=window,
+            interval=P["pruning interval"],
+            n_processes=P["number of processes"],
+        )
+
+        heavy = np.array(
+            [atom.GetAtomicNum() > 1 for atom in openbabel.OBMolAtomIter(obmol)]
+        )
+        if not heavy.any():
+            heavy = None
+        # Pruned structures are not minimized, so do not consider them
+        energies = np.where(pruned, np.inf, energies)
+        n_converged = int(converged.sum())
+        if n_converged == 0:
+            raise RuntimeError(
+                f"None of the {n_rotamers} rotamers converged in {P['n_steps']} "
+                "steps, so there are no conformers. Try more steps."
+            )
+        kept = conformers.unique_conformers(
+            energies,
+            coordinates,
+            mask=heavy,
+            threshold=P["rmsd threshold"].m_as("Å"),
+            window=P["energy window"].m_as("kJ/mol"),
+            max_conformers=P["max conformers"],
+            converged=converged,
+        )
+
+        self._model = ff_name
+
+        # Add the conformers as new configurations, with their energies
+        lowest = energies[kept[0]]
+        lines = ["Conformer,Energy (kJ/mol),Relative Energy (kJ/mol),Converged"]
+        sdf = []
+        write_back = database.WriteBack(configuration.system_db)
+        with database.transaction(configuration.system_db):
+            for n, i in enumerate(kept, start=1):
+                new = system.copy_configuration(
+                    configuration, name=f"conformer {n} with {ff_name}"
+                )
+                write_back.add(
+                    new,
+                    coordinates[i],
+                    {"total energy#QuickMin#{model}": energies[i]},
+                    self.model,
+                )
+            write_back.write()
+        for n, i in enumerate(kept, start=1):
+            lines.append(
+                f"{n},{energies[i]:.4f},{energies[i] - lowest:.4f},{converged[i]}"
+            )
+            forcefield.set_coordinates(obmol, coordinates[i])
+            obmol.SetTitle(f"conformer {n}")
+            sdf.append(forcefield.obmol_to_text(obmol))
+
+        path = Path(self.directory) / "conformers.csv"
+        path.write_text("\n".join(lines) + "\n")
+        path = Path(self.directory) / "conformers.sdf"
+        path.write_text("".join(sdf))
+
+        data = {}
+        data["n rotamers"] = n_rotamers
+        data["n pruned"] = int(pruned.sum())
+        data["n conformers"] = len(kept)
+        data["conformer energies"] = energies[kept].tolist()
+        data["forcefield"] = ff_name
+        data["model"] = self.model
+
+        self.store_results(configuration=configuration, data=data)
+
+        text = (
+            f"Minimized {n_rotamers} rotamers with {ff_name}, of which "
+            f"{n_converged} converged and {int(pruned.sum())} were dropped for "
+            f"being too high in energy. Kept the {len(kept)} unique conformers "
+            "among those that converged as new configurations. The lowest energy "
+            f"was {lowest:.3f} kJ/mol. The conformers are in 'conformers.sdf'."
+        )
+        printer.normal(__(text, indent=4 * " "))
+        printer.normal("")
+
+        self._cite_forcefield(ff_name)
+
+    def funnel_screening(self, P):
+        """Minimize many structures loosely, then the lowest in energy fully.
+
+        Parameters
+        ----------
+        P : dict
+            The current values of the control parameters.
+        """
+        system, configuration = self.get_system_configuration(None)
+        if P["structures"] == "all systems":
+            system_db = self.get_variable("_system_db")
+            configurations = [s.configuration for s in system_db.systems]
+        else:
+            configurations = system.configurations
+        n_structures = len(configurations)
+        if n_structures == 0:
+            raise RuntimeError("There are no structures to screen.")
+
+        texts = [forcefield.obmol_to_text(c.to_OBMol()) for c in configurations]
+        timings = Path(self.directory) / "timings.jsonl"
+        limits = {"timeout": None, "memory_limit": None}
+        if P["time limit"] != "none":
+            limits["timeout"] = P["time limit"].m_as("s")
+        if P["memory limit"] != "none":
+            limits["memory_limit"] = int(P["memory limit"].m_as("B"))
+
+        # Stream the result for each structure as it arrives, so the progress can
+        # be followed
+        writer = ResultsWriter(Path(self.directory) / "funnel.jsonl")
+
+        def stream(tier, indices):
+            def callback(i, result):
+                record = {"structure": indices[i] + 1, "tier": tier}
+                record.update({k: v for k, v in result.items() if k != "coordinates"})
+                writer.write(record)
+
+            return callback
+
+        # The loose pass over everything
+        results = parallel.minimize_molecules(
+            texts,
+            P["forcefield"],
+            n_steps=P["loose steps"],
+            n_processes=P["number of processes"],
+            timings=timings,
+            callback=stream("loose", range(n_structures)),
+            **limits,
+        )
+        tiers = ["failed" if "error" in r else "loose" for r in results]
+
+        # and the tight pass over the lowest in energy
+        ok = [i for i, r in enumerate(results) if "error" not in r]
+        ok.sort(key=lambda i: results[i]["energy"])
+        n_tight = _n_selected(P["tight selection"], len(ok))
+        selected = ok[:n_tight]
+        tight = parallel.minimize_molecules(
+            [texts[i] for i in selected],
+            P["forcefield"],
+            n_steps=P["n_steps"],
+            coordinates=[results[i]["coordinates"] for i in selected],
+            n_processes=P["number of processes"],
+            timings=timings,
+            callback=stream("tight", selected),
+            **limits,
+        )
+        writer.close()
+        for i, result in zip(selected, tight):
+            if "error" not in result:
+                result["n steps"] += results[i]["n steps"]
+                results[i] = result
+                tiers[i] = "tight"
+
+        # Put the results back in the configurations
+        lines = [
+            "Structure,System,Configuration,Forcefield,Energy (kJ/mol),Tier,Converged"
+        ]
+        energies = []
+        converged = []
+        write_back = database.WriteBack(configuration.system_db)
+        for i, (c, result, tier) in enumerate(zip(configurations, results, tiers)):
+            if tier == "failed":
+                energies.append(None)
+                converged.append(False)
+                lines.append(f'{i + 1},"{c.system.name}","{c.name}",,,failed,False')
+                continue
+            ff_name = result["forcefield"]
+            write_back.add(
+                c,
+                result["coordinates"],
+                {
+                    "total energy#QuickMin#{model}": result["energy"],
+                    "convergence tier#QuickMin#{model}": tier,
+                },
+                ff_name,
+            )
+            energies.append(result["energy"])
+            converged.append(result["converged"])
+            lines.append(
+                f'{i + 1},"{c.system.name}","{c.name}",{ff_name},'
+                f"{result['energy']:.4f},{tier},{result['converged']}"
+            )
+        write_back.write()
+        path = Path(self.directory) / "funnel.csv"
+        path.write_text("\n".join(lines) + "\n")
+
+        ff_names = sorted({r["forcefield"] for r in results if "error" not in r})
+        self._model = ff_names[0] if len(ff_names) == 1 else P["forcefield"]
+
+        data = {}
+        data["n structures"] = n_structures
+        data["n tight"] = tiers.count("tight")
+        data["screening energies"] = energies
+        data["screening tiers"] = tiers
+        data["screening converged"] = converged
+        data["model"] = self.model
+
+        self.store_results(configuration=configuration, data=data)
+
+        text = (
+            f"Screened {n_structures} structures, minimizing each for up to "
+            f"{P['loose steps']} steps, and then fully minimized the "
+            f"{tiers.count('tight')} lowest in energy. The results are in "
+            "'funnel.csv'."
+        )
+        if "failed" in tiers:
+            text += (
+                f" {tiers.count('failed')} structures could not be minimized, "
+                "probably because no forcefield could handle them."
+            )
+        printer.normal(__(text, indent=4 * " "))
+        printer.normal("")
+
+        for ff_name in ff_names:
+            self._cite_forcefield(ff_name)
+
+
+def _n_selected(text, n):
+    """The number of items selected by a count or a percentage such as "10%".
+
+    Parameters
+    ----------
+    text : str or int
+        The number, or the percentage, to select.
+    n : int
+        The total number of items.
+
+    Returns
+    -------
+    int
+        The number selected, which is at least one if there are any items.
+    """
+    text = str(text).strip()
+    if text.endswith("%"):
+        result = math.ceil(float(text[:-1]) / 100 * n)
+    else:
+        result = int(text)
+    return max(min(result, n), 1 if n > 0 else 0)
+
+
+def _parse_indices(text, n):
+    """The 0-based indices for a list of 1-based ranges such as "1-10, 12".
+
+    Parameters
+    ----------
+    text : str
+        The ranges, separated by commas.
+    n : int
+        The number of items.
+
+    Returns
+    -------
+    [int]
+        The 0-based indices.
+    """
+    result = []
+    for part in text.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            indices = range(int(first), int(last) + 1)
+        else:
+            indices = [int(part)]
+        for i in indices:
+            if i < 1 or i > n:
+                raise ValueError(f"Index {i} is outside the range 1-{n} in '{text}'")
+            result.append(i - 1)
+    return result
@@ -97,11 +97,24 @@ class QuickMinParameters(seamm.Parameters):
             "kind": "enum",
             "enumeration": (
                 "optimization",
+                "hydrogens only",
                 "single-point energy",
+                "energy scan",
+                "torsion scan",
+                "conformer search",
+                "funnel screening",
             ),
             "format_string": "",
             "description": "Calculation:",
-            "help_text": "The type of calculation to perform.",
+            "help_text": (
+                "The type of calculation to perform. 'hydrogens only' minimizes the "
+                "positions of the hydrogen atoms, keeping all other atoms fixed. "
+                "'energy scan' calculates the energy of a series of structures, and "
+                "'torsion scan' minimizes with a torsion restrained to a series of "
+                "angles, 'conformer search' minimizes many rotamers to find the "
+                "low-energy conformers, and 'funnel screening' loosely minimizes many "
+                "structures, then fully minimizes the lowest in energy."
+            ),
         },
         "n_steps": {
             "default": 1000,
@@ -112,6 +125,399 @@ class QuickMinParameters(seamm.Parameters):
             "description": "Maximum steps:",
             "help_text": "The maximum number of steps to run.",
         },
+        "cutoff": {
+            "default": 6.0,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Nonbond cutoff:",
+            "help_text": (
+                "The cutoff for the nonbonded interactions when minimizing only the "
+                "hydrogen atoms."
+            ),
+        },
+        "time budget": {
+            "default": "none",
+            "kind": "float",
+            "default_units": "s",
+            "enumeration": ("none",),
+            "format_string": ".1f",
+            "description": "Time budget:",
+            "help_text": (
+                "The longest time to spend minimizing, including setting up the "
+                "forcefield. If it runs out, the minimization stops, unconverged, "
+                "keeping the structure found so far."
+            ),
+        },
+        "checkpoint interval": {
+            "default": "none",
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": ("none",),
+            "format_string": "",
+            "description": "Checkpoint every:",
+            "help_text": (
+                "How many steps between saving the coordinates, so that a long "
+                "minimization that is interrupted restarts from the last checkpoint "
+                "when the flowchart is rerun. The server is not used when "
+                "checkpointing."
+            ),
+        },
+        "trajectory interval": {
+            "default": "none",
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": ("none",),
+            "format_string": "",
+            "description": "Save a frame every:",
+            "help_text": (
+                "How many steps between frames of the trajectory of the "
+                "minimization, which is saved in trajectory.bin in the step's "
+                "directory. The server is not used when saving the trajectory."
+            ),
+        },
+        "trajectory energies": {
+            "default": "yes",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Energy of each frame:",
+            "help_text": (
+                "Whether to calculate the energy of each frame of the trajectory, "
+                "which costs an extra energy evaluation per frame. Otherwise only "
+                "the final frame has an energy."
+            ),
+        },
+        "scan source": {
+            "default": "configurations",
+            "kind": "enum",
+            "enumeration": (
+                "configurations",
+                "trajectory file",
+            ),
+            "format_string": "",
+            "description": "Structures from:",
+            "help_text": (
+                "Where to get the structures for the energy scan: the configurations "
+                "of the current system, or a trajectory file."
+            ),
+        },
+        "configurations": {
+            "default": "all",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": ("all",),
+            "format_string": "",
+            "description": "Configurations:",
+            "help_text": (
+                "The configurations of the current system to use in the scan, either "
+                "'all' or a list of ranges of the 1-based indices, e.g. '1-10, 12'."
+            ),
+        },
+        "trajectory file": {
+            "default": "",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Trajectory file:",
+            "help_text": (
+                "A file with the structures for the scan, in any multi-structure "
+                "format OpenBabel reads, such as .xyz or .sdf, or a NumPy .npy file "
+                "with an (n_points, n_atoms, 3) array of coordinates in Å."
+            ),
+        },
+        "scan gradients": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Calculate gradients:",
+            "help_text": "Whether to calculate the gradients for each structure.",
+        },
+        "torsion": {
+            "default": "1 2 3 4",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Torsion atoms:",
+            "help_text": "The 1-based indices of the four atoms defining the torsion.",
+        },
+        "first angle": {
+            "default": -180.0,
+            "kind": "float",
+            "default_units": "degree",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "From:",
+            "help_text": "The first angle for the torsion scan.",
+        },
+        "last angle": {
+            "default": 180.0,
+            "kind": "float",
+            "default_units": "degree",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "To:",
+            "help_text": "The last angle for the torsion scan.",
+        },
+        "angle step": {
+            "default": 15.0,
+            "kind": "float",
+            "default_units": "degree",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Step:",
+            "help_text": "The step between the angles in the torsion scan.",
+        },
+        "scan from both ends": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Scan from both ends in parallel:",
+            "help_text": (
+                "Whether to scan the two halves of the grid in parallel, each "
+                "starting from one end."
+            ),
+        },
+        "save structures": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Save structures as configurations:",
+            "help_text": (
+                "Whether to add the structure at each point of the torsion scan as a "
+                "new configuration of the system. The structures are always written "
+                "to 'torsion_scan.sdf'."
+            ),
+        },
+        "number of rotamers": {
+            "default": 1000,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Number of rotamers:",
+            "help_text": (
+                "The maximum number of rotamers to generate and minimize. If there "
+                "are more possible rotamers, they are sampled randomly."
+            ),
+        },
+        "energy window": {
+            "default": 20.0,
+            "kind": "float",
+            "default_units": "kJ/mol",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Energy window:",
+            "help_text": "Keep conformers within this energy of the lowest one.",
+        },
+        "rmsd threshold": {
+            "default": 0.5,
+            "kind": "float",
+            "default_units": "Å",
+            "enumeration": tuple(),
+            "format_string": ".2f",
+            "description": "RMSD threshold:",
+            "help_text": (
+                "Conformers whose heavy atoms have an RMSD less than this are "
+                "considered the same."
+            ),
+        },
+        "max conformers": {
+            "default": 10,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Maximum conformers:",
+            "help_text": (
+                "The maximum number of unique conformers to keep as new "
+                "configurations."
+            ),
+        },
+        "prune": {
+            "default": "yes",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Prune high-energy conformers:",
+            "help_text": (
+                "Whether to minimize in rounds, dropping conformers that are too "
+                "high in energy after each round."
+            ),
+        },
+        "pruning window": {
+            "default": 50.0,
+            "kind": "float",
+            "default_units": "kJ/mol",
+            "enumeration": tuple(),
+            "format_string": ".1f",
+            "description": "Pruning window:",
+            "help_text": (
+                "Drop conformers more than this above the lowest energy so far. It "
+                "should be larger than the energy window for keeping conformers, "
+                "since the energies are not yet converged."
+            ),
+        },
+        "pruning interval": {
+            "default": 50,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Steps per round:",
+            "help_text": "The number of minimization steps between pruning.",
+        },
+        "structures": {
+            "default": "configurations of the current system",
+            "kind": "enum",
+            "enumeration": (
+                "configurations of the current system",
+                "all systems",
+            ),
+            "format_string": "",
+            "description": "Structures to screen:",
+            "help_text": (
+                "The structures to screen: all the configurations of the current "
+                "system, or the current configuration of every system."
+            ),
+        },
+        "loose steps": {
+            "default": 50,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Steps in loose pass:",
+            "help_text": (
+                "The maximum number of steps for the loose minimization of every "
+                "structure."
+            ),
+        },
+        "tight selection": {
+            "default": "10%",
+            "kind": "string",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Fully minimize the lowest:",
+            "help_text": (
+                "How many of the lowest-energy structures after the loose pass to "
+                "minimize fully, either a number or a percentage such as '10%'."
+            ),
+        },
+        "number of processes": {
+            "default": "all",
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": ("all",),
+            "format_string": "",
+            "description": "Number of processes:",
+            "help_text": "The number of processes to use for the minimizations.",
+        },
+        "save coordinates": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Save the coordinates:",
+            "help_text": (
+                "Whether to save the final coordinates to coordinates.npy in the "
+                "step's directory, as well as the gradients to gradients.npy."
+            ),
+        },
+        "save atom data": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Save the gradients, charges and types on the atoms:",
+            "help_text": (
+                "Whether to store the gradients, and the partial charges and atom "
+                "types from the forcefield, on the atoms of the configuration, so "
+                "that other steps can use them."
+            ),
+        },
+        "inline array limit": {
+            "default": 1000,
+            "kind": "integer",
+            "default_units": "",
+            "enumeration": tuple(),
+            "format_string": "",
+            "description": "Largest system for inline gradients:",
+            "help_text": (
+                "The gradients are always saved to gradients.npy in the step's "
+                "directory, and referred to in Results.json. For systems with up to "
+                "this many atoms they are also available as a list, for variables, "
+                "tables and Results.json. In an energy scan of larger systems the "
+                "gradients are only written to scan.jsonl, point by point."
+            ),
+        },
+        "use server": {
+            "default": "no",
+            "kind": "boolean",
+            "default_units": "",
+            "enumeration": ("yes", "no"),
+            "format_string": "",
+            "description": "Use the QuickMin server:",
+            "help_text": (
+                "Whether to do the calculation on the local QuickMin server, if it "
+                "is running, which avoids the cost of starting OpenBabel and setting "
+                "up the forcefield."
+            ),
+        },
+        "profile": {
+            "default": "no",
+            "kind": "enum",
+            "default_units": "",
+            "enumeration": ("no", "yes", "yes, with memory"),
+            "format_string": "",
+            "description": "Profile the step:",
+            "help_text": (
+                "Whether to profile the step, writing profile.pstats and a summary "
+                "in profile.txt to the step's directory. 'yes, with memory' also "
+                "traces the memory allocated, which is slower. Setting the "
+                "environment variable QUICKMIN_PROFILE to 'yes' or 'memory' does the "
+                "same."
+            ),
+        },
+        "time limit": {
+            "default": "none",
+            "kind": "float",
+            "default_units": "s",
+            "enumeration": ("none",),
+            "format_string": ".1f",
+            "description": "Time limit per structure:",
+            "help_text": (
+                "The longest time to spend on each structure. Structures that take "
+                "longer, or that crash OpenBabel, are reported as failed. Setting "
+                "either limit runs each structure in a supervised process."
+            ),
+        },
+        "memory limit": {
+            "default": "none",
+            "kind": "float",
+            "default_units": "GB",
+            "enumeration": ("none",),
+            "format_string": ".1f",
+            "description": "Memory limit per process:",
+            "help_text": (
+                "The most memory each process may use. Structures that need more "
+                "are reported as failed."
+            ),
+        },
         # Results handling
         "results": {
             "default": {},
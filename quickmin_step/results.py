@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""Reading the results of QuickMin steps, with their arrays.
+
+Large arrays such as the gradients are saved as NumPy .npy files in the step's
+directory rather than as lists in Results.json, which would be megabytes of text
+for large systems. Results.json refers to them in its "arrays" section by path,
+shape, dtype and units::
+
+    "arrays": {
+        "gradients": {
+            "path": "gradients.npy",
+            "shape": [50000, 3],
+            "dtype": "<f8",
+            "units": "kJ/mol/Å"
+        }
+    }
+
+`load_results` reads Results.json and memory-maps the arrays, so only the parts
+used are read from disk.
+
+Calculations on many structures stream the result for each structure, as it is
+produced, to a JSON Lines file with `ResultsWriter`, so the results need not be
+held in memory, and can be followed with `read_results_lines` while the
+calculation is still running.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+results_file = "Results.json"
+
+
+def save_array(directory, name, array, units=None):
+    """Save an array as a .npy file in the directory.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step's directory.
+    name : str
+        The name of the array, which is also the name of the file.
+    array : numpy.ndarray
+        The array.
+    units : str = None
+        The units of the values, if any.
+
+    Returns
+    -------
+    dict
+        The reference to the array for Results.json.
+    """
+    array = np.ascontiguousarray(array)
+    path = Path(directory) / f"{name}.npy"
+    np.save(path, array, allow_pickle=False)
+    reference = {
+        "path": path.name,
+        "shape": list(array.shape),
+        "dtype": array.dtype.str,
+    }
+    if units is not None:
+        reference["units"] = units
+    return reference
+
+
+def load_array(directory, reference, mmap=True):
+    """Open an array saved with `save_array`.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step's directory.
+    reference : dict
+        The reference to the array in Results.json.
+    mmap : bool = True
+        Whether to memory-map the array rather than read it all.
+
+    Returns
+    -------
+    numpy.ndarray
+        The array, read-only if memory-mapped.
+    """
+    path = Path(directory) / reference["path"]
+    array = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    if list(array.shape) != list(reference["shape"]):
+        raise ValueError(
+            f"{path} has shape {array.shape}, not {tuple(reference['shape'])}."
+        )
+    return array
+
+
+def load_results(directory, mmap=True):
+    """Read the results of a step, with its arrays.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        The step's directory.
+    mmap : bool = True
+        Whether to memory-map the arrays rather than read them all.
+
+    Returns
+    -------
+    dict
+        The contents of Results.json, with the arrays referred to in it as NumPy
+        arrays in place of the lists stored for small systems.
+    """
+    directory = Path(directory)
+    results = json.loads((directory / results_file).read_text())
+    for name, reference in results.get("arrays", {}).items():
+        results[name] = load_array(directory, reference, mmap=mmap)
+    return results
+
+
+def _to_json(value):
+    """Convert NumPy values for JSON."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} cannot be written as JSON")
+
+
+class ResultsWriter(object):
+    """Write results one record at a time as JSON Lines.
+
+    Each record is written as a single line and flushed, so a reader following
+    the file only ever misses a final partial line.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The file, which is overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.n = 0
+        self._fd = open(self.path, "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, record):
+        """Write a record, a dict that may contain NumPy arrays and scalars."""
+        self._fd.write(json.dumps(record, default=_to_json) + "\n")
+        self._fd.flush()
+        self.n += 1
+
+    def close(self):
+        """Close the file."""
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+
+def read_results_lines(path):
+    """Read the records written by `ResultsWriter`, one at a time.
+
+    The file may still be being written, in which case only the complete records
+    are read.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The JSON Lines file.
+
+    Yields
+    ------
+    dict
+        Each record.
+    """
+    with open(path) as fd:
+        for line in fd:
+            if not line.endswith("\n"):
+                # Partly written
+                break
+            if line.strip() != "":
+                yield json.loads(line)
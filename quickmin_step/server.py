@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+"""A long-lived local server that does QuickMin calculations with warm workers.
+
+Each QuickMin step normally pays for loading OpenBabel's plugins and forcefield
+parameters, and for typing the molecule, before it can do any work. The server
+keeps worker processes with all that already loaded, and caches the forcefield
+setup of the last molecule, so repeated calculations on the same molecule, even
+from different jobs, skip the setup entirely. It listens on a Unix domain socket in
+the user's ~/.seamm.d/quickmin directory, so no network is needed::
+
+    quickmin-server start -n 4 &
+    quickmin-server status
+    quickmin-server stop
+
+Requests from concurrent clients that arrive close together are batched. Each
+molecule is always sent to the same worker, so that its setup can be reused.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import logging
+import multiprocessing.connection
+import os
+from pathlib import Path
+import queue
+import signal
+import sys
+import threading
+import time
+
+from . import forcefield
+from . import parallel
+
+logger = logging.getLogger(__name__)
+
+default_directory = Path("~/.seamm.d/quickmin")
+socket_name = "server.sock"
+key_name = "server.key"
+
+# The key and setup of the last calculation in each worker process. OpenBabel has
+# only one instance of each forcefield, so only the last setup can be reused.
+_last = None
+
+
+def _paths(directory=None):
+    """The socket and key files of the server."""
+    directory = default_directory if directory is None else Path(directory)
+    directory = directory.expanduser()
+    return directory / socket_name, directory / key_name
+
+
+def _initialize_worker():
+    """Load the OpenBabel plugins and forcefield parameters in a worker."""
+    for ff_name in forcefield.best_available:
+        try:
+            parallel.warm_up_worker(ff_name)
+        except Exception:
+            pass
+
+
+def _calculate_batch(requests):
+    """Do a batch of calculations in a worker, reusing the last setup if possible."""
+    global _last
+    from .quickmin import OutputGrabber
+
+    results = []
+    for request in requests:
+        try:
+            obmol = forcefield.obmol_from_text(request["text"], "mol2")
+            # The text only has 4 decimal places
+            forcefield.set_coordinates(obmol, request["coordinates"])
+            key = (
+                forcefield.topology_hash(obmol),
+                request["forcefield"],
+                request["calculation"] == "hydrogens only",
+                request["cutoff"],
+            )
+            setup = None
+            if _last is not None and _last[0] == key:
+                setup = _last[1]
+            _last = None
+            token = forcefield.CancellationToken(request.get("time_budget"))
+            out = OutputGrabber(sys.stderr)
+            with out:
+                result = forcefield.calculate(
+                    obmol,
+                    request["forcefield"],
+                    request["calculation"],
+                    request["n_steps"],
+                    request["cutoff"],
+                    setup=setup,
+                    callback=token,
+                )
+            result["stopped"] = token.reason
+            _last = (key, result.pop("setup"))
+            result["log"] = out.capturedtext
+            result["coordinates"] = forcefield.get_coordinates(obmol)
+            result["cached"] = setup is not None
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        results.append(result)
+    return results
+
+
+class Server(object):
+    """The server, which hands the requests to a set of warm workers.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path = None
+        The directory for the socket and key, by default ~/.seamm.d/quickmin.
+    n_processes : int or str = None
+        The number of worker processes, by default all the cores.
+    batch_delay : float = 0.005
+        How long to wait, in seconds, for more requests to batch with the first.
+    max_batch : int = 64
+        The largest number of requests in a batch.
+    """
+
+    def __init__(
+        self, directory=None, n_processes=None, batch_delay=0.005, max_batch=64
+    ):
+        self.address, self.keyfile = _paths(directory)
+        self.n_processes = parallel.n_workers(n_processes)
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.n_requests = 0
+        self.n_batches = 0
+        self.started = None
+        self._queue = queue.Queue()
+        self._workers = []
+        self._listener = None
+        self._stopping = False
+
+    def serve_forever(self):
+        """Start the workers and serve requests until told to stop."""
+        self.address.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self.address.exists():
+            if is_running(self.address.parent):
+                raise RuntimeError(f"A server is already running at {self.address}")
+            self.address.unlink()
+
+        authkey = os.urandom(32)
+        fd = os.open(self.keyfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+
+        self._workers = [
+            concurrent.futures.ProcessPoolExecutor(1, initializer=_initialize_worker)
+            for _ in range(self.n_processes)
+        ]
+        self._listener = multiprocessing.connection.Listener(
+            str(self.address), family="AF_UNIX", authkey=authkey
+        )
+        self.started = time.time()
+        dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        dispatcher.start()
+        logger.info(
+            f"The QuickMin server is listening on {self.address} with "
+            f"{self.n_processes} workers."
+        )
+
+        try:
+            while not self._stopping:
+                try:
+                    connection = self._listener.accept()
+                except (OSError, multiprocessing.AuthenticationError) as e:
+                    if not self._stopping:
+                        logger.warning(f"Refused a connection: {e}")
+                    continue
+                threading.Thread(
+                    target=self._handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            self._queue.put(None)
+            dispatcher.join()
+            for worker in self._workers:
+                worker.shutdown(cancel_futures=True)
+            self._listener.close()
+            self.keyfile.unlink(missing_ok=True)
+            logger.info("The QuickMin server has stopped.")
+
+    def stop(self):
+        """Stop the server, waking the listener with a connection."""
+        self._stopping = True
+        try:
+            multiprocessing.connection.Client(
+                str(self.address), family="AF_UNIX", authkey=self.keyfile.read_bytes()
+            ).close()
+        except Exception:
+            pass
+
+    def status(self):
+        """A description of the server."""
+        return {
+            "pid": os.getpid(),
+            "workers": self.n_processes,
+            "requests": self.n_requests,
+            "batches": self.n_batches,
+            "uptime": time.time() - self.started,
+        }
+
+    def _handle(self, connection):
+        """Serve the requests from one client until it disconnects."""
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+                op = request.get("op")
+                if op == "calculate":
+                    future = concurrent.futures.Future()
+                    self._queue.put((request, future))
+                    try:
+                        reply = future.result()
+                    except Exception as e:
+                        reply = {"error": f"{type(e).__name__}: {e}"}
+                elif op == "status":
+                    reply = self.status()
+                elif op == "shutdown":
+                    connection.send({"stopping": True})
+                    self.stop()
+                    break
+                else:
+                    reply = {"error": f"Unknown request '{op}'"}
+                try:
+                    connection.send(reply)
+                except OSError:
+                    break
+
+    def _dispatch(self):
+        """Gather requests into batches and send them to the workers."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+
+            # Each molecule goes to the same worker, which has its setup cached
+            groups = collections.defaultdict(list)
+            for request, future in batch:
+                groups[hash(request["key"]) % self.n_processes].append(
+                    (request, future)
+                )
+            for i, group in groups.items():
+                self._submit(self._workers[i], group)
+            self.n_requests += len(batch)
+            self.n_batches += len(groups)
+
+    def _submit(self, worker, group):
+        """Send a group of requests to a worker, and return the results."""
+
+        def done(batch_future):
+            try:
+                results = batch_future.result()
+            except Exception as e:
+                results = [{"error": f"{type(e).__name__}: {e}"}] * len(group)
+            for (request, future), result in zip(group, results):
+                future.set_result(result)
+
+        try:
+            batch_future = worker.submit(
+                _calculate_batch, [request for request, future in group]
+            )
+        except Exception as e:
+            for request, future in group:
+                future.set_result({"error": f"{type(e).__name__}: {e}"})
+        else:
+            batch_future.add_done_callback(done)
+
+
+class Client(object):
+    """A connection to the QuickMin server.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path = None
+        The directory for the socket and key, by default ~/.seamm.d/quickmin.
+
+    Raises
+    ------
+    ConnectionError
+        If the server is not running.
+    """
+
+    def __init__(self, directory=None):
+        address, keyfile = _paths(directory)
+        if not address.exists() or not keyfile.exists():
+            raise ConnectionError("The QuickMin server is not running.")
+        try:
+            self.connection = multiprocessing.connection.Client(
+                str(address), family="AF_UNIX", authkey=keyfile.read_bytes()
+            )
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            raise ConnectionError(f"Could not connect to the QuickMin server: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+    def request(self, **request):
+        """Send a request and wait for the reply."""
+        self.connection.send(request)
+        return self.connection.recv()
+
+    def calculate(
+        self,
+        obmol,
+        forcefield_name="best available",
+        calculation="optimization",
+        n_steps=1000,
+        cutoff=6.0,
+        time_budget=None,
+    ):
+        """Minimize the molecule or calculate its energy on the server.
+
+        Parameters
+        ----------
+        obmol : openbabel.OBMol
+            The molecule.
+        forcefield_name : str = "best available"
+            The forcefield as given in the parameters.
+        calculation : str = "optimization"
+            "optimization", "hydrogens only" or "single-point energy".
+        n_steps : int = 1000
+            The maximum number of steps.
+        cutoff : float = 6.0
+            The nonbonded cutoff in Å, used when only minimizing the hydrogens.
+        time_budget : float = None
+            The longest time in seconds to spend minimizing.
+
+        Returns
+        -------
+        dict
+            As from `forcefield.calculate`, plus the "coordinates", the OpenBabel
+            "log" and why the minimization was "stopped" early, if it was, or an
+            "error".
+        """
+        return self.request(
+            op="calculate",
+            key=forcefield.topology_hash(obmol),
+            # Unlike SDF, MOL2 keeps the order of the bonds, and so the results
+            text=forcefield.obmol_to_text(obmol, "mol2"),
+            coordinates=forcefield.get_coordinates(obmol),
+            forcefield=forcefield_name,
+            calculation=calculation,
+            n_steps=n_steps,
+            cutoff=cutoff,
+            time_budget=time_budget,
+        )
+
+    def status(self):
+        """The status of the server."""
+        return self.request(op="status")
+
+    def shutdown(self):
+        """Ask the server to stop."""
+        return self.request(op="shutdown")
+
+
+def is_running(directory=None):
+    """Whether the server is running and answering."""
+    try:
+        with Client(directory) as client:
+            client.status()
+        return True
+    except (ConnectionError, EOFError, OSError):
+        return False
+
+
+def main(argv=None):
+    """Start, stop or query the QuickMin server."""
+    parser = argparse.ArgumentParser(
+        prog="quickmin-server",
+        description="A local server for QuickMin calculations with warm workers.",
+    )
+    parser.add_argument("command", choices=("start", "stop", "status"))
+    parser.add_argument(
+        "-n",
+        "--processes",
+        type=int,
+        default=0,
+        help="The number of worker processes (default: all the cores)",
+    )
+    parser.add_argument(
+        "--directory",
+        default=None,
+        help="The directory for the socket (default: ~/.seamm.d/quickmin)",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s: %(message)s")
+
+    if args.command == "start":
+        # Shut down cleanly when terminated
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        server = Server(args.directory, args.processes)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            print(f"quickmin-server: error: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    try:
+        with Client(args.directory) as client:
+            if args.command == "stop":
+                client.shutdown()
+                print("The QuickMin server is stopping.")
+            else:
+                for key, value in client.status().items():
+                    print(f"{key:>10s}: {value}")
+    except ConnectionError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
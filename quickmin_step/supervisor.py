@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""Running jobs in supervised worker processes that may crash or hang.
+
+OpenBabel occasionally segfaults or loops forever on unusual inputs. With a
+`concurrent.futures.ProcessPoolExecutor` a crashed worker breaks the whole pool,
+and a hung one blocks it forever. The `SupervisedExecutor` here watches each worker:
+a job that crashes its worker, runs past the time limit, or exceeds the memory
+limit fails with `WorkerFailed`, the worker is replaced, and the other jobs carry
+on. It has the same interface as the executors in `concurrent.futures`, so the
+futures work with `concurrent.futures.wait` and `as_completed`.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerFailed(RuntimeError):
+    """A job crashed its worker process or exceeded its limits."""
+
+
+def _worker_main(conn, memory_limit, initializer, initargs):
+    """The loop in each worker process, running jobs until told to stop."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit is not None:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception as e:
+            logger.warning(f"The initializer of a worker failed: {e}")
+    conn.send("ready")
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        fn, args, kwargs = job
+        try:
+            result = (True, fn(*args, **kwargs))
+        except BaseException as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # The result or exception could not be pickled
+            conn.send((False, WorkerFailed(f"{type(e).__name__}: {e}")))
+
+
+class _Worker(object):
+    """A worker process and the job it is running."""
+
+    def __init__(self, context, memory_limit, initializer, initargs):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child, memory_limit, initializer, initargs),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.ready = False
+        self.future = None
+        self.started = None
+
+    def stop(self, kill=False):
+        """Stop the process, killing it if it is running a job."""
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.process.join(timeout=None if not kill else 5)
+        self.conn.close()
+
+
+class SupervisedExecutor(concurrent.futures.Executor):
+    """An executor whose jobs each run with a time limit in a replaceable process.
+
+    Parameters
+    ----------
+    max_workers : int = 1
+        The number of worker processes.
+    timeout : float = None
+        The wall-clock time limit in seconds for each job.
+    memory_limit : int = None
+        The limit on the address space of each worker in bytes, set with
+        RLIMIT_AS.
+    initializer : callable = None
+        A function called in each worker when it starts, including replacements,
+        for example to load parameters. The time limit only starts once it is done.
+    initargs : tuple = ()
+        The arguments for the initializer.
+    """
+
+    def __init__(
+        self,
+        max_workers=1,
+        timeout=None,
+        memory_limit=None,
+        initializer=None,
+        initargs=(),
+    ):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.initializer = initializer
+        self.initargs = initargs
+        self.n_replaced = 0
+
+        self._context = multiprocessing.get_context()
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._shutdown = False
+        self._broken = None
+        self._workers = [self._start_worker() for _ in range(self.max_workers)]
+        self._thread = threading.Thread(target=self._manage, daemon=True)
+        self._thread.start()
+
+    def _start_worker(self):
+        return _Worker(
+            self._context, self.memory_limit, self.initializer, self.initargs
+        )
+
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(None)
+        except OSError:
+            pass
+
+    def submit(self, fn, /, *args, **kwargs):
+        """Schedule fn(*args, **kwargs), returning a Future."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit jobs after shutdown.")
+            if self._broken is not None:
+                raise WorkerFailed(self._broken)
+            self._queue.append((future, fn, args, kwargs))
+        self._wakeup()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Stop the workers once the queued jobs are done, or cancel the jobs."""
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while len(self._queue) > 0:
+                    future, fn, args, kwargs = self._queue.popleft()
+                    future.cancel()
+        self._wakeup()
+        if wait:
+            self._thread.join()
+
+    def _replace(self, worker, message):
+        """Fail the worker's job and start a new worker in its place."""
+        future = worker.future
+        worker.future = None
+        worker.stop(kill=True)
+        self._workers[self._workers.index(worker)] = self._start_worker()
+        self.n_replaced += 1
+        logger.warning(f"Replaced a worker process: {message}")
+        if future is not None:
+            future.set_exception(WorkerFailed(message))
+
+    def _failed_to_start(self, worker):
+        """Give up when a new worker dies, failing the queued jobs."""
+        worker.process.join()
+        reason = _describe_exit(worker.process.exitcode)
+        self._broken = f"A worker process could not start: {reason}"
+        logger.error(self._broken)
+        worker.conn.close()
+        self._workers.remove(worker)
+        with self._lock:
+            while len(self._queue) > 0:
+                future, fn, args, kwargs = self._queue.popleft()
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(WorkerFailed(self._broken))
+
+    def _manage(self):
+        """The thread that hands out jobs and watches the workers."""
+        while True:
+            # Hand out queued jobs to idle workers
+            with self._lock:
+                for worker in self._workers:
+                    if worker.future is not None or not worker.ready:
+                        continue
+                    while len(self._queue) > 0:
+                        future, fn, args, kwargs = self._queue.popleft()
+                        if future.set_running_or_notify_cancel():
+                            break
+                    else:
+                        break
+                    try:
+                        worker.conn.send((fn, args, kwargs))
+                    except Exception as e:
+                        future.set_exception(e)
+                        continue
+                    worker.future = future
+                    worker.started = time.monotonic()
+                busy = [w for w in self._workers if w.future is not None]
+                starting = [w for w in self._workers if not w.ready]
+                if (
+                    (self._shutdown or self._broken is not None)
+                    and len(self._queue) == 0
+                    and len(busy) == 0
+                ):
+                    break
+
+            # Wait for a worker to start, a result, a crash, a new job, or the next
+            # time limit
+            wait_for = [self._wakeup_reader]
+            for worker in busy + starting:
+                wait_for.extend((worker.conn, worker.process.sentinel))
+            timeout = None
+            if self.timeout is not None and len(busy) > 0:
+                first = min(worker.started for worker in busy)
+                timeout = max(0.0, first + self.timeout - time.monotonic())
+            ready = multiprocessing.connection.wait(wait_for, timeout=timeout)
+
+            if self._wakeup_reader in ready:
+                while self._wakeup_reader.poll():
+                    self._wakeup_reader.recv()
+
+            for worker in starting:
+                if worker.conn in ready:
+                    try:
+                        worker.conn.recv()
+                        worker.ready = True
+                    except (EOFError, OSError):
+                        self._failed_to_start(worker)
+                elif worker.process.sentinel in ready:
+                    self._failed_to_start(worker)
+
+            for worker in busy:
+                if worker.conn in ready:
+                    try:
+                        ok, value = worker.conn.recv()
+                    except (EOFError, OSError):
+                        worker.process.join()
+                        self._replace(worker, _describe_exit(worker.process.exitcode))
+                        continue
+                    future = worker.future
+                    worker.future = None
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                elif worker.process.sentinel in ready:
+                    worker.process.join()
+                    self._replace(worker, _describe_exit(worker.process.exitcode))
+                elif (
+                    self.timeout is not None
+                    and time.monotonic() - worker.started >= self.timeout
+                ):
+                    self._replace(worker, f"the job took longer than {self.timeout} s.")
+
+        for worker in self._workers:
+            worker.stop()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+
+def _describe_exit(code):
+    """A description of why a worker process exited."""
+    if code is not None and code < 0:
+        try:
+            name = signal.Signals(-code).name
+        except ValueError:
+            name = f"signal {-code}"
+        return f"the worker process was killed by {name}."
+    return f"the worker process exited with code {code}."
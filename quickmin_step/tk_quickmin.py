@@ -133,6 +133,8 @@ class TkQuickMin(seamm.TkNode):
 
         # and binding to change as needed
         self["calculation"].combobox.bind("<<ComboboxSelected>>", self.reset_dialog)
+        self["scan source"].combobox.bind("<<ComboboxSelected>>", self.reset_dialog)
+        self["prune"].combobox.bind("<<ComboboxSelected>>", self.reset_dialog)
 
         # and lay them out
         self.reset_dialog()
@@ -177,8 +179,23 @@ class TkQuickMin(seamm.TkNode):
             widgets.append(self[key])
             row += 1
 
-        if calculation == "optimization":
-            for key in ("n_steps",):
+        if calculation in ("optimization", "hydrogens only"):
+            keys = ["n_steps"]
+            if calculation == "hydrogens only":
+                keys.append("cutoff")
+            keys.extend(
+                (
+                    "time budget",
+                    "checkpoint interval",
+                    "trajectory interval",
+                    "trajectory energies",
+                    "use server",
+                    "save atom data",
+                    "save coordinates",
+                    "inline array limit",
+                )
+            )
+            for key in keys:
                 self[key].grid(row=row, column=0, sticky=tk.EW)
                 widgets.append(self[key])
                 row += 1
@@ -188,6 +205,74 @@ class TkQuickMin(seamm.TkNode):
                 widgets.append(self[key])
                 row += 1
 
+        elif calculation == "single-point energy":
+            for key in (
+                "use server",
+                "save atom data",
+                "save coordinates",
+                "inline array limit",
+            ):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                widgets.append(self[key])
+                row += 1
+
+        elif calculation == "energy scan":
+            keys = ["scan source"]
+            if self["scan source"].get() == "trajectory file":
+                keys.append("trajectory file")
+            else:
+                keys.append("configurations")
+            keys.extend(("scan gradients", "inline array limit"))
+            for key in keys:
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                widgets.append(self[key])
+                row += 1
+
+        elif calculation == "torsion scan":
+            for key in (
+                "torsion",
+                "first angle",
+                "last angle",
+                "angle step",
+                "n_steps",
+                "scan from both ends",
+                "save structures",
+            ):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                widgets.append(self[key])
+                row += 1
+
+        elif calculation == "conformer search":
+            keys = ["number of rotamers", "n_steps", "prune"]
+            if self["prune"].get() == "yes":
+                keys.extend(("pruning window", "pruning interval"))
+            keys.extend(
+                (
+                    "energy window",
+                    "rmsd threshold",
+                    "max conformers",
+                    "number of processes",
+                )
+            )
+            for key in keys:
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                widgets.append(self[key])
+                row += 1
+
+        elif calculation == "funnel screening":
+            for key in (
+                "structures",
+                "loose steps",
+                "tight selection",
+                "n_steps",
+                "number of processes",
+                "time limit",
+                "memory limit",
+            ):
+                self[key].grid(row=row, column=0, sticky=tk.EW)
+                widgets.append(self[key])
+                row += 1
+
         # Align the labels
         sw.align_labels(widgets, sticky=tk.E)
 
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""Saving the path of a minimization, and reading it back lazily.
+
+The trajectory is a single file with a small JSON header followed by preallocated
+arrays of the step, energy and coordinates of each frame. The file is memory-mapped,
+so saving a frame is just a copy into the mapping, and readers only touch the
+frames they use::
+
+    trajectory = Trajectory("trajectory.bin")
+    for step, energy, xyz in zip(
+        trajectory.steps, trajectory.energies, trajectory.coordinates
+    ):
+        ...
+
+The energy of the first frame, the starting structure, is NaN since OpenBabel does
+not report it. OpenBabel does not report the energies during the minimization
+either, so each costs an extra evaluation, and without them only the final frame
+has an energy. Unused frames have a step of -1, so a trajectory from a job that was
+killed can still be read up to the last frame written.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+from seamm_util import Q_
+
+from .forcefield import get_coordinates
+
+header_size = 512
+file_format = "QuickMin trajectory"
+
+
+class TrajectoryWriter(object):
+    """A callback for `forcefield.minimize` that saves a frame every so often.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The trajectory file, which is overwritten.
+    obmol : openbabel.OBMol
+        The molecule being minimized, with its starting coordinates.
+    interval : int
+        The number of steps between frames.
+    n_steps : int
+        The maximum number of steps, used to size the file.
+    first_step : int = 0
+        The number of steps already taken, when restarting.
+    energies : bool = True
+        Whether to calculate the energy of each frame.
+    """
+
+    def __init__(self, path, obmol, interval, n_steps, first_step=0, energies=True):
+        self.path = Path(path)
+        self.obmol = obmol
+        self.interval = interval
+        self.first_step = first_step
+        self.with_energies = energies
+        self.n_frames = 0
+        self._last = 0
+        self._factor = None
+
+        n_atoms = obmol.NumAtoms()
+        # The starting and final structures, and one every interval steps between
+        capacity = n_steps // interval + 2
+        steps_offset = header_size
+        energies_offset = steps_offset + 8 * capacity
+        coordinates_offset = energies_offset + 8 * capacity
+        header = {
+            "format": file_format,
+            "version": 1,
+            "n_atoms": n_atoms,
+            "capacity": capacity,
+            "interval": interval,
+            "units": {"energy": "kJ/mol", "coordinates": "Å"},
+            "steps": {"offset": steps_offset, "dtype": "<i8"},
+            "energies": {"offset": energies_offset, "dtype": "<f8"},
+            "coordinates": {"offset": coordinates_offset, "dtype": "<f4"},
+        }
+        text = json.dumps(header).encode()
+        if len(text) >= header_size:
+            raise ValueError("The trajectory header is too large.")
+
+        with open(self.path, "wb") as fd:
+            fd.write(text.ljust(header_size - 1) + b"\n")
+            fd.truncate(coordinates_offset + 4 * capacity * n_atoms * 3)
+        self.steps = np.memmap(
+            self.path, dtype="<i8", mode="r+", offset=steps_offset, shape=capacity
+        )
+        self.steps[:] = -1
+        self.energies = np.memmap(
+            self.path, dtype="<f8", mode="r+", offset=energies_offset, shape=capacity
+        )
+        self.coordinates = np.memmap(
+            self.path,
+            dtype="<f4",
+            mode="r+",
+            offset=coordinates_offset,
+            shape=(capacity, n_atoms, 3),
+        )
+        # The energy of the starting structure is not known until it is minimized
+        self.append(first_step, np.nan)
+
+    def __call__(self, obFF, steps):
+        if steps - self._last >= self.interval:
+            self._last = steps
+            obFF.GetCoordinates(self.obmol)
+            energy = self._energy(obFF) if self.with_energies else np.nan
+            self.append(self.first_step + steps, energy)
+        return False
+
+    def _energy(self, obFF):
+        """The current energy in kJ/mol."""
+        if self._factor is None:
+            self._factor = Q_(1.0, obFF.GetUnit()).m_as("kJ/mol")
+        return self._factor * obFF.Energy(False)
+
+    def append(self, step, energy):
+        """Save the current coordinates of the molecule as the next frame."""
+        if self.n_frames >= self.steps.shape[0]:
+            return
+        i = self.n_frames
+        self.coordinates[i] = get_coordinates(self.obmol)
+        self.energies[i] = energy
+        # The step last, so that readers only see complete frames
+        self.steps[i] = step
+        self.n_frames += 1
+
+    def close(self, step=None, energy=None):
+        """Save the final structure, if given, and flush the file.
+
+        Parameters
+        ----------
+        step : int = None
+            The number of steps taken in this run.
+        energy : float = None
+            The final energy in kJ/mol.
+        """
+        if step is not None and step != self._last:
+            self.append(self.first_step + step, energy)
+        elif step is not None and energy is not None and self.n_frames > 0:
+            # The final structure is already the last frame, perhaps without energy
+            self.energies[self.n_frames - 1] = energy
+        for array in (self.steps, self.energies, self.coordinates):
+            array.flush()
+        del self.steps, self.energies, self.coordinates
+
+
+class Trajectory(object):
+    """A trajectory from `TrajectoryWriter`, read lazily.
+
+    The arrays are read-only memory maps of the frames written, so opening even a
+    large trajectory reads only the header.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The trajectory file.
+
+    Attributes
+    ----------
+    header : dict
+        The JSON header.
+    steps : numpy.ndarray
+        The step of each frame.
+    energies : numpy.ndarray
+        The energy of each frame in kJ/mol.
+    coordinates : numpy.ndarray
+        The (n_frames, n_atoms, 3) coordinates in Å, as float32.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as fd:
+            self.header = json.loads(fd.read(header_size))
+        if self.header.get("format") != file_format:
+            raise ValueError(f"{self.path} is not a QuickMin trajectory.")
+
+        capacity = self.header["capacity"]
+        steps = self._map("steps", capacity)
+        n_frames = int(np.count_nonzero(steps >= 0))
+        self.steps = steps[:n_frames]
+        self.energies = self._map("energies", capacity)[:n_frames]
+        self.coordinates = self._map(
+            "coordinates", (capacity, self.header["n_atoms"], 3)
+        )[:n_frames]
+
+    def __len__(self):
+        return self.steps.shape[0]
+
+    def __getitem__(self, i):
+        """The coordinates of frame i."""
+        return self.coordinates[i]
+
+    def _map(self, name, shape):
+        """A read-only memory map of one of the arrays."""
+        return np.memmap(
+            self.path,
+            dtype=self.header[name]["dtype"],
+            mode="r",
+            offset=self.header[name]["offset"],
+            shape=shape,
+        )
@@ -76,6 +76,11 @@ setup(
         'Programming Language :: Python :: 3.9',
     ],
     entry_points={
+        'console_scripts': [
+            'quickmin-batch = quickmin_step.batch:main',
+            'quickmin-cost-model = quickmin_step.cost:main',
+            'quickmin-server = quickmin_step.server:main',
+        ],
         'org.molssi.seamm': [
             'QuickMin = quickmin_step:QuickMinStep',
         ],
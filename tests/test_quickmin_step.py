@@ -11,3 +11,801 @@ def test_construction():
     """Just create an object and test its type."""
     result = quickmin_step.QuickMin()
     assert str(type(result)) == "<class 'quickmin_step.quickmin.QuickMin'>"
+
+
+def test_parse_indices():
+    """Ranges of configurations are 1-based and inclusive."""
+    from quickmin_step.quickmin import _parse_indices
+
+    assert _parse_indices("1-3, 5", 5) == [0, 1, 2, 4]
+    with pytest.raises(ValueError):
+        _parse_indices("2-6", 5)
+
+
+def test_unique_conformers():
+    """Rotated copies are duplicates, distorted structures are not."""
+    import numpy as np
+    from quickmin_step.conformers import (
+        rmsd_to_many,
+        superposition_rotation,
+        unique_conformers,
+    )
+
+    rng = np.random.default_rng(1)
+    xyz = rng.normal(size=(8, 3))
+    c, s = np.cos(0.7), np.sin(0.7)
+    rotated = xyz @ np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]]) + 2.0
+    distorted = xyz + rng.normal(scale=1.0, size=xyz.shape)
+    coordinates = np.array([xyz, rotated, distorted])
+
+    assert rmsd_to_many(xyz, coordinates[1:2])[0] == pytest.approx(0.0, abs=1e-6)
+    R = superposition_rotation(xyz, rotated)
+    assert (xyz - xyz.mean(axis=0)) @ R == pytest.approx(rotated - rotated.mean(axis=0))
+    assert unique_conformers([1.0, 0.0, 2.0], coordinates) == [1, 2]
+    assert unique_conformers([1.0, 0.0, 2.0], coordinates, window=1.5) == [1]
+    # An unconverged structure is neither kept nor hides its converged twin
+    converged = [True, False, True]
+    kept = unique_conformers([1.0, 0.0, 2.0], coordinates, converged=converged)
+    assert kept == [0, 2]
+
+
+@pytest.mark.parametrize("both_ends", [False, True])
+def test_torsion_drive(both_ends):
+    """The minimized structures keep the torsion at the angles of the scan."""
+    import numpy as np
+    from openbabel import openbabel
+    from quickmin_step import forcefield
+
+    obmol = forcefield.obmol_from_text("CCCCO", "smi")
+    obmol.AddHydrogens()
+    openbabel.OBBuilder().Build(obmol)
+    atoms = [1, 2, 3, 4]
+    angles = [0.0, -60.0, 120.0, 180.0]
+
+    if both_ends:
+        energies, torsions, coordinates = forcefield.torsion_drive_from_both_ends(
+            obmol, "GAFF", atoms, angles
+        )
+    else:
+        obFF, _ = forcefield.setup_forcefield(obmol, "GAFF", log_level=0)
+        energies, torsions, coordinates = forcefield.torsion_drive(
+            obFF, obmol, atoms, angles
+        )
+
+    for angle, torsion, xyz in zip(angles, torsions, coordinates):
+        assert abs(forcefield.angle_difference(torsion, angle)) <= 0.5
+        forcefield.set_coordinates(obmol, xyz)
+        final = obmol.GetTorsion(*[obmol.GetAtom(i) for i in atoms])
+        assert abs(forcefield.angle_difference(final, angle)) <= 0.5
+    # Eclipsed is highest and anti lowest
+    assert np.argmax(energies) == 0 and np.argmin(energies) == 3
+
+
+def test_minimize_with_pruning():
+    """A conformer far above the others is dropped, the rest minimized fully."""
+    import numpy as np
+    from openbabel import openbabel
+    from quickmin_step import forcefield, parallel
+
+    obmol = forcefield.obmol_from_text("CCCCCC", "smi")
+    obmol.AddHydrogens()
+    openbabel.OBBuilder().Build(obmol)
+    xyz = forcefield.get_coordinates(obmol)
+    rng = np.random.default_rng(3)
+    coordinates = np.array(
+        [xyz + rng.normal(scale=0.02, size=xyz.shape) for _ in range(3)]
+        + [xyz + rng.normal(scale=0.5, size=xyz.shape)]
+    )
+
+    energies, converged, _, pruned = parallel.minimize_with_pruning(
+        obmol, "MMFF94", coordinates, n_steps=2000, interval=10, n_processes=1
+    )
+    assert pruned.tolist() == [False, False, False, True]
+    assert converged.tolist() == [True, True, True, False]
+    # The high conformer is left as it was after the first round of 10 steps
+    obFF, _ = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+    first, _, _ = forcefield.minimize_many(obFF, obmol, coordinates[3:], n_steps=10)
+    assert energies[3] == pytest.approx(first[0])
+    assert energies[3] - energies[:3].max() > 50.0
+
+
+def test_n_selected():
+    """The tight pass takes a count or a percentage, but at least one."""
+    from quickmin_step.quickmin import _n_selected
+
+    assert _n_selected("10%", 95) == 10
+    assert _n_selected("25", 10) == 10
+    assert _n_selected("1%", 5) == 1
+    assert _n_selected("10%", 0) == 0
+
+
+def test_batch_keeps_order(tmp_path):
+    """Bad SMILES are reported in place, and the output is in input order."""
+    from quickmin_step.batch import minimize_file
+
+    smiles = tmp_path / "input.smi"
+    smiles.write_text("CCO ethanol\nC1CC broken\nCC ethane\n")
+    output = tmp_path / "output.sdf"
+    counts = minimize_file(smiles, output, ff_name="MMFF94", n_processes=1)
+
+    assert counts["failed"] == 1
+    records = output.read_text().split("$$$$\n")[:-1]
+    assert [r.splitlines()[0] for r in records] == ["ethanol", "broken", "ethane"]
+    assert "<QuickMin error>" in records[1]
+
+
+def test_batch_resumes(tmp_path):
+    """A rerun skips finished molecules and removes partial output."""
+    from quickmin_step.batch import minimize_file
+
+    smiles = tmp_path / "input.smi"
+    smiles.write_text("CCO ethanol\nCC ethane\nCCC propane\n")
+    output = tmp_path / "output.sdf"
+    minimize_file(smiles, output, ff_name="MMFF94", n_processes=1, checkpoint=2)
+    complete = output.read_text()
+    with open(output, "a") as fd:
+        fd.write("partial\n")
+
+    counts = minimize_file(smiles, output, ff_name="MMFF94", n_processes=1)
+    assert counts["previously done"] == 3
+    assert sum(counts.values()) == 3
+    assert output.read_text() == complete
+
+
+def test_cost_model_fit():
+    """The cost model recovers the coefficients used to make the timings."""
+    from quickmin_step.cost import CostModel
+
+    truth = CostModel(
+        {
+            "intercept": -12.0,
+            "log n atoms": 2.0,
+            "log n rotors": 0.3,
+            "log n steps": 1.0,
+            "UFF": 0.7,
+        }
+    )
+    timings = [
+        {
+            "n atoms": n_atoms,
+            "n rotors": n_rotors,
+            "forcefield": ff_name,
+            "n steps": 1000,
+            "time": truth.predict(n_atoms, n_rotors, ff_name, 1000),
+        }
+        for n_atoms in (10, 50, 200)
+        for n_rotors in (0, 3, 12)
+        for ff_name in ("GAFF", "UFF")
+    ]
+    model = CostModel.fit(timings)
+    for key, value in truth.coefficients.items():
+        assert model.coefficients[key] == pytest.approx(value)
+
+
+def test_timing_log(tmp_path):
+    """Times are logged by the forcefield requested, as used for predictions."""
+    import math
+    from openbabel import openbabel
+    from quickmin_step import forcefield
+    from quickmin_step.cost import CostModel, read_timings
+    from quickmin_step.parallel import minimize_molecules
+
+    texts = []
+    for smiles in ("CCO", "CCCC", "OCCO"):
+        obmol = forcefield.obmol_from_text(smiles, "smi")
+        obmol.AddHydrogens()
+        openbabel.OBBuilder().Build(obmol)
+        texts.append(forcefield.obmol_to_text(obmol))
+    path = tmp_path / "timings.jsonl"
+    model = CostModel({**CostModel().coefficients, "best available": 1.0})
+    for ff_name in ("best available", "MMFF94 -- MMFF94 force field"):
+        minimize_molecules(
+            texts, ff_name, n_steps=10, n_processes=1, timings=path, model=model
+        )
+
+    timings = read_timings(path)
+    assert [t["forcefield"] for t in timings] == 3 * ["best available"] + 3 * ["MMFF94"]
+    assert [t.get("resolved forcefield") for t in timings] == 3 * ["GAFF"] + 3 * [None]
+    # The factor for "best available" was used
+    default = CostModel().predict(
+        timings[0]["n atoms"], timings[0]["n rotors"], "x", 10
+    )
+    assert timings[0]["predicted"] == pytest.approx(default * math.e, abs=1e-6)
+
+
+def _crash():
+    import os
+    import signal
+
+    os.kill(os.getpid(), signal.SIGSEGV)
+
+
+def _hang():
+    import time
+
+    time.sleep(60)
+
+
+def test_supervised_executor():
+    """Crashed and hung jobs fail on their own, and the workers are replaced."""
+    from quickmin_step.supervisor import SupervisedExecutor, WorkerFailed
+
+    with SupervisedExecutor(2, timeout=1.0) as executor:
+        crashed = executor.submit(_crash)
+        hung = executor.submit(_hang)
+        values = [executor.submit(abs, -i) for i in range(5)]
+
+        with pytest.raises(WorkerFailed, match="SIGSEGV"):
+            crashed.result()
+        with pytest.raises(WorkerFailed, match="longer than"):
+            hung.result()
+        assert [f.result() for f in values] == [0, 1, 2, 3, 4]
+        assert executor.n_replaced == 2
+
+
+def test_shared_memory_pool():
+    """The workers minimize in place in shared memory, and return the gradients."""
+    import numpy as np
+    from quickmin_step import forcefield, parallel
+
+    obmol = forcefield.obmol_from_text("CCCC", "smi")
+    obmol.AddHydrogens()
+    rng = np.random.default_rng(3)
+    xyz = rng.normal(scale=1.5, size=(obmol.NumAtoms(), 3))
+    coordinates = np.array([xyz, xyz + 0.1, xyz - 0.1, xyz * 1.1])
+
+    with parallel.MinimizerPool(obmol, "MMFF94", 2, block_size=1) as pool:
+        energies, converged, minimized, gradients = pool.minimize(
+            coordinates, n_steps=20, gradients=True
+        )
+        obFF, ff_name = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+        expected, expected_gradients = forcefield.energy_scan(
+            obFF, obmol, minimized, gradients=True
+        )
+        assert np.allclose(energies, expected)
+        assert np.allclose(gradients, expected_gradients)
+        del minimized, gradients
+
+
+def test_minimize_async():
+    """Concurrent minimizations from asyncio give the same energies."""
+    import asyncio
+    import numpy as np
+    from openbabel import openbabel
+    from quickmin_step import AsyncMinimizer, forcefield
+    from seamm_util import Q_
+
+    obmol = forcefield.obmol_from_text("CCO", "smi")
+    openbabel.OBBuilder().Build(obmol)
+    obmol.AddHydrogens()
+
+    async def main():
+        async with AsyncMinimizer(max_concurrent=2, n_processes=2) as minimizer:
+            return await asyncio.gather(
+                *[minimizer.minimize(obmol, "MMFF94", n_steps=200) for _ in range(3)]
+            )
+
+    results = asyncio.run(main())
+    assert len({round(r["energy"], 6) for r in results}) == 1
+    assert all(r["converged"] for r in results)
+
+    # The progress comes with the energy at that step
+    obmol = forcefield.obmol_from_text("CCCCCCCCCCCC", "smi")
+    openbabel.OBBuilder().Build(obmol)
+    obmol.AddHydrogens()
+    xyz = forcefield.get_coordinates(obmol)
+    rng = np.random.default_rng(7)
+    forcefield.set_coordinates(obmol, xyz + rng.normal(scale=0.2, size=xyz.shape))
+    reports = []
+
+    async def watch():
+        async with AsyncMinimizer(n_processes=1, poll_interval=0.0) as minimizer:
+            return await minimizer.minimize(
+                obmol,
+                "MMFF94",
+                n_steps=2000,
+                progress=lambda steps, energy: reports.append((steps, energy)),
+            )
+
+    result = asyncio.run(watch())
+    assert len(reports) > 0
+    steps = [step for step, energy in reports]
+    assert steps == sorted(set(steps)) and steps[-1] <= result["n steps"]
+    final = Q_(result["energy"], result["units"]).m_as("kJ/mol")
+    assert all(energy > final - 1e-6 for step, energy in reports)
+
+
+def test_cancellation_token():
+    """A cancelled minimization stops after the first chunk, unconverged."""
+    import numpy as np
+    from quickmin_step import forcefield
+
+    obmol = forcefield.obmol_from_text("CCCCCC", "smi")
+    obmol.AddHydrogens()
+    rng = np.random.default_rng(5)
+    forcefield.set_coordinates(obmol, rng.normal(scale=2.0, size=(20, 3)))
+    obFF, ff_name = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+
+    token = forcefield.CancellationToken()
+    token.cancel()
+    energy, converged, steps = forcefield.minimize(obFF, obmol, callback=token)
+    assert (converged, steps) == (False, 10)
+    assert token.reason == "it was cancelled"
+
+    token = forcefield.CancellationToken(time_budget=0.0)
+    assert forcefield.minimize(obFF, obmol, callback=token)[1:] == (False, 10)
+
+
+def test_checkpoint(tmp_path):
+    """A checkpoint is only read back for the same input."""
+    import numpy as np
+    from quickmin_step import forcefield
+
+    obmol = forcefield.obmol_from_text("CCO", "smi")
+    key = forcefield.Checkpoint.make_key(obmol, "MMFF94", 1000)
+    path = tmp_path / "checkpoint.npz"
+    assert forcefield.Checkpoint.load(path, key) is None
+
+    checkpoint = forcefield.Checkpoint(path, obmol, key)
+    xyz = np.arange(9.0).reshape(3, 3)
+    checkpoint.save(xyz, 42)
+    steps, coordinates = forcefield.Checkpoint.load(path, key)
+    assert steps == 42 and np.array_equal(coordinates, xyz)
+    other = forcefield.Checkpoint.make_key(obmol, "MMFF94", 2000)
+    assert forcefield.Checkpoint.load(path, other) is None
+
+    checkpoint.remove()
+    assert not path.exists()
+
+
+def test_trajectory(tmp_path):
+    """The frames saved during a minimization can be read back."""
+    import numpy as np
+    from quickmin_step import forcefield, Trajectory
+    from quickmin_step.trajectory import TrajectoryWriter
+
+    obmol = forcefield.obmol_from_text("CCCCCC", "smi")
+    obmol.AddHydrogens()
+    rng = np.random.default_rng(5)
+    forcefield.set_coordinates(obmol, rng.normal(scale=2.0, size=(20, 3)))
+    obFF, ff_name = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+
+    path = tmp_path / "trajectory.bin"
+    writer = TrajectoryWriter(path, obmol, 20, 100)
+    energy, converged, steps = forcefield.minimize(
+        obFF, obmol, n_steps=100, callback=writer
+    )
+    writer.close(steps, energy)
+
+    trajectory = Trajectory(path)
+    assert len(trajectory) == 6
+    assert list(trajectory.steps) == [0, 20, 40, 60, 80, 100]
+    assert np.isnan(trajectory.energies[0])
+    assert trajectory.energies[-1] == pytest.approx(energy)
+    assert np.allclose(trajectory[-1], forcefield.get_coordinates(obmol), atol=1e-4)
+
+    # Without the energies of the frames, only the final one has an energy
+    forcefield.set_coordinates(obmol, trajectory[0])
+    writer = TrajectoryWriter(path, obmol, 20, 100, energies=False)
+    energy, converged, steps = forcefield.minimize(
+        obFF, obmol, n_steps=100, callback=writer
+    )
+    writer.close(steps, energy)
+    trajectory = Trajectory(path)
+    assert len(trajectory) == 6
+    assert np.isnan(trajectory.energies[:-1]).all()
+    assert trajectory.energies[-1] == pytest.approx(energy)
+
+
+def test_phases():
+    """Each phase records its time, and the memory it allocates when tracing."""
+    import tracemalloc
+    from quickmin_step.profiling import Phases
+
+    phases = Phases()
+    tracemalloc.start()
+    try:
+        phases.start("small")
+        small = [0.0] * 1000
+        phases.start("large")
+        large = [[0.0] * 3 for _ in range(100000)]
+        phases.stop()
+    finally:
+        tracemalloc.stop()
+    del small, large
+
+    assert list(phases.timings) == ["small", "large"]
+    assert phases.traced_peaks["large"] > 5 * phases.traced_peaks["small"]
+    assert phases.peak_rss["large"] >= phases.peak_rss["small"]
+
+
+def test_array_sidecars(tmp_path):
+    """Arrays saved beside Results.json are read back memory-mapped."""
+    import json
+    import numpy as np
+    from quickmin_step.results import load_results, save_array
+
+    gradients = np.arange(12.0).reshape(4, 3)
+    reference = save_array(tmp_path, "gradients", gradients, "kJ/mol/Å")
+    assert reference == {
+        "path": "gradients.npy",
+        "shape": [4, 3],
+        "dtype": "<f8",
+        "units": "kJ/mol/Å",
+    }
+    (tmp_path / "Results.json").write_text(
+        json.dumps({"arrays": {"gradients": reference}})
+    )
+
+    results = load_results(tmp_path)
+    assert isinstance(results["gradients"], np.memmap)
+    assert np.array_equal(results["gradients"], gradients)
+
+
+def test_results_lines(tmp_path):
+    """Records are streamed as lines, and a partly written one is not read."""
+    import numpy as np
+    from quickmin_step import read_results_lines
+    from quickmin_step.results import ResultsWriter
+
+    path = tmp_path / "results.jsonl"
+    with ResultsWriter(path) as writer:
+        writer.write({"point": 1, "energy": np.float64(-1.5)})
+        writer.write({"point": 2, "gradients": np.zeros((2, 3))})
+        assert [r["point"] for r in read_results_lines(path)] == [1, 2]
+    with open(path, "a") as fd:
+        fd.write('{"point": 3, "ene')
+
+    records = list(read_results_lines(path))
+    assert records == [
+        {"point": 1, "energy": -1.5},
+        {"point": 2, "gradients": [[0.0] * 3] * 2},
+    ]
+
+
+def test_write_back():
+    """Coordinates and properties of many configurations are written together."""
+    import numpy as np
+    import molsystem
+    from quickmin_step.database import WriteBack
+
+    db = molsystem.SystemDB(filename="file:write_back?mode=memory&cache=shared")
+    system = db.create_system()
+    configuration = system.create_configuration()
+    configuration.from_smiles("CCO")
+    xyz = configuration.atoms.get_coordinates(fractionals=False, as_array=True)
+    copies = [system.copy_configuration(configuration) for _ in range(3)]
+
+    write_back = WriteBack(db)
+    for i, copy in enumerate(copies):
+        write_back.add(
+            copy, xyz + i, {"total energy#QuickMin#{model}": float(i)}, "MMFF94"
+        )
+    write_back.write()
+    assert not db.db.in_transaction
+
+    for i, copy in enumerate(copies):
+        new = copy.atoms.get_coordinates(fractionals=False, as_array=True)
+        assert np.allclose(new, xyz + i)
+        values = copy.properties.get("total energy#QuickMin#MMFF94")
+        assert values["total energy#QuickMin#MMFF94"]["value"] == i
+    assert np.allclose(
+        configuration.atoms.get_coordinates(fractionals=False, as_array=True), xyz
+    )
+
+
+def test_typing_cache(tmp_path):
+    """Cached typing is reused, but not by another forcefield or OpenBabel."""
+    from quickmin_step import forcefield
+
+    obmol = forcefield.obmol_from_text("CC(=O)O", "smi")
+    obmol.AddHydrogens()
+    cache = forcefield.TypingCache(tmp_path)
+    assert cache.get(obmol, "MMFF94") is None
+
+    atom_types, charges = forcefield.get_typing(obmol, "MMFF94", cache=cache)
+    assert atom_types[:4] == ["1", "3", "7", "6"]
+    cached = cache.get(obmol, "MMFF94")
+    assert cached[0] == atom_types and (cached[1] == charges).all()
+
+    assert cache.get(obmol, "GAFF") is None
+    # Typing read from a forcefield already set up is not cached
+    obFF, _ = forcefield.setup_forcefield(obmol, "GAFF", log_level=0)
+    forcefield.get_typing(obmol, "GAFF", obFF=obFF, cache=cache)
+    assert cache.get(obmol, "GAFF") is None
+    assert forcefield.TypingCache(tmp_path, version="0.0").get(obmol, "MMFF94") is None
+
+
+@pytest.mark.parametrize("parameters", [{"time budget": 0.0}, {"n_steps": 15}])
+def test_reported_steps(tmp_path, parameters):
+    """Stopped and unconverged runs report the steps actually taken."""
+    import molsystem
+    import seamm
+
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    db = molsystem.SystemDB(filename="file:reported_steps?mode=memory&cache=shared")
+    seamm.flowchart_variables = seamm.Variables()
+    seamm.flowchart_variables.set_variable("_system_db", db)
+    db.create_system().create_configuration().from_smiles("CCCCCCCC")
+
+    node = quickmin_step.QuickMin(flowchart=flowchart)
+    flowchart.add_node(node)
+    node._id = ("1",)
+    for key, value in parameters.items():
+        node.parameters[key].value = value
+    node.parameters["results"].value = {
+        "n steps": {"variable": "n_steps"},
+        "converged": {"variable": "converged"},
+    }
+    node.run()
+
+    expected = 10 if "time budget" in parameters else 15
+    assert seamm.flowchart_variables.get_variable("n_steps") == expected
+    assert seamm.flowchart_variables.get_variable("converged") is False
+    db.close()
+
+
+def test_hydrogens_only(tmp_path):
+    """Only the hydrogens move when optimizing the hydrogens only."""
+    import molsystem
+    import numpy as np
+    import seamm
+
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    db = molsystem.SystemDB(filename="file:hydrogens_only?mode=memory&cache=shared")
+    seamm.flowchart_variables = seamm.Variables()
+    seamm.flowchart_variables.set_variable("_system_db", db)
+    configuration = db.create_system().create_configuration()
+    configuration.from_smiles("CCCCO")
+    symbols = configuration.atoms.symbols
+    initial = np.array(configuration.atoms.get_coordinates(fractionals=False))
+
+    node = quickmin_step.QuickMin(flowchart=flowchart)
+    flowchart.add_node(node)
+    node._id = ("1",)
+    node.parameters["calculation"].value = "hydrogens only"
+    node.parameters["results"].value = {
+        "n mobile atoms": {"variable": "n_mobile"},
+    }
+    node.run()
+
+    final = np.array(configuration.atoms.get_coordinates(fractionals=False))
+    heavy = np.array([symbol != "H" for symbol in symbols])
+    assert final[heavy] == pytest.approx(initial[heavy], abs=1e-6)
+    assert np.abs(final[~heavy] - initial[~heavy]).max() > 1e-3
+    assert seamm.flowchart_variables.get_variable("n_mobile") == symbols.count("H")
+    db.close()
+
+
+@pytest.mark.parametrize("source", ["configurations", "npy", "streamed"])
+def test_energy_scan(tmp_path, source):
+    """The energies and gradients of the structures, however they are given."""
+    import molsystem
+    import numpy as np
+    import seamm
+    from quickmin_step import forcefield, read_results_lines
+
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    db = molsystem.SystemDB(filename="file:energy_scan?mode=memory&cache=shared")
+    seamm.flowchart_variables = seamm.Variables()
+    seamm.flowchart_variables.set_variable("_system_db", db)
+    system = db.create_system()
+    configuration = system.create_configuration()
+    configuration.from_smiles("CCCCO")
+
+    xyz = configuration.atoms.get_coordinates(fractionals=False, as_array=True)
+    rng = np.random.default_rng(5)
+    coordinates = np.array(
+        [xyz + rng.normal(scale=0.05, size=xyz.shape) for _ in range(3)]
+    )
+    obmol = configuration.to_OBMol()
+    obFF, _ = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+    expected, gradients = forcefield.energy_scan(
+        obFF, obmol, coordinates, gradients=True
+    )
+
+    node = quickmin_step.QuickMin(flowchart=flowchart)
+    flowchart.add_node(node)
+    node._id = ("1",)
+    node.parameters["calculation"].value = "energy scan"
+    node.parameters["forcefield"].value = "MMFF94"
+    node.parameters["scan gradients"].value = "yes"
+    if source == "configurations":
+        for xyz in coordinates:
+            new = system.copy_configuration(configuration)
+            new.atoms.set_coordinates(xyz, fractionals=False)
+        node.parameters["configurations"].value = "2-4"
+    else:
+        path = tmp_path / "scan.npy"
+        np.save(path, coordinates)
+        node.parameters["scan source"].value = "trajectory file"
+        node.parameters["trajectory file"].value = str(path)
+    if source == "streamed":
+        node.parameters["inline array limit"].value = 10
+    node.parameters["results"].value = {
+        "energies": {"variable": "energies"},
+        "scan gradients": {"variable": "gradients"},
+    }
+    node.run()
+
+    energies = seamm.flowchart_variables.get_variable("energies")
+    assert energies == pytest.approx(expected.tolist())
+    records = list(read_results_lines(tmp_path / "1" / "scan.jsonl"))
+    assert [record["point"] for record in records] == [1, 2, 3]
+    assert [record["energy"] for record in records] == pytest.approx(energies)
+    streamed = np.array([record["gradients"] for record in records])
+    assert streamed == pytest.approx(gradients)
+    if source == "streamed":
+        # Only in scan.jsonl, not held in memory
+        assert not seamm.flowchart_variables.exists("gradients")
+    else:
+        saved = np.array(seamm.flowchart_variables.get_variable("gradients"))
+        assert saved == pytest.approx(gradients)
+    db.close()
+
+
+def test_funnel_screening(tmp_path):
+    """The lowest structures are minimized fully, and all written back."""
+    import molsystem
+    import numpy as np
+    import seamm
+    from quickmin_step import forcefield, read_results_lines
+
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    db = molsystem.SystemDB(filename="file:funnel?mode=memory&cache=shared")
+    seamm.flowchart_variables = seamm.Variables()
+    seamm.flowchart_variables.set_variable("_system_db", db)
+    # MMFF94 cannot handle xenon
+    configurations = []
+    for smiles in ("CCCCCC", "CCO", "F[Xe]F", "OCCO"):
+        configurations.append(db.create_system().create_configuration())
+        configurations[-1].from_smiles(smiles)
+    initial = [
+        c.atoms.get_coordinates(fractionals=False, as_array=True)
+        for c in configurations
+    ]
+
+    node = quickmin_step.QuickMin(flowchart=flowchart)
+    flowchart.add_node(node)
+    node._id = ("1",)
+    node.parameters["calculation"].value = "funnel screening"
+    node.parameters["forcefield"].value = "MMFF94"
+    node.parameters["structures"].value = "all systems"
+    node.parameters["loose steps"].value = 5
+    node.parameters["tight selection"].value = "2"
+    node.parameters["number of processes"].value = 1
+    node.parameters["results"].value = {
+        "screening energies": {"variable": "energies"},
+        "screening tiers": {"variable": "tiers"},
+        "screening converged": {"variable": "converged"},
+    }
+    node.run()
+
+    energies = seamm.flowchart_variables.get_variable("energies")
+    tiers = seamm.flowchart_variables.get_variable("tiers")
+    converged = seamm.flowchart_variables.get_variable("converged")
+    assert tiers.count("tight") == 2 and tiers.count("loose") == 1
+    assert tiers[2] == "failed" and energies[2] is None and not converged[2]
+    # The tight tier are those lowest after the loose pass, and now converged
+    loose = {
+        record["structure"] - 1: record["energy"]
+        for record in read_results_lines(tmp_path / "1" / "funnel.jsonl")
+        if record["tier"] == "loose" and "error" not in record
+    }
+    lowest = sorted(loose, key=loose.get)[:2]
+    assert sorted(i for i, tier in enumerate(tiers) if tier == "tight") == sorted(
+        lowest
+    )
+    assert all(converged[i] for i in lowest)
+
+    for i, (c, tier) in enumerate(zip(configurations, tiers)):
+        xyz = c.atoms.get_coordinates(fractionals=False, as_array=True)
+        if tier == "failed":
+            assert xyz == pytest.approx(initial[i])
+            assert c.properties.get("total energy#QuickMin#MMFF94") == {}
+            continue
+        # The minimized structure and its energy are saved with the tier
+        obmol = c.to_OBMol()
+        obFF, _ = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+        E = forcefield.energy_scan(obFF, obmol, [xyz])[0][0]
+        assert E == pytest.approx(energies[i], abs=1e-3)
+        assert not np.allclose(xyz, initial[i])
+        properties = c.properties.get("total energy#QuickMin#MMFF94")
+        assert properties["total energy#QuickMin#MMFF94"]["value"] == pytest.approx(
+            energies[i]
+        )
+        value = c.properties.get("convergence tier#QuickMin#MMFF94")
+        assert value["convergence tier#QuickMin#MMFF94"]["value"] == tier
+    db.close()
+
+
+def test_server(tmp_path):
+    """A calculation on the server, with the setup reused the second time."""
+    import threading
+    import time
+    from openbabel import openbabel
+    from quickmin_step import forcefield
+    from quickmin_step.server import Client, Server, is_running
+
+    server = Server(directory=tmp_path, n_processes=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not is_running(tmp_path):
+            assert time.monotonic() < deadline, "The server did not start"
+            time.sleep(0.05)
+
+        obmol = forcefield.obmol_from_text("CCCCO", "smi")
+        obmol.AddHydrogens()
+        openbabel.OBBuilder().Build(obmol)
+        initial = forcefield.get_coordinates(obmol)
+        with Client(tmp_path) as client:
+            results = [client.calculate(obmol, "MMFF94") for _ in range(2)]
+    finally:
+        server.stop()
+        thread.join(timeout=30)
+    assert not thread.is_alive()
+
+    for result, cached in zip(results, (False, True)):
+        assert "error" not in result
+        assert result["cached"] is cached
+        assert result["converged"] is True
+        assert 0 < result["n steps"] <= 1000
+        assert result["coordinates"].shape == initial.shape
+        assert not (result["coordinates"] == initial).all()
+    assert results[1]["energy"] == pytest.approx(results[0]["energy"])
+
+
+def test_save_atom_data(tmp_path):
+    """The gradients, charges and atom types are stored on the atoms."""
+    import molsystem
+    import numpy as np
+    import seamm
+    from quickmin_step import forcefield
+
+    flowchart = seamm.Flowchart(directory=str(tmp_path))
+    db = molsystem.SystemDB(filename="file:atom_data?mode=memory&cache=shared")
+    seamm.flowchart_variables = seamm.Variables()
+    seamm.flowchart_variables.set_variable("_system_db", db)
+    configuration = db.create_system().create_configuration()
+    configuration.from_smiles("CC(=O)O")
+
+    node = quickmin_step.QuickMin(flowchart=flowchart)
+    flowchart.add_node(node)
+    node._id = ("1",)
+    node.parameters["forcefield"].value = "MMFF94"
+    node.parameters["save atom data"].value = "yes"
+    node.run()
+
+    # The same as from the forcefield at the minimized structure
+    obmol = configuration.to_OBMol()
+    obFF, _ = forcefield.setup_forcefield(obmol, "MMFF94", log_level=0)
+    obFF.Energy(True)
+    gradients = forcefield.get_gradients(obFF, obmol)
+    atom_types, charges = forcefield.get_typing(obmol, "MMFF94", obFF=obFF)
+
+    atoms = configuration.atoms
+    assert atoms.have_gradients
+    saved = np.array(atoms.get_gradients(fractionals=False))
+    assert saved == pytest.approx(gradients, abs=1e-4)
+    assert atoms["charges_MMFF94"] == pytest.approx(charges.tolist())
+    assert atoms["atom_types_MMFF94"] == atom_types
+    assert atom_types[:4] == ["1", "3", "7", "6"]
+    db.close()
+
+
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_unreadable_molecule(n_processes):
+    """A molecule that cannot be read gets an error, and the rest are minimized."""
+    from quickmin_step import forcefield, parallel
+
+    obmol = forcefield.obmol_from_text("CCO", "smi")
+    obmol.AddHydrogens()
+    text = forcefield.obmol_to_text(obmol)
+
+    results = parallel.minimize_molecules(
+        [text, "not a molecule", text], "MMFF94", n_processes=n_processes
+    )
+    assert "error" in results[1]
+    assert results[0]["energy"] == pytest.approx(results[2]["energy"])